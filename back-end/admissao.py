@@ -0,0 +1,161 @@
+import json
+import math
+import time
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+
+class Sobrecarga(Exception):
+    """Pedido recusado por falta de capacidade; `espera` é o Retry-After sugerido (segundos)"""
+
+    def __init__(self, espera: float):
+        super().__init__(f"Servidor sobrecarregado, tente novamente em {espera:.0f}s")
+        self.espera = espera
+
+
+class ControleAdmissao:
+    """Limita os pedidos em atendimento e os que aguardam vaga.
+
+    Até `max_em_andamento` pedidos são atendidos ao mesmo tempo e até `max_fila`
+    esperam no máximo `espera_maxima` segundos por uma vaga; o resto é recusado
+    na hora, em vez de todos ficarem lentos.
+    """
+
+    def __init__(self, max_em_andamento: int = 32, max_fila: int = 64, espera_maxima: float = 2.0):
+        self.max_em_andamento = max_em_andamento
+        self.max_fila = max_fila
+        self.espera_maxima = espera_maxima
+        self.em_andamento = 0
+        self.na_fila = 0
+        self.admitidos = 0
+        self.recusados = 0
+        self.duracao_media = 1.0  # média móvel do tempo de atendimento (segundos)
+        self._semaforo = asyncio.Semaphore(max_em_andamento)
+
+    def esperaSugerida(self) -> float:
+        """Tempo estimado até a fila atual ser atendida"""
+        return max(1.0, self.duracao_media * (self.na_fila + 1) / self.max_em_andamento)
+
+    @asynccontextmanager
+    async def admitir(self):
+        if self._semaforo.locked():
+            if self.na_fila >= self.max_fila:
+                self.recusados += 1
+                raise Sobrecarga(self.esperaSugerida())
+            self.na_fila += 1
+            try:
+                await asyncio.wait_for(self._semaforo.acquire(), self.espera_maxima)
+            except asyncio.TimeoutError:
+                self.recusados += 1
+                raise Sobrecarga(self.esperaSugerida())
+            finally:
+                self.na_fila -= 1
+        else:
+            await self._semaforo.acquire()
+
+        self.admitidos += 1
+        self.em_andamento += 1
+        inicio = time.monotonic()
+        try:
+            yield
+        finally:
+            self.em_andamento -= 1
+            self._semaforo.release()
+            self.duracao_media = 0.9 * self.duracao_media + 0.1 * (time.monotonic() - inicio)
+
+    def estatisticas(self) -> Dict:
+        return {
+            "em_andamento": self.em_andamento,
+            "na_fila": self.na_fila,
+            "max_em_andamento": self.max_em_andamento,
+            "max_fila": self.max_fila,
+            "admitidos": self.admitidos,
+            "recusados": self.recusados,
+            "duracao_media_s": round(self.duracao_media, 3),
+        }
+
+
+class LimitadorTaxa:
+    """Token bucket por chave (usuário do JWT ou IP): `taxa` pedidos/s com rajadas de até `rajada`"""
+
+    def __init__(self, taxa: float = 1.0, rajada: int = 10, max_chaves: int = 10000):
+        self.taxa = taxa
+        self.rajada = rajada
+        self.max_chaves = max_chaves
+        self.limitados = 0
+        self._baldes: "OrderedDict[str, list]" = OrderedDict()  # chave -> [fichas, último abastecimento]
+
+    def permitir(self, chave: str) -> Tuple[bool, float]:
+        """(permitido, segundos até a próxima ficha)"""
+        agora = time.monotonic()
+        balde = self._baldes.get(chave)
+        if balde is None:
+            balde = self._baldes[chave] = [float(self.rajada), agora]
+            if len(self._baldes) > self.max_chaves:
+                self._baldes.popitem(last=False)
+        else:
+            self._baldes.move_to_end(chave)
+            balde[0] = min(self.rajada, balde[0] + (agora - balde[1]) * self.taxa)
+            balde[1] = agora
+
+        if balde[0] >= 1:
+            balde[0] -= 1
+            return True, 0.0
+        self.limitados += 1
+        return False, (1 - balde[0]) / self.taxa
+
+    def estatisticas(self) -> Dict:
+        return {"taxa_por_segundo": self.taxa, "rajada": self.rajada, "chaves": len(self._baldes),
+                "limitados": self.limitados}
+
+
+class MiddlewareAdmissao:
+    """Middleware ASGI que aplica o limite por usuário e o controle de admissão às rotas de resposta.
+
+    Fica no nível ASGI (e não numa dependência) para que a vaga só seja liberada
+    quando a resposta terminar de ser enviada, inclusive no streaming.
+    """
+
+    def __init__(self, app, controle: ControleAdmissao, limitador: LimitadorTaxa, caminhos: Iterable[str],
+                 identificar: Callable[[Dict[str, str], Optional[str]], str]):
+        self.app = app
+        self.controle = controle
+        self.limitador = limitador
+        self.caminhos = set(caminhos)
+        self.identificar = identificar
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.caminhos or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        cabecalhos = {nome.decode("latin-1").lower(): valor.decode("latin-1") for nome, valor in scope["headers"]}
+        cliente = scope.get("client")
+        chave = self.identificar(cabecalhos, cliente[0] if cliente else None)
+
+        permitido, espera = self.limitador.permitir(chave)
+        if not permitido:
+            await self._recusar(send, 429, "Muitas perguntas em sequência. Aguarde um pouco.", espera)
+            return
+
+        try:
+            async with self.controle.admitir():
+                await self.app(scope, receive, send)
+        except Sobrecarga as e:
+            await self._recusar(send, 503, "Servidor sobrecarregado. Tente novamente em instantes.", e.espera)
+
+    @staticmethod
+    async def _recusar(send, status: int, detalhe: str, espera: float) -> None:
+        corpo = json.dumps({"detail": detalhe}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(corpo)).encode()),
+                (b"retry-after", str(math.ceil(espera)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": corpo})
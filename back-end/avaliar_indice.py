@@ -0,0 +1,86 @@
+import argparse
+import time
+import numpy as np
+from indice import IndiceVetorial, IndiceIVF, normalizarVetores, lerEmbedding
+
+# Relatório de recall x latência do índice IVF em comparação com a busca exata.
+# Uso:
+#   python avaliar_indice.py --sintetico 200000
+#   python avaliar_indice.py --mongo            (usa os embeddings da base real)
+
+
+def gerarBaseSintetica(total: int, dimensao: int = 384, grupos: int = 500, semente: int = 0) -> np.ndarray:
+    """Vetores agrupados em torno de centros aleatórios, imitando embeddings de frases"""
+    gerador = np.random.default_rng(semente)
+    centros = gerador.normal(size=(grupos, dimensao)).astype(np.float32)
+    rotulos = gerador.integers(0, grupos, size=total)
+    ruido = gerador.normal(scale=0.6, size=(total, dimensao)).astype(np.float32)
+    return normalizarVetores(centros[rotulos] + ruido)
+
+
+def carregarBaseMongo() -> np.ndarray:
+    from database import colecao_conhecimento
+
+    vetores = [lerEmbedding(doc.get("embedding")) for doc in colecao_conhecimento.find({}, {"embedding": 1})]
+    vetores = [vetor for vetor in vetores if vetor is not None]
+    return normalizarVetores(vetores)
+
+
+def gerarConsultas(base: np.ndarray, total: int, semente: int = 1) -> np.ndarray:
+    """Consultas próximas de documentos existentes, como paráfrases de perguntas já cadastradas"""
+    gerador = np.random.default_rng(semente)
+    escolhidos = base[gerador.choice(len(base), total, replace=False)]
+    ruido = gerador.normal(scale=0.03, size=escolhidos.shape).astype(np.float32)
+    return normalizarVetores(escolhidos + ruido)
+
+
+def medir(indice, consultas, k, **parametros):
+    latencias, resultados = [], []
+    for consulta in consultas:
+        inicio = time.perf_counter()
+        encontrados = indice.buscar(consulta, k=k, limiar=-1.0, **parametros)
+        latencias.append((time.perf_counter() - inicio) * 1000)
+        resultados.append({doc["_id"] for doc, _ in encontrados})
+    return resultados, np.array(latencias)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall x latência do índice IVF")
+    origem = parser.add_mutually_exclusive_group()
+    origem.add_argument("--sintetico", type=int, default=100000, help="quantidade de vetores sintéticos")
+    origem.add_argument("--mongo", action="store_true", help="usar os embeddings da base de conhecimento")
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--listas", type=int, nargs="+", default=[0])
+    parser.add_argument("--sondagens", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    base = carregarBaseMongo() if args.mongo else gerarBaseSintetica(args.sintetico)
+    documentos = [{"_id": i} for i in range(len(base))]
+    consultas = gerarConsultas(base, min(args.consultas, len(base)))
+    print(f"[INFO] Base com {len(base)} vetores de dimensão {base.shape[1]}, {len(consultas)} consultas, k={args.k}")
+
+    exato = IndiceVetorial()
+    exato.construir(documentos, base)
+    referencia, latencias = medir(exato, consultas, args.k)
+    print(f"\n{'modo':<22}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    print(f"{'exato':<22}{1.0:>10.3f}{np.percentile(latencias, 50):>10.3f}{np.percentile(latencias, 95):>10.3f}")
+
+    for n_listas in args.listas:
+        ivf = IndiceIVF(n_listas=n_listas, minimo_documentos=0)
+        inicio = time.perf_counter()
+        ivf.construir(documentos, base)
+        total_listas = len(ivf._estado.centroides)
+        print(f"\n[INFO] IVF com {total_listas} listas treinado em {time.perf_counter() - inicio:.1f}s")
+
+        for n_sondagens in args.sondagens:
+            if n_sondagens > total_listas:
+                continue
+            encontrados, latencias = medir(ivf, consultas, args.k, n_sondagens=n_sondagens)
+            recall = np.mean([len(a & b) / max(len(b), 1) for a, b in zip(encontrados, referencia)])
+            modo = f"ivf sondagens={n_sondagens}"
+            print(f"{modo:<22}{recall:>10.3f}{np.percentile(latencias, 50):>10.3f}{np.percentile(latencias, 95):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+import numpy as np
+
+# Benchmark de ponta a ponta do pipeline RAG, sem rede: MongoDB em memória (mongomock),
+# servidor falso do Gemini (REST, via GEMINI_API_ENDPOINT) com latência configurável e
+# bases sintéticas geradas no formato do mensagens_rag.xml.
+# Uso:
+#   python benchmark.py                                    (1k/10k/100k, modelo de embeddings real em cache)
+#   python benchmark.py --tamanhos 1000 --embedding falso  (sem torch: vetores determinísticos por termo)
+#   python benchmark.py --comparar resultados_benchmark/<commit anterior>.json
+#   python benchmark.py --servir-gemini --porta 8765       (só o servidor falso, para testar com o uvicorn)
+# Os resultados vão para resultados_benchmark/<commit>_<data>.json.
+
+ARQUIVO_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mensagens_rag.xml")
+PASTA_RESULTADOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resultados_benchmark")
+USUARIO_BENCHMARK = {"email": "benchmark@tekbot.local", "senha": "benchmark123"}
+
+PREFIXOS = ["", "Como resolver", "O que significa", "Erro ao emitir nota:", "Cliente relatou", "Dúvida sobre"]
+CONTEXTOS = ["na filial", "na série 2", "em homologação", "em produção", "no MDF-e", "após atualização"]
+
+
+# === Servidor falso do Gemini ===
+
+def respostaFalsa(tamanho: int) -> str:
+    return " ".join(["Verifique o cadastro fiscal e transmita novamente a nota."] * max(1, tamanho // 10))
+
+
+def servirGeminiFalso(porta: int, latencia_ms: float, variacao_ms: float, tamanho_resposta: int,
+                      trechos: int = 4) -> None:
+    """Atende generateContent e streamGenerateContent da API REST v1beta com latência simulada"""
+
+    class Manipulador(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            time.sleep(max(0.0, random.gauss(latencia_ms, variacao_ms)) / 1000)
+            texto = respostaFalsa(tamanho_resposta)
+
+            if ":streamGenerateContent" not in self.path:
+                self._enviar(200, json.dumps(self._candidato(texto)).encode(), "application/json")
+                return
+
+            # Streaming: SSE (alt=sse) ou um array JSON enviado aos poucos (alt=json, padrão do REST)
+            palavras = texto.split(" ")
+            passo = max(1, len(palavras) // trechos)
+            partes = [" ".join(palavras[i:i + passo]) + " " for i in range(0, len(palavras), passo)]
+            sse = "alt=sse" in self.path
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream" if sse else "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for posicao, parte in enumerate(partes):
+                corpo = json.dumps(self._candidato(parte))
+                if sse:
+                    bloco = f"data: {corpo}\r\n\r\n"
+                else:
+                    bloco = ("[" if posicao == 0 else ",") + corpo + ("]" if posicao == len(partes) - 1 else "")
+                dados = bloco.encode()
+                self.wfile.write(f"{len(dados):X}\r\n".encode() + dados + b"\r\n")
+                self.wfile.flush()
+                time.sleep(latencia_ms / 1000 / max(1, len(partes)) / 4)
+            self.wfile.write(b"0\r\n\r\n")
+
+        @staticmethod
+        def _candidato(texto: str) -> Dict:
+            return {
+                "candidates": [{"content": {"parts": [{"text": texto}], "role": "model"},
+                                "finishReason": "STOP", "index": 0}],
+                "usageMetadata": {"promptTokenCount": 200, "candidatesTokenCount": len(texto) // 4},
+            }
+
+        def _enviar(self, status: int, corpo: bytes, tipo: str):
+            self.send_response(status)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", porta), Manipulador)
+    servidor.daemon_threads = True
+    servidor.serve_forever()
+
+
+# === Base de conhecimento sintética ===
+
+def lerParesBase(caminho: str = ARQUIVO_BASE) -> List[Dict]:
+    raiz = ET.parse(caminho).getroot()
+    return [
+        {"pergunta": item.findtext("pergunta").strip(), "resposta": item.findtext("resposta").strip()}
+        for item in raiz.iter("mensagem") if item.findtext("pergunta") and item.findtext("resposta")
+    ]
+
+
+def gerarXmlSintetico(total: int, caminho: str, semente: int = 0) -> None:
+    """Gera `total` mensagens no formato do mensagens_rag.xml variando as entradas reais"""
+    gerador = random.Random(semente)
+    pares = lerParesBase()
+    raiz = ET.Element("mensagens")
+    for i in range(total):
+        par, variacao = pares[i % len(pares)], i // len(pares)
+        pergunta = par["pergunta"]
+        if variacao:
+            # Códigos de rejeição diferentes por variação, para o índice de chaves crescer junto
+            codigo = 100 + (variacao * 7 + i) % 900
+            pergunta = pergunta.replace(pergunta.split(":")[0], f"Rejeição {codigo}", 1) if ":" in pergunta else pergunta
+            pergunta = f"{gerador.choice(PREFIXOS)} {pergunta} {gerador.choice(CONTEXTOS)} #{variacao}".strip()
+        mensagem = ET.SubElement(raiz, "mensagem")
+        ET.SubElement(mensagem, "pergunta").text = pergunta
+        ET.SubElement(mensagem, "resposta").text = f"{par['resposta']} (caso {variacao})" if variacao else par["resposta"]
+    ET.ElementTree(raiz).write(caminho, encoding="utf-8", xml_declaration=True)
+
+
+def iterarXml(caminho: str):
+    contexto = ET.iterparse(caminho, events=("end",))
+    for _, item in contexto:
+        if item.tag == "mensagem":
+            yield {"pergunta": item.findtext("pergunta"), "resposta": item.findtext("resposta")}
+            item.clear()
+
+
+class ModeloEmbeddingFalso:
+    """Vetores determinísticos: soma de vetores aleatórios fixos por termo (sem torch e sem download)"""
+
+    def __init__(self, dimensao: int = 384):
+        from lexico import tokenizar
+
+        self.dimensao = dimensao
+        self.tokenizar = tokenizar
+        self._termos: Dict[str, np.ndarray] = {}
+
+    def _vetor(self, termo: str) -> np.ndarray:
+        vetor = self._termos.get(termo)
+        if vetor is None:
+            vetor = np.random.default_rng(zlib.crc32(termo.encode())).normal(size=self.dimensao).astype(np.float32)
+            self._termos[termo] = vetor
+        return vetor
+
+    def encode(self, textos, **_):
+        saida = np.zeros((len(textos), self.dimensao), dtype=np.float32)
+        for i, texto in enumerate(textos):
+            for termo in self.tokenizar(texto):
+                saida[i] += self._vetor(termo)
+        return saida
+
+
+# === Medição ===
+
+class MonitorMemoria:
+    """Amostra o RSS do processo em segundo plano e guarda o pico desde o último `reiniciar`"""
+
+    def __init__(self, intervalo: float = 0.05):
+        self.intervalo = intervalo
+        self.pico = self.atual()
+        threading.Thread(target=self._executar, daemon=True).start()
+
+    @staticmethod
+    def atual() -> float:
+        try:
+            with open("/proc/self/status") as arquivo:
+                for linha in arquivo:
+                    if linha.startswith("VmRSS:"):
+                        return int(linha.split()[1]) / 1024
+        except OSError:
+            pass
+        import resource  # fora do Linux: pico do processo inteiro (ru_maxrss em KB no Linux, bytes no macOS)
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024
+
+    def reiniciar(self) -> None:
+        self.pico = self.atual()
+
+    def _executar(self) -> None:
+        while True:
+            self.pico = max(self.pico, self.atual())
+            time.sleep(self.intervalo)
+
+
+def resumirLatencias(latencias_ms: List[float]) -> Dict:
+    if not latencias_ms:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "media_ms": None, "max_ms": None}
+    valores = np.asarray(latencias_ms)
+    return {
+        "p50_ms": round(float(np.percentile(valores, 50)), 3),
+        "p95_ms": round(float(np.percentile(valores, 95)), 3),
+        "p99_ms": round(float(np.percentile(valores, 99)), 3),
+        "media_ms": round(float(valores.mean()), 3),
+        "max_ms": round(float(valores.max()), 3),
+    }
+
+
+async def executarCenario(cliente, caminho: str, gerarCorpo: Callable[[int], Dict], concorrencia: int,
+                          total: int, cabecalhos: Optional[Dict] = None) -> Dict:
+    latencias, status = [], {}
+    proximos = iter(range(total))
+
+    async def trabalhador():
+        for i in proximos:
+            inicio = time.perf_counter()
+            resposta = await cliente.post(caminho, json=gerarCorpo(i), headers=cabecalhos)
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            status[resposta.status_code] = status.get(resposta.status_code, 0) + 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabalhador() for _ in range(concorrencia)))
+    duracao = time.perf_counter() - inicio
+    return {
+        **resumirLatencias(latencias),
+        "requisicoes": total,
+        "erros": sum(quantidade for codigo, quantidade in status.items() if codigo >= 400),
+        "status": {str(codigo): quantidade for codigo, quantidade in sorted(status.items())},
+        "vazao_rps": round(total / duracao, 2),
+    }
+
+
+# === Preparação do ambiente ===
+
+def prepararAmbiente(args):
+    """Configura o ambiente e importa a aplicação já apontada para os substitutos locais"""
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit("[ERRO] O benchmark usa o mongomock como MongoDB em memória: pip install mongomock")
+    import pymongo
+
+    os.environ.update({
+        "GEMINI_API_KEY": "benchmark",
+        "GEMINI_API_ENDPOINT": f"http://127.0.0.1:{args.porta}",
+        "MONGO_BANCO": "tekbot_benchmark",
+        # O benchmark mede o pipeline, não os limites de admissão
+        "LIMITE_TAXA_POR_SEGUNDO": "1000000",
+        "LIMITE_TAXA_RAJADA": "1000000",
+        "ADMISSAO_MAX_EM_ANDAMENTO": str(max(args.concorrencias) * 2),
+        "ADMISSAO_MAX_FILA": str(max(args.concorrencias) * 2),
+    })
+    pymongo.MongoClient = mongomock.MongoClient
+
+    # O mongomock não aceita o argumento `sort` que o UpdateOne do pymongo 4.9+ repassa ao bulk_write
+    def bulkWriteCompativel(colecao, operacoes, ordered=True, **_):
+        for operacao in operacoes:
+            colecao.update_one(operacao._filter, operacao._doc, upsert=operacao._upsert)
+    mongomock.Collection.bulk_write = bulkWriteCompativel
+
+    import rag
+    import main
+
+    if args.embedding == "falso":
+        rag.servico_embedding.carregar_modelo = ModeloEmbeddingFalso
+
+    # O motor não fala com o mongomock: a carga inicial usa a coleção síncrona
+    async def carregarIndiceSincrono():
+        return await asyncio.get_running_loop().run_in_executor(rag.executor_embedding, rag.carregarIndice)
+    main.carregarIndiceAsync = carregarIndiceSincrono
+    return rag, main
+
+
+def popularBase(rag, total: int, pasta: str, tamanho_lote: int = 512) -> Dict:
+    from bson import ObjectId
+    from indice import empacotarEmbedding, textoIndexado
+    from chaves import extrairChaves
+
+    caminho = os.path.join(pasta, f"base_{total}.xml")
+    inicio = time.perf_counter()
+    gerarXmlSintetico(total, caminho)
+    tempo_xml = time.perf_counter() - inicio
+
+    rag.colecao_conhecimento.delete_many({})
+    modelo = rag.servico_embedding.modelo
+    inicio, lote = time.perf_counter(), []
+
+    def gravar(lote):
+        vetores = modelo.encode([textoIndexado(doc) for doc in lote])
+        agora = datetime.now(timezone.utc)
+        rag.colecao_conhecimento.insert_many([
+            {**doc, "_id": ObjectId(), "embedding": empacotarEmbedding(vetor), "chaves": extrairChaves(doc["pergunta"]),
+             "atualizado_em": agora}
+            for doc, vetor in zip(lote, vetores)
+        ])
+
+    for doc in iterarXml(caminho):
+        lote.append(doc)
+        if len(lote) >= tamanho_lote:
+            gravar(lote)
+            lote = []
+    if lote:
+        gravar(lote)
+    tempo_insercao = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    rag.carregarIndice()
+    rag.cache_respostas.limpar()
+    return {"geracao_xml_s": round(tempo_xml, 3), "insercao_s": round(tempo_insercao, 3),
+            "carga_indice_s": round(time.perf_counter() - inicio, 3)}
+
+
+def perguntasDeTeste(rag, total: int, semente: int = 1) -> List[str]:
+    """Metade cita o código (caminho exato por chave), metade só descreve o problema (busca + Gemini)"""
+    gerador = random.Random(semente)
+    perguntas = [doc["pergunta"] for doc in rag.colecao_conhecimento.aggregate([{"$sample": {"size": total}}])]
+    saida = []
+    for i, pergunta in enumerate(perguntas):
+        descricao = pergunta.split(":", 1)[-1].strip()
+        saida.append(pergunta if i % 2 == 0 else f"{gerador.choice(PREFIXOS[1:])} {descricao.lower()}?")
+    return saida
+
+
+def medirEtapas(rag, perguntas: List[str]) -> Dict:
+    """Tempo de cada etapa do pipeline, uma pergunta por vez"""
+    etapas = {nome: [] for nome in ("chave", "embedding", "busca", "prompt", "gemini", "registro")}
+
+    def medir(nome, funcao, *parametros):
+        inicio = time.perf_counter()
+        resultado = funcao(*parametros)
+        etapas[nome].append((time.perf_counter() - inicio) * 1000)
+        return resultado
+
+    for pergunta in perguntas:
+        sessao = rag.GerenciadorContexto(efemera=True)
+        if medir("chave", rag.responderPorChave, pergunta, sessao):
+            continue
+        embedding = medir("embedding", rag.servico_embedding.codificar, [pergunta])[0]
+        resultados, _ = medir("busca", rag.recuperarComPontuacao, pergunta, embedding, sessao)
+        contexto = [doc for doc, _ in resultados]
+        prompt = medir("prompt", rag.montarPrompt, contexto, pergunta, "", sessao)
+        resposta = medir("gemini", rag.cliente_ia.gerar, prompt)
+        medir("registro", rag.registrarInteracao, pergunta, resposta, contexto, sessao)
+    return {nome: {**resumirLatencias(valores), "amostras": len(valores)} for nome, valores in etapas.items()}
+
+
+# === Execução ===
+
+async def executar(args) -> Dict:
+    import httpx
+
+    processo_gemini = multiprocessing.Process(
+        target=servirGeminiFalso, args=(args.porta, args.latencia_gemini_ms, args.variacao_gemini_ms, args.tamanho_resposta),
+        daemon=True,
+    )
+    processo_gemini.start()
+
+    rag, main = prepararAmbiente(args)
+    import bcrypt
+    rag.colecao_conhecimento.database["usuarios"].insert_one({
+        "email": USUARIO_BENCHMARK["email"],
+        "senha": bcrypt.hashpw(USUARIO_BENCHMARK["senha"].encode(), bcrypt.gensalt()).decode(),
+    })
+
+    monitor = MonitorMemoria()
+    resultado = {"boot": {}, "bases": [], "cenarios": [], "etapas": []}
+    main.gravador_interacoes.iniciar()
+    await main.inicializar()
+    main.sincronizador_indice.parar()  # o benchmark recarrega o índice sozinho a cada base
+    resultado["boot"] = main.estado_inicializacao
+
+    endpoints = {
+        "/ia/responder": lambda perguntas: lambda i: {"pergunta": perguntas[i % len(perguntas)]},
+        "/pergunta": lambda perguntas: lambda i: {"pergunta": perguntas[i % len(perguntas)]},
+        "/mensagens": lambda perguntas: lambda i: {"texto": f"Anotação de suporte {i}: {perguntas[i % len(perguntas)]}"},
+        "/login": lambda perguntas: lambda i: USUARIO_BENCHMARK,
+    }
+
+    with tempfile.TemporaryDirectory() as pasta:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://benchmark",
+                                     timeout=120) as cliente:
+            for tamanho in args.tamanhos:
+                print(f"[INFO] Base sintética com {tamanho} entradas...")
+                monitor.reiniciar()
+                carga = popularBase(rag, tamanho, pasta)
+                resultado["bases"].append({"tamanho_base": tamanho, **carga, "rss_pico_mb": round(monitor.pico, 1)})
+                print(f"[OK] {carga}")
+
+                perguntas = perguntasDeTeste(rag, max(args.requisicoes, args.amostras_etapas))
+                monitor.reiniciar()
+                for etapa, valores in medirEtapas(rag, perguntas[:args.amostras_etapas]).items():
+                    resultado["etapas"].append({"tamanho_base": tamanho, "etapa": etapa, **valores})
+
+                for caminho, fabrica in endpoints.items():
+                    if args.endpoints and caminho not in args.endpoints:
+                        continue
+                    for concorrencia in args.concorrencias:
+                        rag.cache_respostas.limpar()
+                        monitor.reiniciar()
+                        total = args.requisicoes_login if caminho == "/login" else args.requisicoes
+                        medida = await executarCenario(cliente, caminho, fabrica(perguntas), concorrencia, total)
+                        medida["rss_pico_mb"] = round(monitor.pico, 1)
+                        resultado["cenarios"].append({"tamanho_base": tamanho, "endpoint": caminho,
+                                                      "concorrencia": concorrencia, **medida})
+                        print(f"[OK] {tamanho:>7} {caminho:<14} c={concorrencia:<3} p50={medida['p50_ms']}ms "
+                              f"p95={medida['p95_ms']}ms p99={medida['p99_ms']}ms {medida['vazao_rps']} req/s "
+                              f"erros={medida['erros']} rss={medida['rss_pico_mb']}MB")
+
+    main.gravador_interacoes.parar()
+    processo_gemini.terminate()
+    return resultado
+
+
+def commitAtual() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or "desconhecido"
+    except OSError:
+        return "desconhecido"
+
+
+def comparar(atual: Dict, anterior: Dict) -> None:
+    """Variação do p95 e da vazão em relação a um resultado anterior"""
+    print(f"\nComparação com {anterior.get('commit')} ({anterior.get('data')}):")
+    chave = lambda c: (c["tamanho_base"], c["endpoint"], c["concorrencia"])
+    antigos = {chave(c): c for c in anterior.get("cenarios", [])}
+    for cenario in atual["cenarios"]:
+        antigo = antigos.get(chave(cenario))
+        if not antigo or not antigo["p95_ms"] or not cenario["p95_ms"]:
+            continue
+        variacao = (cenario["p95_ms"] - antigo["p95_ms"]) / antigo["p95_ms"] * 100
+        alerta = "  <-- regressão" if variacao > 10 else ""
+        print(f"{cenario['tamanho_base']:>7} {cenario['endpoint']:<14} c={cenario['concorrencia']:<3} "
+              f"p95 {antigo['p95_ms']} -> {cenario['p95_ms']}ms ({variacao:+.1f}%) "
+              f"vazão {antigo['vazao_rps']} -> {cenario['vazao_rps']} req/s{alerta}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de latência do pipeline RAG com substitutos locais")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--concorrencias", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requisicoes", type=int, default=200, help="requisições por cenário")
+    parser.add_argument("--requisicoes-login", type=int, default=50, help="o bcrypt torna o /login bem mais lento")
+    parser.add_argument("--amostras-etapas", type=int, default=100)
+    parser.add_argument("--endpoints", nargs="+", help="padrão: /ia/responder /pergunta /mensagens /login")
+    parser.add_argument("--embedding", choices=["real", "falso"], default="real")
+    parser.add_argument("--latencia-gemini-ms", type=float, default=800)
+    parser.add_argument("--variacao-gemini-ms", type=float, default=200)
+    parser.add_argument("--tamanho-resposta", type=int, default=120, help="palavras na resposta do Gemini falso")
+    parser.add_argument("--porta", type=int, default=8765)
+    parser.add_argument("--saida", help=f"arquivo JSON (padrão: {PASTA_RESULTADOS}/<commit>_<data>.json)")
+    parser.add_argument("--comparar", help="resultado anterior para comparar")
+    parser.add_argument("--servir-gemini", action="store_true", help="só sobe o servidor falso do Gemini")
+    args = parser.parse_args()
+
+    if args.servir_gemini:
+        print(f"[INFO] Gemini falso em http://127.0.0.1:{args.porta} (latência {args.latencia_gemini_ms}ms)")
+        servirGeminiFalso(args.porta, args.latencia_gemini_ms, args.variacao_gemini_ms, args.tamanho_resposta)
+        return
+
+    resultado = {
+        "commit": commitAtual(),
+        "data": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "parametros": {chave: valor for chave, valor in vars(args).items() if chave not in ("saida", "comparar")},
+        "ambiente": {"python": platform.python_version(), "plataforma": platform.platform(), "cpus": os.cpu_count()},
+        **asyncio.run(executar(args)),
+    }
+
+    saida = args.saida or os.path.join(
+        PASTA_RESULTADOS, f"{resultado['commit']}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+    with open(saida, "w", encoding="utf-8") as arquivo:
+        json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+    print(f"[OK] Resultados salvos em {saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as arquivo:
+            comparar(resultado, json.load(arquivo))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+from indice import normalizarVetores
+
+
+class CacheSemantico:
+    """Cache das respostas geradas pela IA, indexado pelo embedding da pergunta.
+
+    Perguntas com similaridade acima de `limiar` a uma pergunta já respondida
+    reaproveitam a resposta. As entradas expiram após `ttl_segundos`, a mais
+    antiga sem uso sai quando a capacidade é atingida (LRU) e toda entrada que
+    usou um documento alterado da base é descartada.
+    """
+
+    def __init__(self, limiar: float = 0.95, ttl_segundos: float = 3600, capacidade: int = 1000):
+        self.limiar = limiar
+        self.ttl_segundos = ttl_segundos
+        self.capacidade = capacidade
+        self.acertos = 0
+        self.falhas = 0
+        self.invalidacoes = 0
+        self._matriz: Optional[np.ndarray] = None  # uma linha por posição ocupável do cache
+        self._ativos = np.zeros(capacidade, dtype=bool)
+        self._entradas: "OrderedDict[int, Dict]" = OrderedDict()  # posição -> entrada, da menos para a mais recente
+        self._livres: List[int] = list(range(capacidade - 1, -1, -1))
+        self._por_documento: Dict[str, set] = {}
+        self._trava = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+    def buscar(self, vetor) -> Optional[str]:
+        """Devolve a resposta em cache para uma pergunta semelhante, se houver"""
+        vetor = normalizarVetores(vetor)[0]
+        with self._trava:
+            if not self._entradas:
+                self.falhas += 1
+                return None
+
+            pontuacoes = np.where(self._ativos, self._matriz @ vetor, -np.inf)
+            posicao = int(np.argmax(pontuacoes))
+            if pontuacoes[posicao] < self.limiar:
+                self.falhas += 1
+                return None
+
+            entrada = self._entradas[posicao]
+            if time.monotonic() - entrada["criado_em"] > self.ttl_segundos:
+                self._descartar(posicao)
+                self.falhas += 1
+                return None
+
+            self._entradas.move_to_end(posicao)
+            self.acertos += 1
+            return entrada["resposta"]
+
+    def guardar(self, pergunta: str, vetor, resposta: str, ids_documentos: Iterable = ()) -> None:
+        """Armazena a resposta gerada e os documentos da base em que ela se apoiou"""
+        if self.capacidade <= 0:  # cache desligado
+            return
+        vetor = normalizarVetores(vetor)[0]
+        ids_documentos = {str(id_documento) for id_documento in ids_documentos}
+        with self._trava:
+            if self._matriz is None or self._matriz.shape[1] != len(vetor):
+                self._matriz = np.zeros((self.capacidade, len(vetor)), dtype=np.float32)
+                self._limpar()
+            if not self._livres:
+                self._descartar(next(iter(self._entradas)))
+
+            posicao = self._livres.pop()
+            self._matriz[posicao] = vetor
+            self._ativos[posicao] = True
+            self._entradas[posicao] = {
+                "pergunta": pergunta,
+                "resposta": resposta,
+                "documentos": ids_documentos,
+                "criado_em": time.monotonic(),
+            }
+            for id_documento in ids_documentos:
+                self._por_documento.setdefault(id_documento, set()).add(posicao)
+
+    def invalidarDocumentos(self, ids_documentos: Iterable) -> int:
+        """Descarta as respostas que usaram algum dos documentos alterados"""
+        total = 0
+        with self._trava:
+            for id_documento in ids_documentos:
+                for posicao in self._por_documento.pop(str(id_documento), set()):
+                    if posicao in self._entradas:
+                        self._descartar(posicao)
+                        total += 1
+            self.invalidacoes += total
+        return total
+
+    def limpar(self) -> None:
+        with self._trava:
+            self._limpar()
+
+    def estatisticas(self) -> Dict:
+        consultas = self.acertos + self.falhas
+        return {
+            "entradas": len(self._entradas),
+            "capacidade": self.capacidade,
+            "acertos": self.acertos,
+            "falhas": self.falhas,
+            "invalidacoes": self.invalidacoes,
+            "taxa_acerto": round(self.acertos / consultas, 4) if consultas else 0.0,
+        }
+
+    def _descartar(self, posicao: int) -> None:
+        entrada = self._entradas.pop(posicao)
+        self._ativos[posicao] = False
+        self._livres.append(posicao)
+        for id_documento in entrada["documentos"]:
+            posicoes = self._por_documento.get(id_documento)
+            if posicoes:
+                posicoes.discard(posicao)
+                if not posicoes:
+                    del self._por_documento[id_documento]
+
+    def _limpar(self) -> None:
+        self._entradas.clear()
+        self._por_documento.clear()
+        self._ativos[:] = False
+        self._livres = list(range(self.capacidade - 1, -1, -1))
@@ -0,0 +1,107 @@
+import re
+import threading
+from typing import Dict, Iterable, List, Optional
+
+# Códigos estruturados citados nas perguntas: rejeição da SEFAZ (cStat), CFOP, CST e CSOSN.
+# "rejei\S*" aceita rejeição/rejeicao e também o texto com acentuação corrompida.
+PADROES_CHAVES = {
+    "rejeicao": re.compile(r"\b(?:rejei\S*|cstat)\s*(?:n[º°o.]*\s*)?:?\s*(\d{3})\b", re.IGNORECASE),
+    "cfop": re.compile(r"\bcfop\s*(?:n[º°o.]*\s*)?:?\s*([1-7])\.?(\d{3})\b", re.IGNORECASE),
+    "cst": re.compile(r"\bcst\s*(?:n[º°o.]*\s*)?:?\s*(\d{2,3})\b", re.IGNORECASE),
+    "csosn": re.compile(r"\bcsosn\s*(?:n[º°o.]*\s*)?:?\s*(\d{3})\b", re.IGNORECASE),
+}
+
+
+def extrairChaves(texto: Optional[str]) -> List[str]:
+    """Chaves no formato "tipo:codigo" encontradas no texto, sem repetição e na ordem em que aparecem"""
+    encontradas = []
+    for tipo, padrao in PADROES_CHAVES.items():
+        for correspondencia in padrao.finditer(texto or ""):
+            chave = f"{tipo}:{''.join(correspondencia.groups())}"
+            if chave not in encontradas:
+                encontradas.append(chave)
+    return encontradas
+
+
+class IndiceChaves:
+    """Índice exato de código estruturado -> documento da base de conhecimento.
+
+    Perguntas que citam um único código conhecido (ex.: "Rejeição 204") são
+    respondidas direto por aqui, sem embedding, busca vetorial ou Gemini.
+    As chaves de cada documento vêm do campo `chaves` gravado no seed ou, se
+    ele não existir, são extraídas da pergunta na hora da indexação.
+    """
+
+    def __init__(self):
+        self._por_chave: Dict[str, Dict[str, Dict]] = {}  # chave -> {_id: documento}
+        self._chaves_documento: Dict[str, List[str]] = {}  # _id -> chaves
+        self.consultas = 0
+        self.acertos = 0
+        self._trava = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._por_chave)
+
+    @staticmethod
+    def chavesDocumento(doc: Dict) -> List[str]:
+        if doc.get("chaves") is not None:
+            return list(doc["chaves"])
+        return extrairChaves(doc.get("pergunta"))
+
+    def construir(self, documentos: Iterable[Dict]) -> None:
+        por_chave, chaves_documento = {}, {}
+        for doc in documentos:
+            chaves = self.chavesDocumento(doc)
+            if chaves:
+                chaves_documento[str(doc["_id"])] = chaves
+                for chave in chaves:
+                    por_chave.setdefault(chave, {})[str(doc["_id"])] = doc
+        with self._trava:
+            self._por_chave, self._chaves_documento = por_chave, chaves_documento
+
+    def adicionar(self, doc: Dict) -> None:
+        chaves = self.chavesDocumento(doc)
+        with self._trava:
+            self._remover(str(doc["_id"]))
+            if chaves:
+                self._chaves_documento[str(doc["_id"])] = chaves
+                for chave in chaves:
+                    self._por_chave.setdefault(chave, {})[str(doc["_id"])] = doc
+
+    def remover(self, id_documento) -> None:
+        with self._trava:
+            self._remover(str(id_documento))
+
+    def idsCadastrados(self) -> List[str]:
+        """Ids dos documentos com chaves, na ordem de cadastro (a que decide entre entradas repetidas)"""
+        with self._trava:
+            return list(self._chaves_documento)
+
+    def buscar(self, pergunta: str) -> Optional[Dict]:
+        """Documento da única chave citada na pergunta; None se não houver código ou houver vários"""
+        self.consultas += 1
+        chaves = extrairChaves(pergunta)
+        if len(chaves) != 1:
+            return None
+        documentos = self._por_chave.get(chaves[0])
+        if not documentos:
+            return None
+        self.acertos += 1
+        # Mais de uma entrada para o mesmo código: a primeira cadastrada
+        return next(iter(documentos.values()))
+
+    def estatisticas(self) -> Dict:
+        return {
+            "chaves": len(self._por_chave),
+            "consultas": self.consultas,
+            "acertos": self.acertos,
+            "taxa_acerto": round(self.acertos / self.consultas, 4) if self.consultas else 0.0,
+        }
+
+    def _remover(self, id_documento: str) -> None:
+        for chave in self._chaves_documento.pop(id_documento, []):
+            documentos = self._por_chave.get(chave)
+            if documentos:
+                documentos.pop(id_documento, None)
+                if not documentos:
+                    del self._por_chave[chave]
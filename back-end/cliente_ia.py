@@ -0,0 +1,282 @@
+import time
+import random
+import asyncio
+import threading
+from typing import AsyncIterator, Callable, Dict, Optional
+from metricas import anotar, registro_metricas
+
+# Erros da API que valem nova tentativa (sobrecarga, indisponibilidade, prazo estourado)
+ERROS_TRANSITORIOS = {
+    "ServiceUnavailable", "ResourceExhausted", "TooManyRequests", "DeadlineExceeded",
+    "InternalServerError", "BadGateway", "GatewayTimeout", "RetryError",
+}
+
+
+class CircuitoAberto(Exception):
+    """O Gemini falhou seguidamente e as chamadas estão suspensas por um tempo"""
+
+
+def erroTransitorio(erro: Exception) -> bool:
+    if isinstance(erro, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    return type(erro).__name__ in ERROS_TRANSITORIOS
+
+
+class DisjuntorCircuito:
+    """Disjuntor: após `limite_falhas` falhas seguidas abre por `tempo_aberto` segundos.
+
+    Aberto, recusa as chamadas na hora. Passado o tempo, deixa uma chamada de teste
+    (meio aberto): se ela der certo o circuito fecha, se falhar abre de novo.
+    """
+
+    def __init__(self, limite_falhas: int = 5, tempo_aberto: float = 30.0):
+        self.limite_falhas = limite_falhas
+        self.tempo_aberto = tempo_aberto
+        self.falhas_seguidas = 0
+        self.aberturas = 0
+        self._aberto_ate = 0.0
+        self._testando = False
+        self._trava = threading.Lock()
+
+    @property
+    def estado(self) -> str:
+        if self.falhas_seguidas < self.limite_falhas:
+            return "fechado"
+        return "aberto" if time.monotonic() < self._aberto_ate else "meio_aberto"
+
+    def permitir(self) -> bool:
+        with self._trava:
+            estado = self.estado
+            if estado == "fechado":
+                return True
+            if estado == "meio_aberto" and not self._testando:
+                self._testando = True
+                return True
+            return False
+
+    def registrarSucesso(self) -> None:
+        with self._trava:
+            self.falhas_seguidas = 0
+            self._testando = False
+
+    def registrarFalha(self) -> None:
+        with self._trava:
+            self.falhas_seguidas += 1
+            self._testando = False
+            if self.falhas_seguidas >= self.limite_falhas:
+                if time.monotonic() >= self._aberto_ate:
+                    self.aberturas += 1
+                self._aberto_ate = time.monotonic() + self.tempo_aberto
+
+
+class ClienteGemini:
+    """Cliente de longa duração para o Gemini.
+
+    O modelo é criado uma vez e reaproveitado. Cada geração tem prazo
+    (`tempo_limite`), o número de gerações simultâneas é limitado
+    (`max_concorrencia`), erros transitórios são repetidos com espera exponencial
+    com jitter e um disjuntor corta as chamadas quando a API está fora do ar.
+    Com `async_nativo=False` (transporte REST, usado com servidores stub) as
+    chamadas async rodam o cliente síncrono em threads. `configurar` (ex.:
+    genai.configure) roda uma vez, antes de o modelo ser criado.
+    """
+
+    def __init__(self, genai, nome_modelo: str, config_geracao: Dict, tempo_limite: float = 20.0,
+                 max_concorrencia: int = 8, tentativas: int = 3, espera_base: float = 0.5, espera_maxima: float = 5.0,
+                 disjuntor: Optional[DisjuntorCircuito] = None, async_nativo: bool = True,
+                 configurar: Optional[Callable[[], None]] = None):
+        self.genai = genai
+        self.nome_modelo = nome_modelo
+        self.config_geracao = config_geracao
+        self.tempo_limite = tempo_limite
+        self.max_concorrencia = max_concorrencia
+        self.tentativas = tentativas
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self.disjuntor = disjuntor or DisjuntorCircuito()
+        self.async_nativo = async_nativo
+        self.configurar = configurar
+        self.chamadas = 0
+        self.falhas = 0
+        self.repeticoes = 0
+        self.recusadas = 0
+        self.em_andamento = 0
+        self.pendentes = 0  # gerações aguardando vaga ou em andamento (backlog)
+        self._modelo = None
+        self._semaforo_async = asyncio.Semaphore(max_concorrencia)
+        self._semaforo = threading.BoundedSemaphore(max_concorrencia)
+        self._trava = threading.Lock()
+
+    @property
+    def modelo(self):
+        if self._modelo is None:
+            with self._trava:
+                if self._modelo is None:
+                    if self.configurar:
+                        self.configurar()
+                    self._modelo = self.genai.GenerativeModel(self.nome_modelo)
+        return self._modelo
+
+    def _espera(self, tentativa: int) -> float:
+        # "Full jitter": espalha as novas tentativas dos vários workers no tempo
+        return random.uniform(0, min(self.espera_maxima, self.espera_base * (2 ** tentativa)))
+
+    def _liberar(self) -> None:
+        if not self.disjuntor.permitir():
+            self.recusadas += 1
+            raise CircuitoAberto("Gemini indisponível: circuito aberto")
+
+    def _falhou(self, erro: Exception, tentativa: int) -> bool:
+        """Registra a falha; devolve True se ainda vale tentar de novo"""
+        self.falhas += 1
+        if not erroTransitorio(erro):
+            # A API respondeu (ex.: pedido inválido, conteúdo bloqueado): não é indisponibilidade
+            self.disjuntor.registrarSucesso()
+            return False
+        self.disjuntor.registrarFalha()
+        if tentativa + 1 < self.tentativas and self.disjuntor.estado == "fechado":
+            self.repeticoes += 1
+            return True
+        return False
+
+    @staticmethod
+    def _registrarUso(resposta) -> None:
+        """Tokens de entrada e saída informados pela API (usage_metadata)"""
+        uso = getattr(resposta, "usage_metadata", None)
+        if not uso:
+            return
+        entrada = getattr(uso, "prompt_token_count", 0) or 0
+        saida = getattr(uso, "candidates_token_count", 0) or 0
+        for tipo, quantidade in (("entrada", entrada), ("saida", saida)):
+            registro_metricas.contador("tekbot_gemini_tokens_total", "Tokens consumidos no Gemini", tipo=tipo) \
+                .incrementar(quantidade)
+        anotar(tokens_entrada=entrada, tokens_saida=saida)
+
+    def _chamar(self, prompt: str, stream: bool = False):
+        return self.modelo.generate_content(
+            prompt, generation_config=self.config_geracao, stream=stream,
+            request_options={"timeout": self.tempo_limite},
+        )
+
+    async def _chamarAsync(self, prompt: str, stream: bool = False):
+        if self.async_nativo:
+            return await self.modelo.generate_content_async(prompt, generation_config=self.config_geracao, stream=stream)
+        resposta = await asyncio.to_thread(self._chamar, prompt, stream)
+        if not stream:
+            return resposta
+        return self._trechosEmThread(iter(resposta))
+
+    @staticmethod
+    async def _trechosEmThread(trechos):
+        fim = object()
+        while True:
+            trecho = await asyncio.to_thread(next, trechos, fim)
+            if trecho is fim:
+                return
+            yield trecho
+
+    def gerar(self, prompt: str) -> str:
+        """Geração síncrona (terminal e código que roda em threads)"""
+        for tentativa in range(self.tentativas):
+            self._liberar()
+            try:
+                with self._semaforo:
+                    self.chamadas += 1
+                    resposta = self._chamar(prompt)
+                texto = resposta.text.strip()
+                self.disjuntor.registrarSucesso()
+                self._registrarUso(resposta)
+                return texto
+            except Exception as e:
+                if not self._falhou(e, tentativa):
+                    raise
+            time.sleep(self._espera(tentativa))
+        raise RuntimeError("Tentativas esgotadas")
+
+    async def gerarAsync(self, prompt: str) -> str:
+        self.pendentes += 1
+        try:
+            return await self._gerarAsync(prompt)
+        finally:
+            self.pendentes -= 1
+
+    async def _gerarAsync(self, prompt: str) -> str:
+        for tentativa in range(self.tentativas):
+            self._liberar()
+            try:
+                async with self._semaforo_async:
+                    self.chamadas += 1
+                    self.em_andamento += 1
+                    try:
+                        resposta = await asyncio.wait_for(self._chamarAsync(prompt), self.tempo_limite)
+                    finally:
+                        self.em_andamento -= 1
+                texto = resposta.text.strip()
+                self.disjuntor.registrarSucesso()
+                self._registrarUso(resposta)
+                return texto
+            except Exception as e:
+                if not self._falhou(e, tentativa):
+                    raise
+            await asyncio.sleep(self._espera(tentativa))
+        raise RuntimeError("Tentativas esgotadas")
+
+    async def gerarStreamAsync(self, prompt: str) -> AsyncIterator[str]:
+        """Streaming com prazo por trecho. Só repete se a falha vier antes do primeiro trecho."""
+        self.pendentes += 1
+        try:
+            async for trecho in self._gerarStreamAsync(prompt):
+                yield trecho
+        finally:
+            self.pendentes -= 1
+
+    async def _gerarStreamAsync(self, prompt: str) -> AsyncIterator[str]:
+        for tentativa in range(self.tentativas):
+            self._liberar()
+            enviou = False
+            try:
+                async with self._semaforo_async:
+                    self.chamadas += 1
+                    self.em_andamento += 1
+                    try:
+                        resposta = await asyncio.wait_for(self._chamarAsync(prompt, stream=True), self.tempo_limite)
+                        trechos = resposta.__aiter__()
+                        ultimo = None
+                        while True:
+                            try:
+                                trecho = await asyncio.wait_for(trechos.__anext__(), self.tempo_limite)
+                            except StopAsyncIteration:
+                                break
+                            ultimo = trecho
+                            if trecho.parts:
+                                enviou = True
+                                yield trecho.text
+                    finally:
+                        self.em_andamento -= 1
+                self.disjuntor.registrarSucesso()
+                self._registrarUso(ultimo)  # no streaming o uso total vem no último trecho
+                return
+            except Exception as e:
+                if enviou:
+                    # Parte da resposta já foi entregue: não dá para repetir sem duplicar texto
+                    self.falhas += 1
+                    if erroTransitorio(e):
+                        self.disjuntor.registrarFalha()
+                    raise
+                if not self._falhou(e, tentativa):
+                    raise
+            await asyncio.sleep(self._espera(tentativa))
+
+    def estatisticas(self) -> Dict:
+        return {
+            "modelo": self.nome_modelo,
+            "circuito": self.disjuntor.estado,
+            "aberturas_circuito": self.disjuntor.aberturas,
+            "em_andamento": self.em_andamento,
+            "pendentes": self.pendentes,
+            "max_concorrencia": self.max_concorrencia,
+            "chamadas": self.chamadas,
+            "falhas": self.falhas,
+            "repeticoes": self.repeticoes,
+            "recusadas": self.recusadas,
+        }
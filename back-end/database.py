@@ -1,4 +1,5 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, DESCENDING, HASHED
+from motor.motor_asyncio import AsyncIOMotorClient
 import os
 
 # Carregar variáveis de ambiente
@@ -6,8 +7,38 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-# Conectar ao MongoDB
-cliente = MongoClient(os.getenv("MONGO_URI"))
-banco_de_dados = cliente["tekbot"]  # Banco de dados do chatbot
-colecao_usuarios = banco_de_dados["users"]
-colecao_mensagens = banco_de_dados["messages"]
+NOME_BANCO = os.getenv("MONGO_BANCO", "tekbot")
+# Interações mais antigas que isto são apagadas pelo próprio MongoDB (índice TTL)
+RETENCAO_INTERACOES_DIAS = int(os.getenv("INTERACOES_RETENCAO_DIAS", 90))
+
+# Conectar ao MongoDB: um único cliente (e pool de conexões) por processo.
+# connect=False: nada é aberto na importação, que no gunicorn com preload_app acontece no
+# processo mestre. Cada worker abre as próprias conexões na primeira operação depois do fork.
+cliente = MongoClient(os.getenv("MONGO_URI"), connect=False)
+banco_de_dados = cliente[NOME_BANCO]  # Banco de dados do chatbot
+colecao_usuarios = banco_de_dados["usuarios"]
+colecao_conhecimento = banco_de_dados["mensagens"]  # base de conhecimento (seed, treino e /mensagens)
+colecao_interacoes = banco_de_dados["interacoes"]  # registro de cada pergunta respondida
+colecao_sessoes = banco_de_dados["sessoes"]  # histórico das conversas, um documento por sessão
+
+# Cliente assíncrono (motor) para as rotas async: não prende threads esperando o banco.
+# O motor também só conecta no primeiro uso, já dentro do event loop do worker.
+cliente_async = AsyncIOMotorClient(os.getenv("MONGO_URI"))
+banco_de_dados_async = cliente_async[NOME_BANCO]
+colecao_conhecimento_async = banco_de_dados_async["mensagens"]
+
+
+def criarIndices():
+    """Cria (se ainda não existirem) os índices usados pelas consultas da aplicação"""
+    colecao_usuarios.create_index([("email", ASCENDING)], unique=True)
+
+    # Deduplicação do seed por pergunta ($in) e sincronização incremental do índice vetorial
+    colecao_conhecimento.create_index([("pergunta", HASHED)])
+    colecao_conhecimento.create_index([("atualizado_em", ASCENDING)])
+    colecao_conhecimento.create_index([("chaves", ASCENDING)])
+
+    colecao_interacoes.create_index([("sessao_id", ASCENDING), ("data", ASCENDING)])
+    colecao_interacoes.create_index([("data", ASCENDING)], expireAfterSeconds=RETENCAO_INTERACOES_DIAS * 86400)
+
+    colecao_sessoes.create_index([("sessao_id", ASCENDING)], unique=True)
+    colecao_sessoes.create_index([("data_fim", DESCENDING)])
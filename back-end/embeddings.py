@@ -0,0 +1,130 @@
+import os
+import time
+import queue
+import asyncio
+import threading
+import numpy as np
+from concurrent.futures import Future
+from typing import Callable, List
+from metricas import Histograma
+
+# Modelo de embeddings da base: o seed.py e a API precisam usar o mesmo, senão as
+# perguntas e os documentos caem em espaços vetoriais diferentes
+NOME_MODELO_EMBEDDING = os.getenv("EMBEDDING_MODELO", "all-MiniLM-L6-v2")
+
+
+class ServicoEmbedding:
+    """Agrupa pedidos de codificação concorrentes em um único forward pass do modelo.
+
+    Cada chamada entra numa fila; uma thread dedicada espera até `janela_ms`
+    por mais pedidos (ou até juntar `tamanho_max_lote` textos), codifica tudo
+    de uma vez e devolve a cada chamador apenas os seus vetores.
+    O modelo só é carregado (por `carregar_modelo`) no primeiro uso ou em `aquecer`.
+    """
+
+    def __init__(self, carregar_modelo: Callable, janela_ms: float = 5.0, tamanho_max_lote: int = 32):
+        self.carregar_modelo = carregar_modelo
+        self.tempo_carga = None  # segundos gastos carregando o modelo
+        self.tempo_aquecimento = None
+        self._modelo = None
+        self.janela = janela_ms / 1000
+        self.tamanho_max_lote = tamanho_max_lote
+        self.espera_fila_ms = Histograma([0.5, 1, 2, 5, 10, 20, 50, 100, 250, 1000])
+        self.tamanho_lote = Histograma([1, 2, 4, 8, 16, 32, 64, 128])
+        self._iniciarThread()
+        # Threads não sobrevivem ao fork: com gunicorn --preload cada worker precisa da sua
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._iniciarThread)
+
+    def _iniciarThread(self) -> None:
+        self._fila: "queue.Queue" = queue.Queue()
+        self._trava_modelo = threading.Lock()
+        self._thread = threading.Thread(target=self._executar, name="servico-embedding", daemon=True)
+        self._thread.start()
+
+    @property
+    def modelo(self):
+        if self._modelo is None:
+            with self._trava_modelo:
+                if self._modelo is None:
+                    inicio = time.perf_counter()
+                    self._modelo = self.carregar_modelo()
+                    self.tempo_carga = time.perf_counter() - inicio
+        return self._modelo
+
+    @property
+    def pronto(self) -> bool:
+        return self.tempo_aquecimento is not None
+
+    def aquecer(self) -> float:
+        """Carrega o modelo e faz um forward pass completo pela fila, para a primeira pergunta
+        não pagar a inicialização preguiçosa dos kernels"""
+        inicio = time.perf_counter()
+        self.codificar(["Como emitir uma NF-e?"])
+        self.tempo_aquecimento = time.perf_counter() - inicio
+        return self.tempo_aquecimento
+
+    def encode(self, textos: List[str]) -> np.ndarray:
+        """Mesma interface do SentenceTransformer, para quem recebe um "modelo" (ex.: carga do índice)"""
+        return self.codificar(textos)
+
+    def submeter(self, textos: List[str]) -> Future:
+        futuro: Future = Future()
+        self._fila.put((list(textos), futuro, time.perf_counter()))
+        return futuro
+
+    def codificar(self, textos: List[str]) -> np.ndarray:
+        """Codificação síncrona (bloqueia até o lote que contém estes textos ser processado)"""
+        return self.submeter(textos).result()
+
+    async def codificarAsync(self, textos: List[str]) -> np.ndarray:
+        """Codificação sem bloquear o event loop"""
+        return await asyncio.wrap_future(self.submeter(textos))
+
+    def _executar(self) -> None:
+        while True:
+            pedidos = [self._fila.get()]
+            total_textos = len(pedidos[0][0])
+            prazo = time.perf_counter() + self.janela
+
+            # Junta o que chegar dentro da janela, sem passar do tamanho máximo do lote
+            while total_textos < self.tamanho_max_lote:
+                restante = prazo - time.perf_counter()
+                if restante <= 0:
+                    break
+                try:
+                    pedido = self._fila.get(timeout=restante)
+                except queue.Empty:
+                    break
+                pedidos.append(pedido)
+                total_textos += len(pedido[0])
+
+            inicio_lote = time.perf_counter()
+            for _, _, enfileirado_em in pedidos:
+                self.espera_fila_ms.observar((inicio_lote - enfileirado_em) * 1000)
+            self.tamanho_lote.observar(total_textos)
+
+            textos = [texto for pedido_textos, _, _ in pedidos for texto in pedido_textos]
+            try:
+                vetores = np.asarray(self.modelo.encode(textos))
+            except Exception as e:
+                for _, futuro, _ in pedidos:
+                    futuro.set_exception(e)
+                continue
+
+            posicao = 0
+            for pedido_textos, futuro, _ in pedidos:
+                futuro.set_result(vetores[posicao:posicao + len(pedido_textos)])
+                posicao += len(pedido_textos)
+
+    def estatisticas(self) -> dict:
+        return {
+            "janela_ms": self.janela * 1000,
+            "tamanho_max_lote": self.tamanho_max_lote,
+            "pendentes": self._fila.qsize(),
+            "modelo_carregado": self._modelo is not None,
+            "tempo_carga_s": None if self.tempo_carga is None else round(self.tempo_carga, 3),
+            "tempo_aquecimento_s": None if self.tempo_aquecimento is None else round(self.tempo_aquecimento, 3),
+            "espera_fila_ms": self.espera_fila_ms.resumo(),
+            "tamanho_lote": self.tamanho_lote.resumo(),
+        }
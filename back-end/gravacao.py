@@ -0,0 +1,162 @@
+import time
+import queue
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from metricas import Histograma
+
+
+class GravadorInteracoes:
+    """Grava no MongoDB, em segundo plano, os registros de interação e o histórico das sessões.
+
+    As requisições só enfileiram; uma thread dedicada junta os pedidos até
+    `tamanho_lote` ou `intervalo` segundos e grava tudo de uma vez: registros
+    com `insert_many` e históricos com `$push` (anexando ao documento da sessão,
+    limitado ao tamanho do histórico) em um único `bulk_write`. Com a fila cheia
+    o registro é descartado em vez de atrasar a resposta ao usuário.
+    """
+
+    def __init__(self, colecao_interacoes, colecao_sessoes, tamanho_lote: int = 100, intervalo: float = 1.0,
+                 capacidade_fila: int = 10000):
+        self.colecao_interacoes = colecao_interacoes
+        self.colecao_sessoes = colecao_sessoes
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.gravados = 0
+        self.falhas = 0
+        self.descartados = 0
+        self.tamanho_gravacao = Histograma([1, 2, 5, 10, 20, 50, 100, 200, 500])
+        self._fila: "queue.Queue" = queue.Queue(maxsize=capacidade_fila)
+        self._thread: Optional[threading.Thread] = None
+        self._trava = threading.Lock()
+
+    def iniciar(self) -> None:
+        with self._trava:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._executar, name="gravador-interacoes", daemon=True)
+                self._thread.start()
+
+    def registrar(self, documento: Dict) -> None:
+        """Enfileira um documento para `insert_many`"""
+        self._enfileirar(("registro", documento))
+
+    def anexarSessao(self, sessao_id: str, interacao: Dict, limite_historico: int) -> None:
+        """Enfileira uma interação para ser anexada ao histórico da sessão no banco"""
+        self._enfileirar(("sessao", (sessao_id, interacao, limite_historico)))
+
+    def descarregar(self, tempo_limite: Optional[float] = None) -> None:
+        """Espera tudo o que já foi enfileirado ser gravado"""
+        concluido = threading.Event()
+        self._enfileirar(("marca", concluido), bloquear=True)
+        concluido.wait(tempo_limite)
+
+    def parar(self, tempo_limite: float = 10.0) -> None:
+        """Grava o que estiver pendente e encerra a thread (desligamento do servidor)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._gravar(self._retirarPendentes())
+            return
+        self._fila.put(("parar", None))
+        self._thread.join(tempo_limite)
+
+    def estatisticas(self) -> Dict:
+        return {
+            "pendentes": self._fila.qsize(),
+            "gravados": self.gravados,
+            "falhas": self.falhas,
+            "descartados": self.descartados,
+            "tamanho_gravacao": self.tamanho_gravacao.resumo(),
+        }
+
+    def _enfileirar(self, pedido, bloquear: bool = False) -> None:
+        self.iniciar()
+        try:
+            self._fila.put(pedido, block=bloquear)
+        except queue.Full:
+            self.descartados += 1
+            print("[AVISO] Fila de gravação cheia: registro de interação descartado.")
+
+    def _retirarPendentes(self) -> List:
+        pedidos = []
+        while True:
+            try:
+                pedidos.append(self._fila.get_nowait())
+            except queue.Empty:
+                return pedidos
+
+    def _executar(self) -> None:
+        while True:
+            pedidos = [self._fila.get()]
+            prazo = time.monotonic() + self.intervalo
+
+            # Junta o que chegar dentro do intervalo, até o tamanho do lote ou um pedido de controle
+            while len(pedidos) < self.tamanho_lote and pedidos[-1][0] not in ("marca", "parar"):
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    pedidos.append(self._fila.get(timeout=restante))
+                except queue.Empty:
+                    break
+
+            if pedidos[-1][0] == "parar":
+                self._gravar(pedidos[:-1] + self._retirarPendentes())
+                return
+            self._gravar(pedidos)
+
+    def _gravar(self, pedidos: List) -> None:
+        registros = [dados for tipo, dados in pedidos if tipo == "registro"]
+
+        # Interações da mesma sessão viram um único $push com $each
+        por_sessao: Dict[str, List] = {}
+        for tipo, dados in pedidos:
+            if tipo == "sessao":
+                sessao_id, interacao, limite = dados
+                por_sessao.setdefault(sessao_id, [[], limite])[0].append(interacao)
+
+        agora = datetime.now(timezone.utc)
+        operacoes = [
+            UpdateOne(
+                {"sessao_id": sessao_id},
+                {
+                    "$push": {"historico": {"$each": interacoes, "$slice": -limite}},
+                    "$set": {"data_fim": agora},
+                    "$inc": {"total_interacoes": len(interacoes)},
+                    "$setOnInsert": {"data_inicio": interacoes[0]["timestamp"]},
+                },
+                upsert=True,
+            )
+            for sessao_id, (interacoes, limite) in por_sessao.items()
+        ]
+
+        total = len(registros) + len(operacoes)
+        if total:
+            self.tamanho_gravacao.observar(total)
+            try:
+                if registros:
+                    self.colecao_interacoes.insert_many(registros, ordered=False)
+                if operacoes:
+                    self._gravarSessoes(operacoes)
+                self.gravados += total
+            except Exception as e:
+                self.falhas += total
+                print(f"[ERRO] Falha ao gravar {total} interações: {e}")
+
+        for tipo, dados in pedidos:
+            if tipo == "marca":
+                dados.set()
+
+    def _gravarSessoes(self, operacoes: List, tentativas: int = 3) -> None:
+        """Upserts das sessões tolerando a corrida entre workers: dois upserts simultâneos da
+        mesma sessão nova esbarram no índice único de sessao_id (E11000). Só as operações
+        recusadas por isso são repetidas; com o documento já criado, viram um $push comum."""
+        for tentativa in range(tentativas):
+            try:
+                self.colecao_sessoes.bulk_write(operacoes, ordered=False)
+                return
+            except BulkWriteError as e:
+                erros = e.details.get("writeErrors", [])
+                if tentativa + 1 == tentativas or not erros or any(erro.get("code") != 11000 for erro in erros):
+                    raise
+                operacoes = [operacoes[erro["index"]] for erro in erros]
@@ -0,0 +1,879 @@
+import os
+import json
+import time
+import struct
+import threading
+import numpy as np
+import bson
+from collections.abc import Sequence
+from datetime import datetime, timezone
+from typing import Callable, List, Dict, Tuple, Optional
+from bson.binary import Binary, USER_DEFINED_SUBTYPE
+from chaves import IndiceChaves
+from lexico import IndiceBM25
+from metricas import anotar
+
+# Campos do documento mantidos em memória junto com cada linha da matriz
+CAMPOS_METADADOS = ("_id", "tipo", "pergunta", "resposta", "texto", "chaves")
+
+
+def normalizarVetores(vetores) -> np.ndarray:
+    """Converte os vetores para float32 contíguo com norma unitária por linha"""
+    matriz = np.ascontiguousarray(np.asarray(vetores, dtype=np.float32))
+    if matriz.ndim == 1:
+        matriz = matriz.reshape(1, -1)
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    normas[normas == 0] = 1.0
+    return matriz / normas
+
+
+# === Armazenamento compacto dos embeddings no MongoDB ===
+# BSON Binary com cabeçalho de 4 bytes (formato + preenchimento) seguido dos valores;
+# no int8 vem ainda a escala em float32. O cabeçalho mantém os dados alinhados para o np.frombuffer.
+FORMATOS_EMBEDDING = {"float32": (1, np.float32), "float16": (2, np.float16), "int8": (3, np.int8)}
+FORMATO_EMBEDDING = os.getenv("EMBEDDING_FORMATO", "float32")
+
+
+def empacotarEmbedding(vetor, formato: Optional[str] = None) -> Binary:
+    """Serializa o vetor no formato binário (float32 por padrão, float16 ou int8 quantizado)"""
+    codigo, tipo = FORMATOS_EMBEDDING[formato or FORMATO_EMBEDDING]
+    vetor = np.asarray(vetor, dtype=np.float32).ravel()
+    cabecalho = bytes([codigo, 0, 0, 0])
+    if tipo is np.int8:
+        escala = float(np.abs(vetor).max()) / 127 or 1.0
+        valores = np.round(vetor / escala).astype(np.int8)
+        cabecalho += np.float32(escala).tobytes()
+    else:
+        valores = vetor.astype(tipo)
+    return Binary(cabecalho + valores.tobytes(), USER_DEFINED_SUBTYPE)
+
+
+def lerEmbedding(valor) -> Optional[np.ndarray]:
+    """Lê o embedding salvo (binário ou a lista de floats antiga); devolve None se não houver"""
+    if valor is None or len(valor) == 0:
+        return None
+    if not isinstance(valor, (bytes, bytearray)):
+        return np.asarray(valor, dtype=np.float32)
+
+    codigo = valor[0]
+    for _, (codigo_formato, tipo) in FORMATOS_EMBEDDING.items():
+        if codigo == codigo_formato:
+            break
+    else:
+        raise ValueError(f"Formato de embedding desconhecido: {codigo}")
+
+    if tipo is np.int8:
+        escala = np.frombuffer(valor, dtype=np.float32, count=1, offset=4)[0]
+        return np.frombuffer(valor, dtype=np.int8, offset=8).astype(np.float32) * escala
+    # Sem cópia: o array aponta para os bytes do próprio documento
+    return np.frombuffer(valor, dtype=tipo, offset=4)
+
+
+def extrairMetadados(documentos: List[Dict]) -> List[Dict]:
+    return [{campo: doc.get(campo) for campo in CAMPOS_METADADOS} for doc in documentos]
+
+
+def textoIndexado(doc: Dict) -> str:
+    """Texto usado para o embedding: a pergunta ou, nas mensagens livres, o texto"""
+    return doc.get("pergunta") or doc.get("texto") or ""
+
+
+def instante(data) -> float:
+    """Converte o campo atualizado_em (com ou sem fuso, como o pymongo devolve) em timestamp UTC"""
+    if data is None:
+        return 0.0
+    if data.tzinfo is None:
+        data = data.replace(tzinfo=timezone.utc)
+    return data.timestamp()
+
+
+class EstadoIndice:
+    """Fotografia do índice publicada de uma só vez para as buscas.
+
+    A base é imutável. O segmento delta é um buffer com folga: novas linhas são
+    escritas além de `n_delta` e só então um novo estado é publicado, então
+    buscas que ainda usam o estado antigo nunca enxergam linhas pela metade.
+    """
+
+    def __init__(self, matriz: np.ndarray, documentos: List[Dict],
+                 centroides: Optional[np.ndarray] = None, inicio_listas: Optional[np.ndarray] = None,
+                 delta: Optional[np.ndarray] = None, documentos_delta: Optional[List[Dict]] = None,
+                 n_delta: int = 0, vivos: Optional[np.ndarray] = None, vivos_delta: Optional[np.ndarray] = None):
+        self.matriz = matriz
+        self.documentos = documentos
+        self.centroides = centroides
+        self.inicio_listas = inicio_listas
+        self.delta = delta
+        self.documentos_delta = documentos_delta if documentos_delta is not None else []
+        self.n_delta = n_delta
+        self.vivos = vivos if vivos is not None else np.ones(len(documentos), dtype=bool)
+        self.vivos_delta = vivos_delta
+
+
+class DocumentosMapeados(Sequence):
+    """Metadados da base gravados em BSON num arquivo mapeado em memória (só leitura).
+
+    Cada acesso decodifica apenas o documento pedido: os processos que mapeiam o mesmo
+    arquivo dividem as páginas do cache do sistema em vez de cada um manter sua lista de dicts.
+    """
+
+    def __init__(self, dados: np.ndarray, deslocamentos: np.ndarray):
+        self._dados = memoryview(dados)
+        self._deslocamentos = deslocamentos  # documento i ocupa dados[deslocamentos[i]:deslocamentos[i + 1]]
+
+    def __len__(self) -> int:
+        return len(self._deslocamentos) - 1
+
+    def __getitem__(self, posicao):
+        if isinstance(posicao, slice):
+            return [self[i] for i in range(*posicao.indices(len(self)))]
+        if posicao < 0:
+            posicao += len(self)
+        if not 0 <= posicao < len(self):
+            raise IndexError(posicao)
+        return bson.decode(self._dados[self._deslocamentos[posicao]:self._deslocamentos[posicao + 1]])
+
+    def decodificar(self, linhas: List[int]) -> List[Dict]:
+        """Vários documentos de uma vez: para boa parte do arquivo, um único decode_all sai mais barato"""
+        if len(linhas) > len(self) // 2:
+            todos = bson.decode_all(self._dados)
+            return [todos[linha] for linha in linhas]
+        return [self[linha] for linha in linhas]
+
+
+# === Snapshot da base em arquivo único ===
+# Cabeçalho: MAGICA_SNAPSHOT, versão do formato e tamanho do JSON (uint32 cada), depois o JSON
+# com as informações da base e a posição de cada seção. As seções são arrays numpy crus
+# alinhados a 64 bytes, lidos com np.frombuffer sobre o próprio mapeamento, sem cópia.
+MAGICA_SNAPSHOT = b"TEKBOTSN"
+VERSAO_SNAPSHOT = 1
+ALINHAMENTO_SNAPSHOT = 64
+CAMINHO_SNAPSHOT = os.getenv("INDICE_SNAPSHOT", "snapshot/base_conhecimento.snap")
+
+
+def alinhar(posicao: int) -> int:
+    return -(-posicao // ALINHAMENTO_SNAPSHOT) * ALINHAMENTO_SNAPSHOT
+
+
+def gravarSnapshot(caminho: str, cabecalho: Dict, secoes: Dict[str, np.ndarray]) -> Dict:
+    """Grava o snapshot num arquivo temporário e o troca de uma vez pelo destino: processos
+    que ainda mapeiam o arquivo anterior continuam lendo a versão antiga sem problema"""
+    secoes = {nome: np.ascontiguousarray(array) for nome, array in secoes.items()}
+    posicoes, tamanho_dados = {}, 0
+    for nome, array in secoes.items():
+        posicoes[nome] = {"deslocamento": tamanho_dados, "dtype": array.dtype.str, "forma": list(array.shape)}
+        tamanho_dados = alinhar(tamanho_dados + array.nbytes)
+    cabecalho = dict(cabecalho, versao=VERSAO_SNAPSHOT, tamanho_dados=tamanho_dados, secoes=posicoes)
+    texto = json.dumps(cabecalho, ensure_ascii=False).encode("utf-8")
+
+    temporario = f"{caminho}.{os.getpid()}.tmp"
+    with open(temporario, "wb") as arquivo:
+        arquivo.write(MAGICA_SNAPSHOT + struct.pack("<II", VERSAO_SNAPSHOT, len(texto)) + texto)
+        inicio_dados = alinhar(arquivo.tell())
+        for nome, array in secoes.items():
+            arquivo.write(b"\0" * (inicio_dados + posicoes[nome]["deslocamento"] - arquivo.tell()))
+            arquivo.write(array.reshape(-1).view(np.uint8))
+        arquivo.write(b"\0" * (inicio_dados + tamanho_dados - arquivo.tell()))
+        arquivo.flush()
+        os.fsync(arquivo.fileno())
+    os.replace(temporario, caminho)
+    return cabecalho
+
+
+def abrirSnapshot(caminho: str) -> Tuple[Dict, Dict[str, np.ndarray]]:
+    """Mapeia o snapshot só para leitura; devolve o cabeçalho e as seções (views do mapeamento)"""
+    mapa = np.memmap(caminho, dtype=np.uint8, mode="r")
+    inicio = len(MAGICA_SNAPSHOT) + 8
+    if len(mapa) < inicio or bytes(mapa[:len(MAGICA_SNAPSHOT)]) != MAGICA_SNAPSHOT:
+        raise ValueError(f"{caminho} não é um snapshot da base de conhecimento")
+    versao, tamanho_cabecalho = struct.unpack("<II", bytes(mapa[len(MAGICA_SNAPSHOT):inicio]))
+    if versao != VERSAO_SNAPSHOT:
+        raise ValueError(f"Snapshot na versão {versao} do formato; esta versão lê a {VERSAO_SNAPSHOT}")
+    cabecalho = json.loads(bytes(mapa[inicio:inicio + tamanho_cabecalho]).decode("utf-8"))
+    inicio_dados = alinhar(inicio + tamanho_cabecalho)
+    if len(mapa) < inicio_dados + cabecalho["tamanho_dados"]:
+        raise ValueError(f"Snapshot incompleto: {caminho}")
+
+    secoes = {}
+    for nome, posicao in cabecalho["secoes"].items():
+        tipo, forma = np.dtype(posicao["dtype"]), tuple(posicao["forma"])
+        quantidade = int(np.prod(forma))
+        if quantidade == 0:
+            secoes[nome] = np.zeros(forma, dtype=tipo)
+            continue
+        secoes[nome] = np.frombuffer(mapa, dtype=tipo, count=quantidade,
+                                     offset=inicio_dados + posicao["deslocamento"]).reshape(forma)
+    return cabecalho, secoes
+
+
+class IndiceVetorial:
+    """Índice em memória com os embeddings da base de conhecimento.
+
+    Mantém uma matriz float32 contígua e pré-normalizada, de forma que a
+    similaridade de cosseno de uma consulta com toda a base seja um único
+    produto matriz-vetor. Inclusões vão para um segmento delta; edições e
+    remoções marcam a linha antiga como morta (tombstone) até a compactação.
+    """
+
+    def __init__(self, limite_delta: int = 1024, fracao_compactacao: float = 0.1):
+        self._estado = EstadoIndice(np.zeros((0, 0), dtype=np.float32), [])
+        self.carregado = False
+        self.marca_dagua = 0.0  # maior atualizado_em já aplicado (timestamp UTC)
+        self.limite_delta = limite_delta
+        self.fracao_compactacao = fracao_compactacao
+        self._localizacao: Dict[str, Tuple[bool, int, float]] = {}  # _id -> (no delta?, linha, versão)
+        self._removidos = 0
+        self._trava = threading.RLock()
+        self.observadores: List[Callable[[List[str]], None]] = []  # avisados quando um documento indexado muda
+        self.chaves = IndiceChaves()  # códigos de rejeição/CFOP/CST -> documento, mantido junto com a matriz
+        self.lexico = IndiceBM25()  # candidatos por termo para a busca híbrida
+
+    def _notificar(self, ids_alterados: List[str]) -> None:
+        for observador in self.observadores:
+            try:
+                observador(ids_alterados)
+            except Exception as e:
+                print(f"[WARN] Falha ao notificar alteração do índice: {e}")
+
+    def __len__(self) -> int:
+        return len(self._localizacao)
+
+    @property
+    def matriz(self) -> np.ndarray:
+        return self._estado.matriz
+
+    @property
+    def documentos(self) -> List[Dict]:
+        return self._estado.documentos
+
+    @property
+    def mapeado(self) -> bool:
+        """A base atual vem de um snapshot mapeado (ver `mapearSnapshot`)"""
+        return isinstance(self._estado.documentos, DocumentosMapeados)
+
+    def _publicar(self, estado: EstadoIndice) -> None:
+        # Troca a referência de uma vez para que buscas concorrentes vejam um estado consistente
+        with self._trava:
+            self._estado = estado
+            self.carregado = True
+
+    # === Construção ===
+
+    def _montarBase(self, matriz: np.ndarray, metadados: List[Dict], retreinar: bool = True) -> EstadoIndice:
+        """Cria o estado da base; subclasses reorganizam as linhas (ex.: listas IVF)"""
+        return EstadoIndice(matriz, metadados)
+
+    def _reindexar(self, estado: EstadoIndice, versoes: Dict[str, float]) -> None:
+        self._localizacao = {
+            str(doc["_id"]): (False, linha, versoes.get(str(doc["_id"]), 0.0))
+            for linha, doc in enumerate(estado.documentos)
+        }
+        self._removidos = 0
+
+    def construir(self, documentos: List[Dict], vetores) -> None:
+        """Substitui o conteúdo do índice pelos documentos e vetores informados"""
+        if len(documentos) == 0:
+            matriz = np.zeros((0, 0), dtype=np.float32)
+        else:
+            matriz = normalizarVetores(vetores)
+        versoes = {str(doc["_id"]): instante(doc.get("atualizado_em")) for doc in documentos}
+        metadados = extrairMetadados(documentos)
+        with self._trava:
+            estado = self._montarBase(matriz, metadados)
+            self._reindexar(estado, versoes)
+            self._publicar(estado)
+            self.chaves.construir(metadados)
+            self.lexico.construir(metadados)
+
+    @staticmethod
+    def consultaCarga(filtro: Optional[Dict] = None) -> Tuple[Dict, Dict]:
+        """Consulta e projeção da carga inicial: só documentos ativos e os campos usados pelo índice"""
+        projecao = {campo: 1 for campo in CAMPOS_METADADOS}
+        projecao.update({"embedding": 1, "atualizado_em": 1})
+        return {"$and": [filtro or {}, {"removido": {"$ne": True}}]}, projecao
+
+    def carregarDaColecao(self, colecao, modelo, filtro: Optional[Dict] = None) -> int:
+        """Carrega os documentos da coleção em uma única varredura e monta a matriz"""
+        # Marca d'água tomada antes da varredura: o que mudar durante a carga é reaplicado na sincronização
+        inicio_carga = time.time()
+        consulta, projecao = self.consultaCarga(filtro)
+        return self.carregarDocumentos(colecao.find(consulta, projecao), modelo, colecao, inicio_carga)
+
+    def carregarDocumentos(self, cursor, modelo, colecao=None, inicio_carga: Optional[float] = None) -> int:
+        """Monta o índice a partir de documentos já lidos (cursor síncrono ou lista vinda do motor)"""
+        documentos, vetores, sem_embedding = [], [], []
+        for doc in cursor:
+            if not textoIndexado(doc):
+                continue
+            embedding = lerEmbedding(doc.get("embedding"))
+            if embedding is not None:
+                documentos.append(doc)
+                vetores.append(embedding)
+            else:
+                sem_embedding.append(doc)
+
+        # Documentos antigos sem embedding são codificados em lote e persistidos
+        if sem_embedding:
+            novos = modelo.encode([textoIndexado(doc) for doc in sem_embedding])
+            for doc, embedding in zip(sem_embedding, novos):
+                try:
+                    if colecao is not None:
+                        colecao.update_one({"_id": doc["_id"]}, {"$set": {"embedding": empacotarEmbedding(embedding)}})
+                except Exception as e:
+                    print(f"[WARN] Não foi possível salvar embedding: {e}")
+                documentos.append(doc)
+                vetores.append(embedding)
+
+        # Descarta vetores com dimensão diferente da maioria (modelo trocado, dado corrompido)
+        if vetores:
+            dimensoes = [len(v) for v in vetores]
+            dimensao = max(set(dimensoes), key=dimensoes.count)
+            validos = [i for i, d in enumerate(dimensoes) if d == dimensao]
+            if len(validos) < len(vetores):
+                print(f"[WARN] {len(vetores) - len(validos)} embeddings ignorados por dimensão inválida.")
+            documentos = [documentos[i] for i in validos]
+            vetores = [vetores[i] for i in validos]
+
+        self.construir(documentos, vetores)
+        self.marca_dagua = inicio_carga if inicio_carga is not None else time.time()
+        return len(self)
+
+    # === Snapshot ===
+
+    def exportarSnapshot(self, caminho: str, **informacoes) -> Dict:
+        """Compacta a base e a grava, com os índices por chave e BM25, num snapshot (ver `gravarSnapshot`).
+        `informacoes` vão para o cabeçalho (ex.: o modelo de embedding que gerou os vetores)."""
+        self.compactar()
+        with self._trava:
+            estado = self._estado
+            ids = [str(doc["_id"]) for doc in estado.documentos]
+            versoes = np.array([self._localizacao[chave][2] for chave in ids], dtype=np.float64)
+            frequencias = [self.lexico.frequencias(chave) for chave in ids]
+            linhas = {chave: linha for linha, chave in enumerate(ids)}
+            marca_dagua = self.marca_dagua
+
+        blocos = [bson.encode(doc) for doc in estado.documentos]
+        deslocamentos = np.zeros(len(blocos) + 1, dtype=np.int64)
+        np.cumsum([len(bloco) for bloco in blocos], out=deslocamentos[1:])
+
+        # Postings do BM25 já tokenizados, por linha, com os termos numerados num vocabulário
+        vocabulario, numeros, termos, contagens = [], {}, [], []
+        inicio_termos = np.zeros(len(ids) + 1, dtype=np.int64)
+        for linha, frequencias_documento in enumerate(frequencias):
+            for termo, frequencia in frequencias_documento.items():
+                if termo not in numeros:
+                    numeros[termo] = len(vocabulario)
+                    vocabulario.append(termo)
+                termos.append(numeros[termo])
+                contagens.append(frequencia)
+            inicio_termos[linha + 1] = len(termos)
+
+        secoes = {
+            "matriz": np.asarray(estado.matriz, dtype=np.float32),
+            "versoes": versoes,
+            "ids": np.array([chave.encode("utf-8") for chave in ids]),
+            "deslocamentos": deslocamentos,
+            "documentos": np.frombuffer(b"".join(blocos), dtype=np.uint8),
+            "linhas_chaves": np.array([linhas[chave] for chave in self.chaves.idsCadastrados() if chave in linhas],
+                                      dtype=np.int64),
+            "bm25_inicio": inicio_termos,
+            "bm25_termos": np.array(termos, dtype=np.int32),
+            "bm25_frequencias": np.array(contagens, dtype=np.int32),
+            "bm25_vocabulario": np.frombuffer("\n".join(vocabulario).encode("utf-8"), dtype=np.uint8),
+        }
+        if estado.centroides is not None:
+            secoes["centroides"] = estado.centroides
+            secoes["inicio_listas"] = estado.inicio_listas
+        cabecalho = {
+            "documentos": len(ids),
+            "dimensao": int(estado.matriz.shape[1]) if ids else 0,
+            "tipo_indice": type(self).__name__,
+            "marca_dagua": marca_dagua,
+            "criado_em": time.time(),
+            **informacoes,
+        }
+        return gravarSnapshot(caminho, cabecalho, secoes)
+
+    def mapearSnapshot(self, caminho: str) -> Dict:
+        """Troca a base pelo snapshot mapeado só para leitura e devolve o cabeçalho.
+
+        Matriz e metadados ficam nas páginas do arquivo, divididas entre os processos que
+        o mapeiam; só o mapa de ids, os índices por chave e o BM25 são montados em memória,
+        sem reler o MongoDB nem tokenizar de novo. O que mudar depois da marca d'água do
+        snapshot chega pelo delta, como de costume.
+        """
+        cabecalho, secoes = abrirSnapshot(caminho)
+        if not cabecalho["documentos"]:
+            raise ValueError(f"Snapshot vazio: {caminho}")
+
+        documentos = DocumentosMapeados(secoes["documentos"], secoes["deslocamentos"])
+        estado = EstadoIndice(secoes["matriz"], documentos, secoes.get("centroides"), secoes.get("inicio_listas"))
+        ids = [chave.decode("utf-8") for chave in secoes["ids"].tolist()]
+        vocabulario = bytes(secoes["bm25_vocabulario"]).decode("utf-8").split("\n")
+
+        with self._trava:
+            self._localizacao = {chave: (False, linha, versao)
+                                 for linha, (chave, versao) in enumerate(zip(ids, secoes["versoes"].tolist()))}
+            self._removidos = 0
+            self._publicar(estado)
+            self.chaves.construir(documentos.decodificar(secoes["linhas_chaves"].tolist()))
+            self.lexico.construirDeFrequencias(ids, vocabulario, secoes["bm25_inicio"], secoes["bm25_termos"],
+                                               secoes["bm25_frequencias"])
+            self.marca_dagua = max(self.marca_dagua, cabecalho["marca_dagua"])
+        return cabecalho
+
+    # === Manutenção incremental ===
+
+    def adicionar(self, doc: Dict, vetor) -> bool:
+        """Inclui ou substitui um documento. Ignora versões que não são mais novas que a indexada."""
+        chave = str(doc["_id"])
+        versao = instante(doc.get("atualizado_em"))
+        vetor = normalizarVetores(vetor)[0]
+
+        with self._trava:
+            atual = self._localizacao.get(chave)
+            if atual is not None and versao and versao <= atual[2]:
+                return False
+
+            estado = self._estado
+            dimensao = estado.matriz.shape[1] if estado.matriz.size else (
+                estado.delta.shape[1] if estado.delta is not None else len(vetor))
+            if len(vetor) != dimensao:
+                print(f"[WARN] Embedding com dimensão {len(vetor)} ignorado (índice usa {dimensao}).")
+                return False
+            if atual is not None:
+                self._marcarRemovido(estado, atual)
+
+            delta, vivos_delta, n = estado.delta, estado.vivos_delta, estado.n_delta
+            if delta is None or n == len(delta):
+                # Buffer cheio: dobra a capacidade; buscas em andamento seguem com o buffer antigo
+                capacidade = max(64, 2 * n)
+                novo_delta = np.zeros((capacidade, dimensao), dtype=np.float32)
+                novo_vivos = np.zeros(capacidade, dtype=bool)
+                if n:
+                    novo_delta[:n] = delta[:n]
+                    novo_vivos[:n] = vivos_delta[:n]
+                delta, vivos_delta = novo_delta, novo_vivos
+
+            metadados = extrairMetadados([doc])[0]
+            delta[n] = vetor
+            vivos_delta[n] = True
+            estado.documentos_delta.append(metadados)
+            self.chaves.adicionar(metadados)
+            self.lexico.adicionar(metadados)
+            self._localizacao[chave] = (True, n, versao)
+            self._publicar(EstadoIndice(
+                estado.matriz, estado.documentos, estado.centroides, estado.inicio_listas,
+                delta, estado.documentos_delta, n + 1, estado.vivos, vivos_delta,
+            ))
+            self.marca_dagua = max(self.marca_dagua, versao)
+
+        if atual is not None:
+            self._notificar([chave])
+        self.compactarSeNecessario()
+        return True
+
+    def remover(self, id_documento, versao: float = 0.0) -> bool:
+        """Marca o documento como removido (tombstone); a linha sai na próxima compactação"""
+        with self._trava:
+            self.marca_dagua = max(self.marca_dagua, versao)
+            atual = self._localizacao.pop(str(id_documento), None)
+            if atual is None:
+                return False
+            self._marcarRemovido(self._estado, atual)
+            self.chaves.remover(id_documento)
+            self.lexico.remover(id_documento)
+
+        self._notificar([str(id_documento)])
+        self.compactarSeNecessario()
+        return True
+
+    def _marcarRemovido(self, estado: EstadoIndice, localizacao: Tuple[bool, int, float]) -> None:
+        no_delta, linha, _ = localizacao
+        if no_delta:
+            estado.vivos_delta[linha] = False
+        else:
+            estado.vivos[linha] = False
+        self._removidos += 1
+
+    def compactarSeNecessario(self) -> bool:
+        estado = self._estado
+        total = len(estado.documentos) + estado.n_delta
+        if not total:
+            return False
+        if estado.n_delta > max(self.limite_delta, len(estado.documentos) * self.fracao_compactacao) \
+                or self._removidos > total * self.fracao_compactacao:
+            if self.mapeado:
+                # Delta e tombstones não podem crescer sem limite: a base vira uma cópia privada
+                print(f"[AVISO] Compactando a base mapeada em memória própria do processo {os.getpid()}; "
+                      f"regrave o snapshot para voltar a compartilhá-la.")
+            self.compactar()
+            return True
+        return False
+
+    def compactar(self) -> None:
+        """Funde o delta na base e descarta as linhas mortas, sem reler o MongoDB nem recodificar"""
+        with self._trava:
+            estado = self._estado
+            versoes = {chave: versao for chave, (_, _, versao) in self._localizacao.items()}
+
+            partes = [estado.matriz[estado.vivos]] if len(estado.documentos) else []
+            metadados = [doc for doc, vivo in zip(estado.documentos, estado.vivos) if vivo]
+            if estado.n_delta:
+                vivos_delta = estado.vivos_delta[:estado.n_delta]
+                partes.append(estado.delta[:estado.n_delta][vivos_delta])
+                metadados += [doc for doc, vivo in zip(estado.documentos_delta, vivos_delta) if vivo]
+
+            if metadados:
+                matriz = np.ascontiguousarray(np.vstack(partes))
+            else:
+                matriz = np.zeros((0, 0), dtype=np.float32)
+            novo = self._montarBase(matriz, metadados, retreinar=False)
+            self._reindexar(novo, versoes)
+            self._publicar(novo)
+
+    # === Busca ===
+
+    def _pontuarBase(self, estado: EstadoIndice, vetor: np.ndarray, **parametros) -> Tuple[np.ndarray, np.ndarray]:
+        """Linhas candidatas da base e suas similaridades; a busca exata pontua todas"""
+        return np.arange(len(estado.documentos)), estado.matriz @ vetor
+
+    def buscar(self, consulta, k: int = 5, limiar: float = 0.6, **parametros) -> List[Tuple[Dict, float]]:
+        """Retorna até k pares (documento, similaridade) com similaridade acima do limiar"""
+        estado = self._estado
+        if not estado.documentos and not estado.n_delta:
+            return []
+
+        vetor = normalizarVetores(consulta)[0]
+        segmentos, pontuacoes = [], []
+
+        if estado.documentos:
+            linhas, pontuacao_base = self._pontuarBase(estado, vetor, **parametros)
+            if self._removidos:
+                pontuacao_base = np.where(estado.vivos[linhas], pontuacao_base, -np.inf)
+            segmentos.append((estado.documentos, linhas))
+            pontuacoes.append(pontuacao_base)
+
+        if estado.n_delta:
+            pontuacao_delta = estado.delta[:estado.n_delta] @ vetor
+            pontuacao_delta = np.where(estado.vivos_delta[:estado.n_delta], pontuacao_delta, -np.inf)
+            segmentos.append((estado.documentos_delta, np.arange(estado.n_delta)))
+            pontuacoes.append(pontuacao_delta)
+
+        pontuacoes = np.concatenate(pontuacoes)
+        resultado = []
+        for posicao in self._selecionarMelhores(pontuacoes, k, limiar):
+            deslocamento = posicao
+            for documentos, linhas in segmentos:
+                if deslocamento < len(linhas):
+                    resultado.append((documentos[linhas[deslocamento]], float(pontuacoes[posicao])))
+                    break
+                deslocamento -= len(linhas)
+        return resultado
+
+    def buscarLote(self, consultas, k: int = 5, limiar: float = 0.6, **parametros) -> List[List[Tuple[Dict, float]]]:
+        """Busca várias consultas de uma vez: um único produto matriz-matriz sobre base e delta.
+        Com listas IVF treinadas cada consulta sonda listas diferentes, então a busca é feita uma a uma."""
+        estado = self._estado
+        consultas = normalizarVetores(consultas)
+        if estado.centroides is not None:
+            return [self.buscar(consulta, k, limiar, **parametros) for consulta in consultas]
+        if not estado.documentos and not estado.n_delta:
+            return [[] for _ in consultas]
+
+        blocos = []
+        if estado.documentos:
+            pontuacoes = consultas @ estado.matriz.T
+            if self._removidos:
+                pontuacoes[:, ~estado.vivos] = -np.inf
+            blocos.append(pontuacoes)
+        if estado.n_delta:
+            pontuacoes = consultas @ estado.delta[:estado.n_delta].T
+            pontuacoes[:, ~estado.vivos_delta[:estado.n_delta]] = -np.inf
+            blocos.append(pontuacoes)
+
+        # Posições além da base caem no delta; os documentos são lidos só para os escolhidos
+        n_base = len(estado.documentos)
+        documento = lambda posicao: (estado.documentos[posicao] if posicao < n_base
+                                     else estado.documentos_delta[posicao - n_base])
+        pontuacoes = np.hstack(blocos) if len(blocos) > 1 else blocos[0]
+        return [
+            [(documento(posicao), float(linha[posicao])) for posicao in self._selecionarMelhores(linha, k, limiar)]
+            for linha in pontuacoes
+        ]
+
+    def buscarHibrido(self, texto: str, consulta, k: int = 5, limiar: float = 0.6, candidatos: int = 200,
+                      peso_vetor: float = 0.7, sondagens: int = 2, constante_rrf: int = 60,
+                      **parametros) -> List[Tuple[Dict, float]]:
+        """Busca híbrida: o BM25 escolhe os candidatos e só eles recebem a similaridade vetorial.
+
+        O conjunto pontuado é formado pelos `candidatos` melhores do BM25, pelas linhas das
+        `sondagens` listas IVF mais próximas (nenhuma se o índice não tem centróides) e pelo
+        delta. A ordem funde por RRF (reciprocal rank fusion) as posições no cosseno e no
+        BM25, mas o primeiro resultado é sempre o de maior cosseno, que é o usado pela
+        resposta direta. Sem candidatos léxicos, ou sem nenhum candidato acima do limiar,
+        cai na busca vetorial completa.
+        """
+        encontrados = self.lexico.buscar(texto, candidatos)
+        anotar(candidatos_lexicos=len(encontrados))
+        if not encontrados:
+            return self.buscar(consulta, k, limiar, **parametros)
+        vetor = normalizarVetores(consulta)[0]
+        with self._trava:
+            # Localização e estado lidos juntos: a compactação troca os dois sob a mesma trava
+            estado = self._estado
+            localizacoes = [self._localizacao.get(chave) for chave, _ in encontrados]
+
+        # Linhas candidatas do BM25 (base e delta), na ordem léxica; ids removidos desde a busca ficam de fora
+        localizacoes = [localizacao for localizacao in localizacoes if localizacao is not None]
+        lexicas_delta = np.array([localizacao[0] for localizacao in localizacoes], dtype=bool)
+        lexicas_linhas = np.array([localizacao[1] for localizacao in localizacoes], dtype=np.int64)
+
+        linhas_base = self._sondarBase(estado, vetor, sondagens)
+        if estado.documentos:
+            linhas_base = np.unique(np.concatenate([linhas_base, lexicas_linhas[~lexicas_delta]]))
+            linhas_base = linhas_base[estado.vivos[linhas_base]]
+        linhas_delta = np.flatnonzero(estado.vivos_delta[:estado.n_delta]) if estado.n_delta \
+            else np.zeros(0, dtype=np.int64)
+
+        # Base e delta num só espaço de posições: a linha i do delta vira n_base + i
+        n_base = len(estado.documentos)
+        posicoes = np.concatenate([linhas_base, n_base + linhas_delta])
+        vetoriais = np.concatenate([
+            estado.matriz[linhas_base] @ vetor if len(linhas_base) else np.zeros(0, dtype=np.float32),
+            estado.delta[linhas_delta] @ vetor if len(linhas_delta) else np.zeros(0, dtype=np.float32),
+        ])
+        anotar(candidatos_vetoriais=len(posicoes))
+        acima = np.flatnonzero(vetoriais > limiar)
+        if not len(acima):
+            return self.buscar(consulta, k, limiar, **parametros)
+
+        # RRF: peso_vetor / (c + posição no cosseno) + (1 - peso_vetor) / (c + posição no BM25)
+        acima = acima[np.argsort(-vetoriais[acima], kind="stable")]
+        fusao = peso_vetor / (constante_rrf + 1 + np.arange(len(acima)))
+        lexicas = np.where(lexicas_delta, n_base + lexicas_linhas, lexicas_linhas)
+        ordem_lexica = np.argsort(lexicas, kind="stable")
+        indice_lexico = np.searchsorted(lexicas[ordem_lexica], posicoes[acima])
+        indice_lexico = np.minimum(indice_lexico, max(len(lexicas) - 1, 0))
+        if len(lexicas):
+            encontrada = lexicas[ordem_lexica][indice_lexico] == posicoes[acima]
+            fusao += np.where(encontrada, (1 - peso_vetor) / (constante_rrf + 1 + ordem_lexica[indice_lexico]), 0.0)
+
+        # O de maior cosseno vai primeiro (resposta direta); os demais seguem a fusão
+        restantes = [1 + i for i in self._selecionarMelhores(fusao[1:], k - 1, -np.inf)]
+        documento = lambda posicao: (estado.documentos[posicao] if posicao < n_base
+                                     else estado.documentos_delta[posicao - n_base])
+        return [(documento(int(posicoes[acima[i]])), float(vetoriais[acima[i]])) for i in [0, *restantes]]
+
+    def _sondarBase(self, estado: EstadoIndice, vetor: np.ndarray, sondagens: int) -> np.ndarray:
+        """Linhas da base vizinhas da consulta para a busca híbrida; a busca exata não tem sondagem barata"""
+        return np.zeros(0, dtype=np.int64)
+
+    @staticmethod
+    def _selecionarMelhores(pontuacoes: np.ndarray, k: int, limiar: float) -> List[int]:
+        """Top-k por argpartition; devolve as posições acima do limiar, da maior para a menor"""
+        k = min(k, len(pontuacoes))
+        if k == 0:
+            return []
+        if k < len(pontuacoes):
+            melhores = np.argpartition(-pontuacoes, k - 1)[:k]
+        else:
+            melhores = np.arange(len(pontuacoes))
+        melhores = melhores[np.argsort(-pontuacoes[melhores])]
+        return [int(i) for i in melhores if pontuacoes[i] > limiar]
+
+
+class IndiceIVF(IndiceVetorial):
+    """Busca aproximada por lista invertida (IVF) sobre centróides de k-means esférico.
+
+    A matriz é reordenada por lista, de modo que cada lista é uma fatia contígua
+    e a consulta pontua apenas as `n_sondagens` listas mais próximas. Abaixo de
+    `minimo_documentos` o índice não treina centróides e faz busca exata.
+    """
+
+    def __init__(self, n_listas: int = 0, n_sondagens: int = 8, minimo_documentos: int = 20000,
+                 iteracoes: int = 10, semente: int = 42, **opcoes):
+        super().__init__(**opcoes)
+        self.n_listas = n_listas  # 0 = automático (~4 * raiz de N)
+        self.n_sondagens = n_sondagens
+        self.minimo_documentos = minimo_documentos
+        self.iteracoes = iteracoes
+        self.semente = semente
+
+    def _montarBase(self, matriz: np.ndarray, metadados: List[Dict], retreinar: bool = True) -> EstadoIndice:
+        """Distribui as linhas nas listas; na compactação reaproveita os centróides já treinados"""
+        if len(metadados) < max(self.minimo_documentos, 1):
+            return EstadoIndice(matriz, metadados)
+
+        centroides = None if retreinar else self._estado.centroides
+        if centroides is None:
+            n_listas = self.n_listas or int(4 * np.sqrt(len(metadados)))
+            n_listas = max(1, min(n_listas, len(metadados)))
+            centroides = self._treinarCentroides(matriz, n_listas)
+        atribuicao = self._atribuir(matriz, centroides)
+
+        # Reordena linhas por lista: cada lista vira uma fatia contígua da matriz
+        ordem = np.argsort(atribuicao, kind="stable")
+        inicio_listas = np.zeros(len(centroides) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(atribuicao, minlength=len(centroides)), out=inicio_listas[1:])
+
+        matriz = np.ascontiguousarray(matriz[ordem])
+        metadados = [metadados[i] for i in ordem]
+        return EstadoIndice(matriz, metadados, centroides, inicio_listas)
+
+    def _treinarCentroides(self, matriz: np.ndarray, n_listas: int) -> np.ndarray:
+        """k-means esférico (Lloyd) sobre uma amostra da base"""
+        gerador = np.random.default_rng(self.semente)
+        tamanho_amostra = min(len(matriz), n_listas * 64)
+        amostra = matriz[gerador.choice(len(matriz), tamanho_amostra, replace=False)]
+        centroides = amostra[gerador.choice(len(amostra), n_listas, replace=False)].copy()
+
+        for _ in range(self.iteracoes):
+            atribuicao = self._atribuir(amostra, centroides)
+            somas = np.zeros_like(centroides)
+            np.add.at(somas, atribuicao, amostra)
+            contagens = np.bincount(atribuicao, minlength=n_listas)
+
+            # Listas vazias recebem um ponto aleatório da amostra
+            vazias = np.flatnonzero(contagens == 0)
+            if len(vazias):
+                somas[vazias] = amostra[gerador.choice(len(amostra), len(vazias), replace=False)]
+            centroides = normalizarVetores(somas)
+
+        return centroides
+
+    @staticmethod
+    def _atribuir(matriz: np.ndarray, centroides: np.ndarray, tamanho_bloco: int = 8192) -> np.ndarray:
+        """Centróide mais próximo de cada linha, em blocos para limitar memória"""
+        atribuicao = np.empty(len(matriz), dtype=np.int64)
+        for inicio in range(0, len(matriz), tamanho_bloco):
+            bloco = matriz[inicio:inicio + tamanho_bloco]
+            atribuicao[inicio:inicio + tamanho_bloco] = np.argmax(bloco @ centroides.T, axis=1)
+        return atribuicao
+
+    def _listasProximas(self, estado: EstadoIndice, vetor: np.ndarray, n_sondagens: int) -> List[Tuple[int, int]]:
+        """Fatias [início, fim) da matriz das `n_sondagens` listas de centróide mais próximo"""
+        n_sondagens = min(n_sondagens, len(estado.centroides))
+        proximidade = estado.centroides @ vetor
+        listas = np.argpartition(-proximidade, n_sondagens - 1)[:n_sondagens]
+        return [(estado.inicio_listas[l], estado.inicio_listas[l + 1]) for l in listas]
+
+    def _pontuarBase(self, estado: EstadoIndice, vetor: np.ndarray,
+                     n_sondagens: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Pontua só as listas mais próximas da consulta; exata se o índice não foi treinado"""
+        if estado.centroides is None:
+            return super()._pontuarBase(estado, vetor)
+
+        fatias = self._listasProximas(estado, vetor, n_sondagens or self.n_sondagens)
+        linhas = np.concatenate([np.arange(a, b) for a, b in fatias])
+        pontuacoes = np.concatenate([estado.matriz[a:b] @ vetor for a, b in fatias])
+        return linhas, pontuacoes
+
+    def _sondarBase(self, estado: EstadoIndice, vetor: np.ndarray, sondagens: int) -> np.ndarray:
+        if estado.centroides is None or sondagens <= 0:
+            return super()._sondarBase(estado, vetor, sondagens)
+        return np.concatenate([np.arange(a, b) for a, b in self._listasProximas(estado, vetor, sondagens)])
+
+
+def criarIndice(tipo: Optional[str] = None) -> IndiceVetorial:
+    """Cria o índice configurado em INDICE_TIPO ("exato" ou "ivf")"""
+    tipo = (tipo or os.getenv("INDICE_TIPO", "ivf")).lower()
+    opcoes = {
+        "limite_delta": int(os.getenv("INDICE_LIMITE_DELTA", 1024)),
+        "fracao_compactacao": float(os.getenv("INDICE_FRACAO_COMPACTACAO", 0.1)),
+    }
+    if tipo == "exato":
+        return IndiceVetorial(**opcoes)
+    if tipo == "ivf":
+        return IndiceIVF(
+            n_listas=int(os.getenv("IVF_LISTAS", 0)),
+            n_sondagens=int(os.getenv("IVF_SONDAGENS", 8)),
+            minimo_documentos=int(os.getenv("IVF_MINIMO_DOCUMENTOS", 20000)),
+            **opcoes,
+        )
+    raise ValueError(f"Tipo de índice desconhecido: {tipo}")
+
+
+class SincronizadorIndice:
+    """Mantém o índice deste worker em dia com escritas feitas por outros workers.
+
+    Usa um change stream do MongoDB quando disponível (replica set) e, caso
+    contrário, consulta periodicamente os documentos com `atualizado_em` acima
+    da marca d'água do índice. A compactação periódica também roda aqui.
+    """
+
+    def __init__(self, indice: IndiceVetorial, colecao, filtro: Optional[Dict] = None,
+                 intervalo: float = 5.0, folga: float = 2.0):
+        self.indice = indice
+        self.colecao = colecao
+        self.filtro = filtro or {}
+        self.intervalo = intervalo
+        self.folga = folga  # tolerância a relógios dessincronizados entre workers
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def aplicar(self, doc: Dict) -> bool:
+        """Aplica um documento alterado: remoção lógica vira tombstone, o resto é upsert"""
+        if doc.get("removido"):
+            return self.indice.remover(doc["_id"], instante(doc.get("atualizado_em")))
+        vetor = lerEmbedding(doc.get("embedding"))
+        if not textoIndexado(doc) or vetor is None:
+            return False
+        return self.indice.adicionar(doc, vetor)
+
+    def sincronizar(self) -> int:
+        """Busca e aplica tudo que mudou desde a marca d'água; devolve quantos foram aplicados"""
+        desde = datetime.fromtimestamp(max(self.indice.marca_dagua - self.folga, 0), timezone.utc)
+        consulta = {"$and": [self.filtro, {"atualizado_em": {"$gt": desde}}]}
+        aplicados = 0
+        for doc in self.colecao.find(consulta).sort("atualizado_em", 1):
+            if self.aplicar(doc):
+                aplicados += 1
+        return aplicados
+
+    def iniciar(self) -> None:
+        if self._thread is not None:
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, name="sincronizador-indice", daemon=True)
+        self._thread.start()
+
+    def parar(self) -> None:
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.intervalo + 1)
+            self._thread = None
+
+    def _executar(self) -> None:
+        while not self._parar.is_set():
+            try:
+                self._acompanharChangeStream()
+            except Exception as e:
+                # Sem replica set (ou stream interrompido): segue por consulta periódica
+                print(f"[INFO] Change stream indisponível ({e}); sincronizando por consulta periódica.")
+                self._acompanharPorConsulta()
+
+    def _acompanharChangeStream(self) -> None:
+        condicoes = {f"fullDocument.{campo}": valor for campo, valor in self.filtro.items()}
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}, **condicoes}}]
+        with self.colecao.watch(pipeline, full_document="updateLookup") as stream:
+            # O que mudou antes do stream abrir é recuperado pela consulta
+            self.sincronizar()
+            while not self._parar.is_set():
+                mudanca = stream.try_next()
+                if mudanca is None:
+                    self.indice.compactarSeNecessario()
+                    self._parar.wait(0.5)
+                    continue
+                if mudanca.get("fullDocument"):
+                    self.aplicar(mudanca["fullDocument"])
+
+    def _acompanharPorConsulta(self) -> None:
+        while not self._parar.is_set():
+            try:
+                self.sincronizar()
+                self.indice.compactarSeNecessario()
+            except Exception as e:
+                print(f"[ERRO] Falha ao sincronizar índice: {e}")
+            self._parar.wait(self.intervalo)
+
@@ -0,0 +1,202 @@
+import re
+import math
+import threading
+import unicodedata
+import numpy as np
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+# Palavras frequentes demais para ajudar a separar documentos
+STOPWORDS = {
+    "a", "o", "as", "os", "de", "da", "do", "das", "dos", "e", "em", "na", "no", "nas", "nos",
+    "um", "uma", "uns", "umas", "para", "pra", "por", "com", "sem", "que", "se", "ao", "aos",
+    "como", "qual", "quais", "quando", "onde", "porque", "pois", "ja", "nao", "sim", "mais",
+    "menos", "muito", "ou", "ser", "esta", "este", "essa", "esse", "isso", "isto", "foi", "sao",
+    "tem", "ter", "ha", "meu", "minha", "seu", "sua", "eu", "voce", "ele", "ela", "me", "lhe",
+}
+
+
+PADRAO_HIFEN = re.compile(r"(\w)-(\w)")
+PADRAO_TERMO = re.compile(r"\w+")
+
+
+def tokenizar(texto: str) -> List[str]:
+    """Minúsculas sem acento; siglas com hífen viram um termo só (NF-e -> nfe, CT-e -> cte)"""
+    texto = unicodedata.normalize("NFKD", (texto or "").lower()).encode("ascii", "ignore").decode("ascii")
+    texto = PADRAO_HIFEN.sub(r"\1\2", texto)
+    return [
+        termo for termo in PADRAO_TERMO.findall(texto)
+        if termo not in STOPWORDS and (len(termo) > 1 or termo.isdigit())
+    ]
+
+
+def textoLexico(doc: Dict) -> str:
+    return " ".join(doc.get(campo) or "" for campo in ("pergunta", "resposta", "texto"))
+
+
+class IndiceBM25:
+    """Índice invertido com pontuação BM25 sobre pergunta, resposta e texto dos documentos.
+
+    As listas de cada termo ficam em dicionários (fáceis de editar) e, na primeira
+    consulta depois de uma mudança, são copiadas para arrays NumPy (posição do
+    documento, frequência e tamanho), ordenados pela contribuição BM25. A pontuação
+    é vetorizada, acumulada só nas posições tocadas, e cada termo contribui com
+    no máximo `limite_postings` documentos: termos comuns entram só com os
+    documentos em que pesam mais.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, limite_postings: int = 5000):
+        self.k1 = k1
+        self.b = b
+        self.limite_postings = limite_postings
+        self._listas: Dict[str, Dict[str, int]] = {}  # termo -> {_id: frequência no documento}
+        self._tamanhos: Dict[str, int] = {}  # _id -> quantidade de termos
+        self._termos: Dict[str, List[str]] = {}  # _id -> termos distintos (para remoção)
+        self._soma_tamanhos = 0
+        self._posicoes: Dict[str, int] = {}  # _id -> posição no vetor de pontuações
+        self._ids: List[str] = []  # posição -> _id
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}  # termo -> arrays da lista
+        self._acumulador = np.zeros(0, dtype=np.float32)  # pontuação por posição, zerado após cada consulta
+        self._trava = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tamanhos)
+
+    def construir(self, documentos: Iterable[Dict]) -> None:
+        with self._trava:
+            self._listas, self._tamanhos, self._termos, self._soma_tamanhos = {}, {}, {}, 0
+            self._posicoes, self._ids, self._postings = {}, [], {}
+            for doc in documentos:
+                self._adicionar(str(doc["_id"]), textoLexico(doc))
+
+    def frequencias(self, id_documento) -> Dict[str, int]:
+        """Frequência de cada termo do documento (usado ao gravar o snapshot)"""
+        with self._trava:
+            chave = str(id_documento)
+            return {termo: self._listas[termo][chave] for termo in self._termos.get(chave, [])}
+
+    def construirDeFrequencias(self, ids: List[str], vocabulario: List[str], inicio: np.ndarray,
+                               termos: np.ndarray, frequencias: np.ndarray) -> None:
+        """Monta o índice já tokenizado (do snapshot): os termos do documento i são
+        vocabulario[termos[inicio[i]:inicio[i + 1]]], com as respectivas frequências"""
+        linhas = np.repeat(np.arange(len(ids)), np.diff(inicio))
+        # Agrupa por termo mantendo a ordem dos documentos, como na construção normal
+        ordem = np.argsort(termos, kind="stable")
+        termos_ordenados = termos[ordem]
+        cortes = np.flatnonzero(np.diff(termos_ordenados)) + 1
+        ids_ordenados = np.array(ids, dtype=object)[linhas[ordem]].tolist()
+        frequencias_ordenadas = frequencias[ordem].tolist()
+        listas = {
+            vocabulario[termos_ordenados[a]]: dict(zip(ids_ordenados[a:b], frequencias_ordenadas[a:b]))
+            for a, b in zip(np.r_[0, cortes].tolist(), np.r_[cortes, len(ordem)].tolist()) if a < b
+        }
+
+        tamanhos_linha = np.bincount(linhas, weights=frequencias, minlength=len(ids)).astype(np.int64).tolist()
+        termos_linha = np.array(vocabulario, dtype=object)[termos].tolist()
+        inicio = inicio.tolist()
+        tamanhos, termos_documento = {}, {}
+        for i, id_documento in enumerate(ids):
+            if inicio[i] < inicio[i + 1]:
+                tamanhos[id_documento] = tamanhos_linha[i]
+                termos_documento[id_documento] = termos_linha[inicio[i]:inicio[i + 1]]
+        with self._trava:
+            self._listas, self._tamanhos, self._termos = listas, tamanhos, termos_documento
+            self._soma_tamanhos = sum(tamanhos_linha)
+            self._ids = list(ids)
+            self._posicoes = {id_documento: i for i, id_documento in enumerate(self._ids)}
+            self._postings = {}
+
+    def adicionar(self, doc: Dict) -> None:
+        with self._trava:
+            self._remover(str(doc["_id"]))
+            self._adicionar(str(doc["_id"]), textoLexico(doc))
+
+    def remover(self, id_documento) -> None:
+        with self._trava:
+            self._remover(str(id_documento))
+
+    def buscar(self, texto: str, limite: int = 200) -> List[Tuple[str, float]]:
+        """Até `limite` pares (_id, pontuação BM25), do mais ao menos relevante"""
+        termos = set(tokenizar(texto))
+        with self._trava:
+            total = len(self._tamanhos)
+            if not total or not termos:
+                return []
+            media = self._soma_tamanhos / total
+
+            # Acumulador reaproveitado entre consultas (sob a trava): só as postings tocadas são
+            # somadas, lidas e zeradas de volta, nunca um vetor do tamanho da base
+            if len(self._acumulador) < len(self._ids):
+                self._acumulador = np.zeros(max(len(self._ids), 2 * len(self._acumulador)), dtype=np.float32)
+            acumulador, tocadas = self._acumulador, []
+            for termo in termos:
+                if termo not in self._listas:
+                    continue
+                quantidade = len(self._listas[termo])
+                posicoes, frequencias, tamanhos = self._arrays(termo, media)
+                posicoes = posicoes[:self.limite_postings]
+                frequencias = frequencias[:self.limite_postings]
+                tamanhos = tamanhos[:self.limite_postings]
+
+                idf = math.log(1 + (total - quantidade + 0.5) / (quantidade + 0.5))
+                normalizacao = self.k1 * (1 - self.b + self.b * tamanhos / media)
+                # Posições únicas dentro de uma lista: a soma indexada não perde valores
+                acumulador[posicoes] += idf * frequencias * (self.k1 + 1) / (frequencias + normalizacao)
+                tocadas.append(posicoes)
+            if not tocadas:
+                return []
+
+            posicoes = tocadas[0] if len(tocadas) == 1 else np.concatenate(tocadas)
+            pontuacoes = acumulador[posicoes]
+            acumulador[posicoes] = 0.0
+            ids = self._ids
+
+        # Um documento com vários termos aparece repetido: escolhe com folga e deduplica no fim
+        folga = min(len(pontuacoes), limite * len(tocadas))
+        melhores = np.argpartition(-pontuacoes, folga - 1)[:folga] if folga < len(pontuacoes) \
+            else np.arange(len(pontuacoes))
+        melhores = melhores[np.argsort(-pontuacoes[melhores], kind="stable")]
+        _, primeiras = np.unique(posicoes[melhores], return_index=True)
+        melhores = melhores[np.sort(primeiras)][:limite]
+        return [(ids[posicao], float(pontuacao)) for posicao, pontuacao in
+                zip(posicoes[melhores].tolist(), pontuacoes[melhores].tolist())]
+
+    def _arrays(self, termo: str, media: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Lista do termo como arrays, da maior para a menor contribuição (calculada com a
+        média de tamanho do momento; serve só para escolher quem entra no limite)"""
+        arrays = self._postings.get(termo)
+        if arrays is None:
+            lista = self._listas[termo]
+            posicoes = np.fromiter((self._posicoes[i] for i in lista), dtype=np.int64, count=len(lista))
+            frequencias = np.fromiter(lista.values(), dtype=np.float32, count=len(lista))
+            tamanhos = np.fromiter((self._tamanhos[i] for i in lista), dtype=np.float32, count=len(lista))
+            contribuicao = frequencias / (frequencias + self.k1 * (1 - self.b + self.b * tamanhos / media))
+            ordem = np.argsort(-contribuicao, kind="stable")
+            arrays = self._postings[termo] = (posicoes[ordem], frequencias[ordem], tamanhos[ordem])
+        return arrays
+
+    def _adicionar(self, id_documento: str, texto: str) -> None:
+        frequencias = Counter(tokenizar(texto))
+        if not frequencias:
+            return
+        if id_documento not in self._posicoes:
+            self._posicoes[id_documento] = len(self._ids)
+            self._ids.append(id_documento)
+        for termo, frequencia in frequencias.items():
+            self._listas.setdefault(termo, {})[id_documento] = frequencia
+            self._postings.pop(termo, None)
+        tamanho = sum(frequencias.values())
+        self._tamanhos[id_documento] = tamanho
+        self._termos[id_documento] = list(frequencias)
+        self._soma_tamanhos += tamanho
+
+    def _remover(self, id_documento: str) -> None:
+        # A posição do _id continua reservada: se o documento voltar, reaproveita a mesma
+        for termo in self._termos.pop(id_documento, []):
+            self._postings.pop(termo, None)
+            lista = self._listas.get(termo)
+            if lista is not None:
+                lista.pop(id_documento, None)
+                if not lista:
+                    del self._listas[termo]
+        self._soma_tamanhos -= self._tamanhos.pop(id_documento, 0)
@@ -1,42 +1,91 @@
-from fastapi import FastAPI, HTTPException, status, Depends
+import time
+INICIO_PROCESSO = time.perf_counter()  # referência para o tempo total de boot do worker
+
+from fastapi import FastAPI, HTTPException, status, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.security import OAuth2PasswordBearer
-from typing import List
-from schemas import PerguntaEntrada, MensagemEntrada, RedefinirSenha, RecuperacaoSenha
+from typing import List, Optional
+from schemas import PerguntaEntrada, PerguntasEmLote, MensagemEntrada, RedefinirSenha, RecuperacaoSenha
 from models import UsuarioLogin, Token
-from auth import create_access_token
-from rag import recuperarInfoRelevantes, gerarRespostaComIa, registrarInteracao, modelo_embedding
-from pymongo import MongoClient
+from auth import create_access_token, CHAVE_SECRETA, ALGORITMO
+from rag import (
+    recuperarComPontuacaoAsync, gerarRespostaComCacheAsync, gerarRespostaComCacheStreamAsync,
+    registrarInteracaoAsync, carregarIndiceAsync, cache_respostas, servico_embedding,
+    adicionarConhecimento, atualizarConhecimento, removerConhecimento, sincronizador_indice,
+    armazem_sessoes, GerenciadorContexto, gravador_interacoes, responderPorChave, indice_conhecimento,
+    responderEmLoteAsync, cliente_ia, iaSobrecarregada, LIMITE_BACKLOG_IA,
+)
+import rag
+from admissao import ControleAdmissao, LimitadorTaxa, MiddlewareAdmissao
+from metricas import MiddlewareRastreamento, registro_metricas
+from database import colecao_usuarios, criarIndices
 from dotenv import load_dotenv
 from jose import JWTError, jwt
-from bson import json_util
+from bson import json_util, ObjectId
+from bson.errors import InvalidId
 from datetime import timedelta
 from email.message import EmailMessage
 import os
+import asyncio
 import bcrypt
 import json
 import smtplib
 import traceback
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from datetime import timedelta
 
 # === Configurações ===
 load_dotenv()
-MONGO_URI = os.getenv("MONGO_URI")
-SECRET_KEY = os.getenv("SECRET_KEY", "sua_chave_secreta")  # Substitua por sua chave real
-ALGORITHM = "HS256"
-
-# Conecta ao MongoDB
-client = MongoClient(MONGO_URI)
-db = client["tekbot"]
-colecao_usuarios = db["usuarios"]
-colecao_mensagens = db["mensagens"]
+# Chave e algoritmo do JWT vêm de auth.py, o mesmo módulo que assina os tokens
 
 # Inicializa FastAPI
 app = FastAPI()
 
+
+def sujeito_token(authorization: Optional[str]) -> Optional[str]:
+    """E-mail (sub) do token JWT do cabeçalho Authorization; None se ausente ou inválido.
+    Valida com a mesma chave e algoritmo que assinam o token no login (auth.py)."""
+    if authorization and authorization.lower().startswith("bearer "):
+        try:
+            return jwt.decode(authorization[7:], CHAVE_SECRETA, algorithms=[ALGORITMO]).get("sub")
+        except JWTError:
+            pass
+    return None
+
+
+def chave_limite_taxa(cabecalhos: dict, ip: Optional[str]) -> str:
+    """Limite por usuário logado; sem login, por IP"""
+    email = sujeito_token(cabecalhos.get("authorization"))
+    return f"usuario:{email}" if email else f"ip:{ip}"
+
+
+# === Controle de admissão ===
+# Rajadas além da capacidade recebem 503/429 com Retry-After na hora, em vez de esperar sem limite
+ROTAS_RESPOSTA = ["/pergunta", "/ia/responder", "/ia/responder/stream", "/ia/responder/lote"]
+controle_admissao = ControleAdmissao(
+    max_em_andamento=int(os.getenv("ADMISSAO_MAX_EM_ANDAMENTO", 32)),
+    max_fila=int(os.getenv("ADMISSAO_MAX_FILA", 64)),
+    espera_maxima=float(os.getenv("ADMISSAO_ESPERA_MAXIMA_SEGUNDOS", 2)),
+)
+limitador_taxa = LimitadorTaxa(
+    taxa=float(os.getenv("LIMITE_TAXA_POR_SEGUNDO", 1)),
+    rajada=int(os.getenv("LIMITE_TAXA_RAJADA", 10)),
+)
+# Adicionado antes do CORS para que as recusas também levem os cabeçalhos de CORS
+app.add_middleware(
+    MiddlewareAdmissao,
+    controle=controle_admissao,
+    limitador=limitador_taxa,
+    caminhos=ROTAS_RESPOSTA,
+    identificar=chave_limite_taxa,
+)
+# Por fora da admissão, para que as recusas 429/503 também sejam contadas
+app.add_middleware(
+    MiddlewareRastreamento,
+    amostragem=float(os.getenv("RASTREAMENTO_AMOSTRAGEM", 0.01)),
+    limiar_lento_ms=float(os.getenv("RASTREAMENTO_LIMIAR_LENTO_MS", 0)),
+)
+
 # Configurar o CORS
 app.add_middleware(
     CORSMiddleware,
@@ -52,7 +101,7 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 def verificar_token(token: str = Depends(oauth2_scheme)):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, CHAVE_SECRETA, algorithms=[ALGORITMO])
         email = payload.get("sub")
         if email is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
@@ -61,6 +110,18 @@ def verificar_token(token: str = Depends(oauth2_scheme)):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
 
 
+def obter_sessao(authorization: Optional[str] = Header(None),
+                 x_sessao_id: Optional[str] = Header(None)) -> GerenciadorContexto:
+    """Sessão de conversa da requisição: do usuário do token JWT ou, sem login, do cabeçalho X-Sessao-Id.
+    Sem nenhum dos dois a conversa não tem continuidade: a sessão é descartável e não vai para `sessoes`."""
+    email = sujeito_token(authorization)
+    if email:
+        return armazem_sessoes.obter(f"usuario:{email}")
+    if x_sessao_id:
+        return armazem_sessoes.obter(f"sessao:{x_sessao_id[:64]}")
+    return GerenciadorContexto(efemera=True)
+
+
 def enviarEmailRecuperacao(destinatario: str, token: str):
     email_remetente = os.getenv("EMAIL_REMETENTE")
     email_senha = os.getenv("EMAIL_SENHA")
@@ -88,6 +149,96 @@ Se você não fez essa solicitação, ignore este e-mail.
         smtp.send_message(msg)
 
 
+# === Inicialização ===
+# O servidor aceita conexões logo após importar; modelo, índice e aquecimento rodam em segundo
+# plano. /health responde desde o início, /ready só depois que tudo estiver carregado.
+estado_inicializacao = {"pronto": False, "fases": {}, "erros": []}
+tarefa_inicializacao: Optional[asyncio.Task] = None
+
+
+async def executar_fase(nome: str, corrotina) -> bool:
+    """Executa uma fase do boot, registrando a duração ou o erro"""
+    inicio = time.perf_counter()
+    try:
+        await corrotina
+    except Exception as e:
+        estado_inicializacao["erros"].append(f"{nome}: {e}")
+        print(f"[ERRO] Falha na inicialização ({nome}): {e}")
+        return False
+    estado_inicializacao["fases"][nome] = round(time.perf_counter() - inicio, 3)
+    print(f"[INFO] Inicialização: {nome} em {estado_inicializacao['fases'][nome]:.2f}s")
+    return True
+
+
+async def inicializar():
+    estado_inicializacao["fases"]["importacao"] = round(time.perf_counter() - INICIO_PROCESSO, 3)
+    await executar_fase("indices_mongodb", asyncio.to_thread(criarIndices))
+
+    # Modelo de embeddings (com um forward pass de aquecimento) e índice vetorial carregam em paralelo:
+    # a carga do índice só espera pelo modelo se algum documento estiver sem embedding.
+    # Com gunicorn --preload o índice já vem do processo mestre e só o que mudou depois é sincronizado.
+    fases = [executar_fase("modelo_e_aquecimento", asyncio.to_thread(servico_embedding.aquecer))]
+    if not indice_conhecimento.carregado:
+        fases.append(executar_fase("indice_vetorial", carregarIndiceAsync()))
+    modelo_ok, *indice_ok = await asyncio.gather(*fases)
+    indice_ok = all(indice_ok)
+    await executar_fase("cliente_gemini", asyncio.to_thread(lambda: cliente_ia.modelo))
+
+    # Acompanha inclusões, edições e remoções feitas por outros workers
+    sincronizador_indice.iniciar()
+    estado_inicializacao["pronto"] = modelo_ok and indice_ok
+    estado_inicializacao["fases"]["total"] = round(time.perf_counter() - INICIO_PROCESSO, 3)
+    if estado_inicializacao["pronto"]:
+        print(f"[OK] Worker pronto em {estado_inicializacao['fases']['total']:.2f}s: {estado_inicializacao['fases']}")
+
+
+@app.on_event("startup")
+async def iniciar_worker():
+    global tarefa_inicializacao
+    gravador_interacoes.iniciar()
+    tarefa_inicializacao = asyncio.create_task(inicializar())
+
+
+def exigir_pronto():
+    """Rotas de resposta só atendem depois do boot (modelo aquecido e índice carregado)"""
+    if not estado_inicializacao["pronto"]:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Servidor iniciando",
+                            headers={"Retry-After": "5"})
+
+
+@app.get("/health")
+def saude():
+    # Processo vivo e atendendo: não depende de modelo, índice ou banco
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+def prontidao():
+    corpo = {"pronto": estado_inicializacao["pronto"], "fases": estado_inicializacao["fases"],
+             "erros": estado_inicializacao["erros"]}
+    if not estado_inicializacao["pronto"]:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=corpo)
+    return corpo
+
+
+@app.on_event("shutdown")
+def parar_sincronizador_indice():
+    if tarefa_inicializacao and not tarefa_inicializacao.done():
+        tarefa_inicializacao.cancel()
+    sincronizador_indice.parar()
+    # Salva as conversas ainda em memória para serem retomadas depois
+    armazem_sessoes.salvarTodas()
+    # Grava os registros de interação que ainda estão na fila
+    gravador_interacoes.parar()
+
+
+def converterObjectId(id_documento: str) -> ObjectId:
+    try:
+        return ObjectId(id_documento)
+    except InvalidId:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Identificador inválido")
+
+
 # === ROTAS ===
 
 @app.post("/login", response_model=Token)
@@ -118,13 +269,20 @@ def register_user(usuario: UsuarioLogin):
     return usuario
 
 
-@app.post("/pergunta")
-def responder_pergunta(pergunta_entrada: PerguntaEntrada):
+@app.post("/pergunta", dependencies=[Depends(exigir_pronto)])
+async def responder_pergunta(pergunta_entrada: PerguntaEntrada, sessao: GerenciadorContexto = Depends(obter_sessao)):
     try:
         pergunta = pergunta_entrada.pergunta
-        contexto = recuperarInfoRelevantes(pergunta)
-        resposta = gerarRespostaComIa(contexto, pergunta)
-        registrarInteracao(pergunta, resposta, [doc.get("texto", "") for doc in contexto])
+        doc_chave = responderPorChave(pergunta, sessao)
+        if doc_chave:
+            resposta = doc_chave.get("resposta") or doc_chave.get("texto", "")
+            await registrarInteracaoAsync(pergunta, resposta, [doc_chave], sessao)
+            return {"resposta": resposta}
+
+        resultados, pergunta_embedding = await recuperarComPontuacaoAsync(pergunta, sessao)
+        contexto = [doc for doc, sim in resultados]
+        resposta = await gerarRespostaComCacheAsync(contexto, pergunta, pergunta_embedding, sessao=sessao)
+        await registrarInteracaoAsync(pergunta, resposta, contexto, sessao)
         return {"resposta": resposta}
     except Exception as e:
         print(f"[ERROR] Erro ao processar a pergunta: {e}")
@@ -138,63 +296,82 @@ def adicionar_mensagem(mensagem: MensagemEntrada):
         if not texto:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Texto vazio não permitido")
 
-        embedding = modelo_embedding.encode([texto])[0]
-        doc = {
-            "texto": texto,
-            "embedding": embedding.tolist()
-        }
-
-        resultado = colecao_mensagens.insert_one(doc)
+        id_inserido = adicionarConhecimento({"texto": texto})
 
         return JSONResponse(
             content=json.loads(json_util.dumps({
                 "mensagem": "Mensagem adicionada com sucesso",
-                "id": resultado.inserted_id
+                "id": id_inserido
             })),
             status_code=200
         )
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"[ERROR] Erro ao adicionar mensagem: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Erro ao salvar a mensagem")
 
 
-@app.post("/ia/responder")
-def responder(pergunta_req: PerguntaEntrada):
-    pergunta = pergunta_req.pergunta.strip()
+@app.put("/mensagens/{id_mensagem}")
+def editar_mensagem(id_mensagem: str, mensagem: MensagemEntrada):
+    texto = mensagem.texto.strip()
+    if not texto:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Texto vazio não permitido")
 
     try:
-        documentos_relevantes = recuperarInfoRelevantes(pergunta)
+        atualizado = atualizarConhecimento(converterObjectId(id_mensagem), {"texto": texto})
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[ERROR] Erro ao editar mensagem: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Erro ao editar a mensagem")
 
-        # Cálculo da similaridade para checar se já existe resposta alta
-        pergunta_embedding = modelo_embedding.encode([pergunta]).reshape(1, -1)
+    if not atualizado:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Mensagem não encontrada")
+    return {"mensagem": "Mensagem atualizada com sucesso"}
 
-        melhor_doc = None
-        maior_similaridade = 0
 
-        for doc in documentos_relevantes:
+@app.delete("/mensagens/{id_mensagem}")
+def remover_mensagem(id_mensagem: str):
+    try:
+        removido = removerConhecimento(converterObjectId(id_mensagem))
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[ERROR] Erro ao remover mensagem: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Erro ao remover a mensagem")
 
-            embedding_doc = np.array(doc.get("embedding", []))
-            if embedding_doc.size == 0:
+    if not removido:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Mensagem não encontrada")
+    return {"mensagem": "Mensagem removida com sucesso"}
 
-                embedding_doc = modelo_embedding.encode([doc.get("texto", "")])[0]
-            embedding_doc = embedding_doc.reshape(1, -1)
 
-            sim = cosine_similarity(pergunta_embedding, embedding_doc)[0][0]
-            if sim > maior_similaridade:
-                maior_similaridade = sim
-                melhor_doc = doc
+@app.post("/ia/responder", dependencies=[Depends(exigir_pronto)])
+async def responder(pergunta_req: PerguntaEntrada, sessao: GerenciadorContexto = Depends(obter_sessao)):
+    pergunta = pergunta_req.pergunta.strip()
+
+    try:
+        # Código de rejeição/CFOP/CST conhecido: resposta exata, sem embedding nem IA
+        doc_chave = responderPorChave(pergunta, sessao)
+        if doc_chave:
+            resultados, pergunta_embedding = [(doc_chave, 1.0)], None
+        else:
+            # A recuperação já devolve a similaridade de cada documento, sem nova codificação
+            resultados, pergunta_embedding = await recuperarComPontuacaoAsync(pergunta, sessao)
+        documentos_relevantes = [doc for doc, sim in resultados]
+        melhor_doc, maior_similaridade = resultados[0] if resultados else (None, 0)
 
         LIMIAR_SIMILARIDADE = 0.9  # ajuste conforme necessário
 
         if melhor_doc and maior_similaridade >= LIMIAR_SIMILARIDADE:
             # Retorna a resposta já existente para similaridade alta
-            resposta = melhor_doc.get("resposta", melhor_doc.get("texto", ""))
-            registrarInteracao(pergunta, resposta, [melhor_doc])
+            resposta = melhor_doc.get("resposta") or melhor_doc.get("texto", "")
+            await registrarInteracaoAsync(pergunta, resposta, [melhor_doc], sessao)
             return {"resposta": resposta}
 
-        # gera resposta via IA
-        resposta = gerarRespostaComIa(documentos_relevantes, pergunta)
-        registrarInteracao(pergunta, resposta, documentos_relevantes)
+        # gera resposta via IA (ou reaproveita uma resposta gerada para pergunta equivalente)
+        resposta = await gerarRespostaComCacheAsync(documentos_relevantes, pergunta, pergunta_embedding, sessao=sessao)
+        await registrarInteracaoAsync(pergunta, resposta, documentos_relevantes, sessao)
         return {"resposta": resposta}
 
     except Exception as e:
@@ -202,6 +379,150 @@ def responder(pergunta_req: PerguntaEntrada):
         raise HTTPException(status_code=500, detail="Erro interno ao processar a resposta.")
 
 
+@app.post("/ia/responder/lote", dependencies=[Depends(exigir_pronto)])
+async def responder_lote(lote: PerguntasEmLote):
+    # Perguntas independentes (ex.: rejeições de um lote de NF-e) respondidas numa única requisição
+    try:
+        return {"respostas": await responderEmLoteAsync(lote.perguntas)}
+    except Exception as e:
+        print(f"[ERROR] Erro ao responder lote: {e}")
+        raise HTTPException(status_code=500, detail="Erro interno ao processar o lote.")
+
+
+def eventoSse(evento: str, dados: dict) -> str:
+    return f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+
+@app.post("/ia/responder/stream", dependencies=[Depends(exigir_pronto)])
+async def responder_stream(pergunta_req: PerguntaEntrada, sessao: GerenciadorContexto = Depends(obter_sessao)):
+    # Mesma lógica de /ia/responder, mas envia a resposta em trechos (server-sent events)
+    pergunta = pergunta_req.pergunta.strip()
+
+    try:
+        doc_chave = responderPorChave(pergunta, sessao)
+        if doc_chave:
+            resultados, pergunta_embedding = [(doc_chave, 1.0)], None
+        else:
+            resultados, pergunta_embedding = await recuperarComPontuacaoAsync(pergunta, sessao)
+    except Exception as e:
+        print(f"[ERROR] Erro ao recuperar contexto: {e}")
+        raise HTTPException(status_code=500, detail="Erro interno ao processar a resposta.")
+
+    documentos_relevantes = [doc for doc, sim in resultados]
+    melhor_doc, maior_similaridade = resultados[0] if resultados else (None, 0)
+
+    async def gerarEventos():
+        # Resposta já existente para similaridade alta: um único trecho
+        if melhor_doc and maior_similaridade >= 0.9:
+            resposta = melhor_doc.get("resposta") or melhor_doc.get("texto", "")
+            yield eventoSse("trecho", {"texto": resposta})
+            await registrarInteracaoAsync(pergunta, resposta, [melhor_doc], sessao)
+            yield eventoSse("fim", {})
+            return
+
+        trechos = []
+        try:
+            async for trecho in gerarRespostaComCacheStreamAsync(documentos_relevantes, pergunta, pergunta_embedding,
+                                                              sessao=sessao):
+                trechos.append(trecho)
+                yield eventoSse("trecho", {"texto": trecho})
+        except Exception:
+            yield eventoSse("erro", {"detalhe": "Erro ao gerar resposta com a IA do Gemini."})
+            return
+
+        # A interação só é registrada com o texto completo, depois do último trecho
+        await registrarInteracaoAsync(pergunta, "".join(trechos).strip(), documentos_relevantes, sessao)
+        yield eventoSse("fim", {})
+
+    return StreamingResponse(
+        gerarEventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/ia/cache")
+def estatisticas_cache():
+    return cache_respostas.estatisticas()
+
+
+@app.get("/ia/embeddings")
+def estatisticas_embeddings():
+    return servico_embedding.estatisticas()
+
+
+@app.get("/ia/gemini")
+def estatisticas_gemini():
+    return cliente_ia.estatisticas()
+
+
+@app.get("/ia/chaves")
+def estatisticas_chaves():
+    # Parcela das perguntas atendidas direto pelo código citado
+    return indice_conhecimento.chaves.estatisticas()
+
+
+@app.get("/ia/sessoes")
+def estatisticas_sessoes():
+    armazem_sessoes.descartarInativas()
+    return armazem_sessoes.estatisticas()
+
+
+@app.get("/ia/gravacao")
+def estatisticas_gravacao():
+    return gravador_interacoes.estatisticas()
+
+
+# === Métricas (Prometheus) ===
+# Valores que os componentes já mantêm, lidos na hora da coleta
+for nome, ajuda, funcao, tipo in [
+    ("tekbot_indice_documentos", "Documentos no índice vetorial", lambda: len(indice_conhecimento), "gauge"),
+    ("tekbot_cache_entradas", "Respostas no cache semântico", lambda: len(cache_respostas), "gauge"),
+    ("tekbot_cache_acertos_total", "Acertos do cache semântico", lambda: cache_respostas.acertos, "counter"),
+    ("tekbot_cache_falhas_total", "Consultas ao cache sem acerto", lambda: cache_respostas.falhas, "counter"),
+    ("tekbot_embedding_fila", "Pedidos aguardando o modelo de embeddings",
+     lambda: servico_embedding.estatisticas()["pendentes"], "gauge"),
+    ("tekbot_gemini_pendentes", "Gerações aguardando vaga ou em andamento", lambda: cliente_ia.pendentes, "gauge"),
+    ("tekbot_gemini_em_andamento", "Gerações em andamento", lambda: cliente_ia.em_andamento, "gauge"),
+    ("tekbot_gemini_chamadas_total", "Chamadas ao Gemini", lambda: cliente_ia.chamadas, "counter"),
+    ("tekbot_gemini_falhas_total", "Chamadas ao Gemini com erro", lambda: cliente_ia.falhas, "counter"),
+    ("tekbot_gemini_circuito_aberto", "1 enquanto o disjuntor do Gemini não está fechado",
+     lambda: cliente_ia.disjuntor.estado != "fechado", "gauge"),
+    ("tekbot_admissao_em_andamento", "Requisições de resposta em atendimento",
+     lambda: controle_admissao.em_andamento, "gauge"),
+    ("tekbot_admissao_fila", "Requisições de resposta aguardando vaga", lambda: controle_admissao.na_fila, "gauge"),
+    ("tekbot_admissao_recusadas_total", "Requisições recusadas com 503", lambda: controle_admissao.recusados, "counter"),
+    ("tekbot_limite_taxa_recusadas_total", "Requisições recusadas com 429", lambda: limitador_taxa.limitados, "counter"),
+    ("tekbot_sessoes_ativas", "Sessões de conversa em memória", lambda: len(armazem_sessoes), "gauge"),
+    ("tekbot_gravacao_pendentes", "Interações aguardando gravação",
+     lambda: gravador_interacoes.estatisticas()["pendentes"], "gauge"),
+    ("tekbot_gravacao_falhas_total", "Interações que falharam ao gravar", lambda: gravador_interacoes.falhas, "counter"),
+    ("tekbot_pronto", "1 depois que o boot terminou", lambda: estado_inicializacao["pronto"], "gauge"),
+]:
+    registro_metricas.medidor(nome, ajuda, funcao, tipo)
+registro_metricas.registrarHistograma("tekbot_embedding_espera_fila_ms", "Espera na fila do micro-lote (ms)",
+                                      servico_embedding.espera_fila_ms)
+registro_metricas.registrarHistograma("tekbot_embedding_tamanho_lote", "Textos por forward pass",
+                                      servico_embedding.tamanho_lote)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metricas():
+    return PlainTextResponse(registro_metricas.formatoPrometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/ia/admissao")
+def estatisticas_admissao():
+    return {
+        **controle_admissao.estatisticas(),
+        "limite_taxa": limitador_taxa.estatisticas(),
+        "modo_degradado": iaSobrecarregada(),
+        "backlog_ia": cliente_ia.pendentes,
+        "limite_backlog_ia": LIMITE_BACKLOG_IA,
+        "respostas_degradadas": rag.respostas_degradadas,
+    }
+
+
 @app.get("/autenticar/login")
 def get_usuario_autenticado(usuario: dict = Depends(verificar_token)):
     return {
@@ -213,7 +534,7 @@ def get_usuario_autenticado(usuario: dict = Depends(verificar_token)):
 @app.post("/redefinir-senha")
 def redefinir_senha(dados: RedefinirSenha):
     try:
-        payload = jwt.decode(dados.token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(dados.token, CHAVE_SECRETA, algorithms=[ALGORITMO])
         email = payload.get("sub")
         if email is None:
             raise HTTPException(status_code=400, detail="Token inválido ou expirado")
@@ -0,0 +1,236 @@
+import json
+import time
+import uuid
+import random
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+class Histograma:
+    """Histograma cumulativo por faixas fixas (no formato dos buckets do Prometheus)"""
+
+    def __init__(self, limites: Sequence[float]):
+        self.limites: List[float] = sorted(limites)
+        self.contagens = [0] * (len(self.limites) + 1)  # a última faixa é +Inf
+        self.soma = 0.0
+        self.total = 0
+        self._trava = threading.Lock()
+
+    def observar(self, valor: float) -> None:
+        posicao = bisect.bisect_left(self.limites, valor)
+        with self._trava:
+            self.contagens[posicao] += 1
+            self.soma += valor
+            self.total += 1
+
+    def resumo(self) -> Dict:
+        """Contagem acumulada por limite superior, mais soma, total e média"""
+        acumulado, faixas = 0, {}
+        for limite, contagem in zip(self.limites + [float("inf")], self.contagens):
+            acumulado += contagem
+            faixas["+Inf" if limite == float("inf") else str(limite)] = acumulado
+        return {
+            "faixas": faixas,
+            "soma": round(self.soma, 6),
+            "total": self.total,
+            "media": round(self.soma / self.total, 6) if self.total else 0.0,
+        }
+
+
+class Contador:
+    """Contador que só cresce (counter do Prometheus)"""
+
+    def __init__(self):
+        self.valor = 0.0
+        self._trava = threading.Lock()
+
+    def incrementar(self, quantidade: float = 1) -> None:
+        with self._trava:
+            self.valor += quantidade
+
+
+# Faixas padrão (segundos) para durações de requisições e etapas
+LIMITES_DURACAO = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+
+def _formatarRotulos(rotulos: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pares = list(rotulos) + ([extra] if extra else [])
+    if not pares:
+        return ""
+    escapar = lambda valor: str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{chave}="{escapar(valor)}"' for chave, valor in pares) + "}"
+
+
+class RegistroMetricas:
+    """Métricas nomeadas, com rótulos, exportadas no formato texto do Prometheus (/metrics).
+
+    `contador` e `histograma` devolvem sempre o mesmo objeto para o mesmo nome e rótulos;
+    `medidor` lê o valor de uma função na hora da exportação (filas, itens em memória, ou
+    contadores que já existem em outro componente, com tipo="counter").
+    """
+
+    def __init__(self):
+        self._familias: Dict[str, Dict] = {}  # nome -> {tipo, ajuda, series: {rotulos: objeto}}
+        self._trava = threading.Lock()
+
+    def _serie(self, tipo: str, nome: str, ajuda: str, rotulos: Dict, fabrica: Callable):
+        chave = tuple(sorted(rotulos.items()))
+        familia = self._familias.get(nome)
+        if familia is None or chave not in familia["series"]:
+            with self._trava:
+                familia = self._familias.setdefault(nome, {"tipo": tipo, "ajuda": ajuda, "series": {}})
+                familia["series"].setdefault(chave, fabrica())
+        return familia["series"][chave]
+
+    def contador(self, nome: str, ajuda: str = "", **rotulos) -> Contador:
+        return self._serie("counter", nome, ajuda, rotulos, Contador)
+
+    def histograma(self, nome: str, ajuda: str = "", limites: Sequence[float] = LIMITES_DURACAO,
+                   **rotulos) -> Histograma:
+        return self._serie("histogram", nome, ajuda, rotulos, lambda: Histograma(limites))
+
+    def registrarHistograma(self, nome: str, ajuda: str, histograma: Histograma, **rotulos) -> None:
+        """Exporta um histograma que já existe em outro componente"""
+        self._serie("histogram", nome, ajuda, rotulos, lambda: histograma)
+
+    def medidor(self, nome: str, ajuda: str, funcao: Callable[[], float], tipo: str = "gauge", **rotulos) -> None:
+        self._serie(tipo, nome, ajuda, rotulos, lambda: funcao)
+
+    def formatoPrometheus(self) -> str:
+        linhas = []
+        with self._trava:
+            familias = [(nome, dict(familia, series=dict(familia["series"]))) for nome, familia in self._familias.items()]
+        for nome, familia in familias:
+            linhas.append(f"# HELP {nome} {familia['ajuda']}")
+            linhas.append(f"# TYPE {nome} {familia['tipo']}")
+            for rotulos, serie in familia["series"].items():
+                if callable(serie):
+                    try:
+                        valor = float(serie())
+                    except Exception:
+                        continue
+                    linhas.append(f"{nome}{_formatarRotulos(rotulos)} {valor}")
+                elif isinstance(serie, Contador):
+                    linhas.append(f"{nome}{_formatarRotulos(rotulos)} {serie.valor}")
+                else:
+                    acumulado = 0
+                    for limite, contagem in zip(serie.limites + [float("inf")], serie.contagens):
+                        acumulado += contagem
+                        le = "+Inf" if limite == float("inf") else repr(float(limite))
+                        linhas.append(f"{nome}_bucket{_formatarRotulos(rotulos, ('le', le))} {acumulado}")
+                    linhas.append(f"{nome}_sum{_formatarRotulos(rotulos)} {serie.soma}")
+                    linhas.append(f"{nome}_count{_formatarRotulos(rotulos)} {serie.total}")
+        return "\n".join(linhas) + "\n"
+
+
+registro_metricas = RegistroMetricas()
+
+
+# === Rastreamento por requisição ===
+# Toda etapa alimenta o histograma tekbot_etapa_duracao_segundos (custo de ~1µs). O detalhe
+# (etapas com início e duração, atributos como candidatos e tokens) só é guardado nas
+# requisições amostradas, que ao final são impressas como uma linha JSON "[TRACE]".
+
+class Rastreamento:
+    def __init__(self, id_requisicao: str, rota: str):
+        self.id_requisicao = id_requisicao
+        self.rota = rota
+        self.inicio = time.perf_counter()
+        self.etapas: List[Dict] = []
+        self.atributos: Dict = {}
+
+    def paraDict(self, status: int) -> Dict:
+        return {
+            "id_requisicao": self.id_requisicao,
+            "rota": self.rota,
+            "status": status,
+            "duracao_ms": round((time.perf_counter() - self.inicio) * 1000, 3),
+            "etapas": self.etapas,
+            **self.atributos,
+        }
+
+
+rastreamento_atual: ContextVar[Optional[Rastreamento]] = ContextVar("rastreamento_atual", default=None)
+
+
+@contextmanager
+def etapa(nome: str):
+    """Mede uma etapa do pipeline (embedding, busca, gemini...) na requisição corrente"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        fim = time.perf_counter()
+        registro_metricas.histograma(
+            "tekbot_etapa_duracao_segundos", "Duração de cada etapa do pipeline de resposta", etapa=nome
+        ).observar(fim - inicio)
+        rastro = rastreamento_atual.get()
+        if rastro is not None:
+            rastro.etapas.append({"etapa": nome, "inicio_ms": round((inicio - rastro.inicio) * 1000, 3),
+                                  "duracao_ms": round((fim - inicio) * 1000, 3)})
+
+
+def anotar(**atributos) -> None:
+    """Acrescenta atributos (ex.: candidatos=120, maior_similaridade=0.83) ao rastreamento corrente"""
+    rastro = rastreamento_atual.get()
+    if rastro is not None:
+        rastro.atributos.update(atributos)
+
+
+class MiddlewareRastreamento:
+    """Middleware ASGI: id da requisição (X-Request-Id), duração e status por rota e, nas
+    requisições amostradas (`amostragem`, de 0 a 1) ou mais lentas que `limiar_lento_ms`, o
+    rastreamento completo. A duração inclui o envio do corpo, inclusive no streaming."""
+
+    def __init__(self, app, amostragem: float = 0.01, limiar_lento_ms: float = 0.0,
+                 ignorar: Sequence[str] = ("/metrics", "/health", "/ready")):
+        self.app = app
+        self.amostragem = amostragem
+        self.limiar_lento_ms = limiar_lento_ms
+        self.ignorar = set(ignorar)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.ignorar:
+            await self.app(scope, receive, send)
+            return
+
+        id_requisicao = None
+        for nome, valor in scope["headers"]:
+            if nome == b"x-request-id":
+                id_requisicao = valor.decode("latin-1")[:64]
+        id_requisicao = id_requisicao or uuid.uuid4().hex[:16]
+
+        # Com limiar de lentidão todas as requisições são rastreadas, mas só as lentas (ou sorteadas) são impressas
+        sorteada = random.random() < self.amostragem
+        rastro = Rastreamento(id_requisicao, scope["path"]) if sorteada or self.limiar_lento_ms > 0 else None
+        token = rastreamento_atual.set(rastro)
+        inicio = time.perf_counter()
+        status = 500
+
+        async def enviar(mensagem):
+            nonlocal status
+            if mensagem["type"] == "http.response.start":
+                status = mensagem["status"]
+                mensagem = dict(mensagem, headers=list(mensagem.get("headers", [])) +
+                                [(b"x-request-id", id_requisicao.encode("latin-1"))])
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            rastreamento_atual.reset(token)
+            duracao = time.perf_counter() - inicio
+            # Rótulo pelo molde da rota (/mensagens/{id_mensagem}), para não criar uma série por id
+            rota = getattr(scope.get("route"), "path", None) or "nao_encontrada"
+            registro_metricas.histograma(
+                "tekbot_requisicao_duracao_segundos", "Duração das requisições HTTP", rota=rota
+            ).observar(duracao)
+            registro_metricas.contador(
+                "tekbot_requisicoes_total", "Requisições HTTP atendidas", rota=rota, status=str(status)
+            ).incrementar()
+            if rastro is not None and (sorteada or duracao * 1000 >= self.limiar_lento_ms):
+                rastro.rota = rota
+                print(f"[TRACE] {json.dumps(rastro.paraDict(status), ensure_ascii=False, default=str)}")
@@ -0,0 +1,71 @@
+import argparse
+from pymongo import ReplaceOne
+from database import banco_de_dados, colecao_conhecimento, colecao_interacoes, colecao_sessoes, criarIndices
+
+# Separa a antiga coleção única (base de conhecimento + interações + sessões) nas coleções próprias.
+# Uso:
+#   python migrar_colecoes.py                 (lê a coleção legada "messages")
+#   python migrar_colecoes.py --origem outra  --remover-origem
+# Pode ser executado mais de uma vez: os documentos são gravados pelo _id.
+
+TAMANHO_LOTE = 1000
+
+
+def destinoDe(documento):
+    tipo = documento.get("tipo")
+    if tipo == "interacao":
+        return colecao_interacoes
+    if tipo == "sessao_conversa":
+        return colecao_sessoes
+    return colecao_conhecimento
+
+
+def gravarLote(lotes):
+    for colecao, operacoes in lotes.items():
+        if operacoes:
+            colecao.bulk_write(operacoes, ordered=False)
+            operacoes.clear()
+
+
+def migrar(nome_origem: str, remover_origem: bool = False):
+    origem = banco_de_dados[nome_origem]
+    lotes = {colecao_conhecimento: [], colecao_interacoes: [], colecao_sessoes: []}
+    contagem = {colecao.name: 0 for colecao in lotes}
+    sessoes_vistas = set()
+
+    # Sessões antigas eram regravadas a cada salvamento: só a mais recente de cada sessao_id é mantida
+    sessoes = origem.find({"tipo": "sessao_conversa"}).sort("data_fim", -1)
+    demais = origem.find({"tipo": {"$ne": "sessao_conversa"}})
+    for documento in (documento for cursor in (sessoes, demais) for documento in cursor):
+        destino = destinoDe(documento)
+        if destino is colecao_sessoes:
+            if documento.get("sessao_id") in sessoes_vistas:
+                continue
+            sessoes_vistas.add(documento.get("sessao_id"))
+            sessao = {campo: valor for campo, valor in documento.items() if campo != "_id"}
+            operacao = ReplaceOne({"sessao_id": documento.get("sessao_id")}, sessao, upsert=True)
+        else:
+            operacao = ReplaceOne({"_id": documento["_id"]}, documento, upsert=True)
+
+        lotes[destino].append(operacao)
+        contagem[destino.name] += 1
+        if len(lotes[destino]) >= TAMANHO_LOTE:
+            gravarLote({destino: lotes[destino]})
+
+    gravarLote(lotes)
+    for nome, total in contagem.items():
+        print(f"[OK] {total} documentos copiados para '{nome}'.")
+
+    if remover_origem and nome_origem != colecao_conhecimento.name:
+        origem.drop()
+        print(f"[INFO] Coleção '{nome_origem}' removida.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Separa a coleção legada em conhecimento, interações e sessões")
+    parser.add_argument("--origem", default="messages", help="coleção legada com todos os documentos")
+    parser.add_argument("--remover-origem", action="store_true", help="apaga a coleção legada ao final")
+    args = parser.parse_args()
+
+    criarIndices()
+    migrar(args.origem, args.remover_origem)
@@ -0,0 +1,43 @@
+import argparse
+import time
+from pymongo import UpdateOne
+from database import colecao_conhecimento
+from indice import FORMATOS_EMBEDDING, FORMATO_EMBEDDING, empacotarEmbedding, lerEmbedding
+
+# Converte os embeddings gravados como lista de floats para o formato binário compacto.
+# Uso:
+#   python migrar_embeddings.py                      (só documentos ainda no formato antigo)
+#   python migrar_embeddings.py --formato int8 --todos
+# O campo atualizado_em não é alterado: o vetor é o mesmo, então os workers não precisam reindexar.
+
+TAMANHO_LOTE = 1000
+
+
+def migrar(formato: str, todos: bool = False) -> int:
+    filtro = {"embedding": {"$exists": True}} if todos else {"embedding": {"$type": "array"}}
+    convertidos, operacoes, inicio = 0, [], time.perf_counter()
+
+    for doc in colecao_conhecimento.find(filtro, {"embedding": 1}):
+        vetor = lerEmbedding(doc.get("embedding"))
+        if vetor is None:
+            continue
+        operacoes.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"embedding": empacotarEmbedding(vetor, formato)}}))
+        if len(operacoes) >= TAMANHO_LOTE:
+            convertidos += colecao_conhecimento.bulk_write(operacoes, ordered=False).modified_count
+            operacoes = []
+            print(f"[INFO] {convertidos} embeddings convertidos...")
+
+    if operacoes:
+        convertidos += colecao_conhecimento.bulk_write(operacoes, ordered=False).modified_count
+
+    print(f"[OK] {convertidos} embeddings convertidos para {formato} em {time.perf_counter() - inicio:.1f}s.")
+    return convertidos
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grava os embeddings da base em formato binário")
+    parser.add_argument("--formato", choices=list(FORMATOS_EMBEDDING), default=FORMATO_EMBEDDING)
+    parser.add_argument("--todos", action="store_true", help="reconverte também os que já estão em binário")
+    args = parser.parse_args()
+
+    migrar(args.formato, args.todos)
@@ -0,0 +1,173 @@
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+from lexico import tokenizar
+
+PADRAO_SENTENCA = re.compile(r"(?<=[.!?;:])\s+|\n+")
+PADRAO_PEDACO = re.compile(r"\w+|[^\w\s]")
+
+
+def dividirSentencas(texto: str) -> List[str]:
+    return [sentenca.strip() for sentenca in PADRAO_SENTENCA.split(texto or "") if sentenca.strip()]
+
+
+class ContadorTokens:
+    """Conta tokens localmente, sem chamar a API.
+
+    Com `tokenizador` (arquivo tokenizer.json ou nome no Hugging Face, ex.: o do Gemma, que
+    usa o mesmo vocabulário SentencePiece do Gemini) usa a biblioteca `tokenizers`; sem ele,
+    ou se não der para carregar, estima ~1 token a cada 4 letras de cada palavra e 1 por
+    pontuação, o que fica próximo da contagem do Gemini para português.
+    """
+
+    def __init__(self, tokenizador: Optional[str] = None):
+        self.nome_tokenizador = tokenizador
+        self._tokenizador = None
+        self._carregado = not tokenizador
+        self._trava = threading.Lock()
+
+    def _obterTokenizador(self):
+        if not self._carregado:
+            with self._trava:
+                if not self._carregado:
+                    try:
+                        from tokenizers import Tokenizer
+
+                        if os.path.exists(self.nome_tokenizador):
+                            self._tokenizador = Tokenizer.from_file(self.nome_tokenizador)
+                        else:
+                            self._tokenizador = Tokenizer.from_pretrained(self.nome_tokenizador)
+                        print(f"[OK] Tokenizador do prompt carregado: {self.nome_tokenizador}")
+                    except Exception as e:
+                        print(f"[AVISO] Tokenizador '{self.nome_tokenizador}' indisponível ({e}); usando estimativa.")
+                    self._carregado = True
+        return self._tokenizador
+
+    def contar(self, texto: str) -> int:
+        if not texto:
+            return 0
+        tokenizador = self._obterTokenizador()
+        if tokenizador is not None:
+            return len(tokenizador.encode(texto, add_special_tokens=False).ids)
+        return sum(1 + (len(pedaco) - 1) // 4 for pedaco in PADRAO_PEDACO.findall(texto))
+
+    def truncar(self, texto: str, limite: int) -> str:
+        """Maior prefixo do texto que cabe no limite, cortando entre sentenças. Só corta
+        palavras (com reticências) quando nem a primeira sentença cabe."""
+        if self.contar(texto) <= limite:
+            return texto
+        partes, usados = [], 0
+        for sentenca in dividirSentencas(texto):
+            tokens = self.contar(sentenca) + 1
+            if usados + tokens > limite:
+                break
+            partes.append(sentenca)
+            usados += tokens
+        if partes:
+            return " ".join(partes)
+
+        palavras, usados = [], 1
+        for palavra in texto.split():
+            usados += self.contar(palavra)
+            if usados > limite:
+                break
+            palavras.append(palavra)
+        return " ".join(palavras) + "…"
+
+
+def removerQuaseDuplicados(documentos: List[Dict], limiar: float = 0.8) -> Tuple[List[Dict], int]:
+    """Descarta passagens cujos termos já estão, acima do limiar, numa mais relevante já mantida
+    (coeficiente de sobreposição: também pega a passagem que é um trecho da outra)"""
+    mantidos, conjuntos, removidos = [], [], 0
+    for doc in documentos:
+        termos = set(tokenizar(f"{doc.get('pergunta') or doc.get('texto', '')} {doc.get('resposta') or ''}"))
+        if termos and any(len(termos & outro) / min(len(termos), len(outro)) >= limiar for outro in conjuntos):
+            removidos += 1
+            continue
+        mantidos.append(doc)
+        if termos:
+            conjuntos.append(termos)
+    return mantidos, removidos
+
+
+class MontadorPrompt:
+    """Monta as partes variáveis do prompt dentro de orçamentos de tokens separados.
+
+    Conhecimento: passagens na ordem de relevância, sem quase duplicadas, inteiras enquanto
+    couberem (a primeira é encurtada por sentenças se sozinha já estourar). Histórico: as
+    interações mais recentes na íntegra e as mais antigas resumidas (pergunta e a primeira
+    frase da resposta) no que sobrar do orçamento.
+    """
+
+    def __init__(self, contador: ContadorTokens, orcamento_conhecimento: int = 1200, orcamento_historico: int = 600,
+                 limiar_duplicado: float = 0.8, max_interacoes: int = 5):
+        self.contador = contador
+        self.orcamento_conhecimento = orcamento_conhecimento
+        self.orcamento_historico = orcamento_historico
+        self.limiar_duplicado = limiar_duplicado
+        self.max_interacoes = max_interacoes
+
+    @staticmethod
+    def passagem(doc: Dict) -> str:
+        return f"P: {doc.get('pergunta') or doc.get('texto', '')}\nR: {doc.get('resposta') or ''}"
+
+    def conhecimento(self, documentos: List[Dict]) -> Tuple[str, Dict]:
+        documentos = [doc for doc in documentos if isinstance(doc, dict)]
+        # O que todas as passagens ocupariam sem deduplicação nem orçamento (para medir a economia)
+        disponiveis = sum(self.contador.contar(self.passagem(doc)) + 1 for doc in documentos)
+        documentos, duplicados = removerQuaseDuplicados(documentos, self.limiar_duplicado)
+
+        partes, usados, fora = [], 0, 0
+        for doc in documentos:
+            passagem = self.passagem(doc)
+            tokens = self.contador.contar(passagem) + 1
+            if usados + tokens > self.orcamento_conhecimento:
+                if partes:
+                    fora += 1
+                    continue
+                passagem = self.contador.truncar(passagem, self.orcamento_conhecimento)
+                tokens = self.contador.contar(passagem) + 1
+            partes.append(passagem)
+            usados += tokens
+        return "\n".join(partes), {"tokens": usados, "tokens_sem_orcamento": disponiveis, "passagens": len(partes),
+                                   "duplicadas": duplicados, "fora_do_orcamento": fora}
+
+    def historico(self, interacoes: List[Dict], orcamento: Optional[int] = None) -> Tuple[str, Dict]:
+        orcamento = orcamento or self.orcamento_historico
+        if not interacoes:
+            return "", {"tokens": 0, "integrais": 0, "resumidas": 0}
+        recentes = interacoes[-self.max_interacoes:]
+        antigas = interacoes[:-self.max_interacoes]
+
+        # Da mais recente para a mais antiga: na íntegra enquanto couber, depois resumida
+        integrais, resumidas, usados = [], [], 0
+        for interacao in reversed(recentes):
+            bloco = f"USUÁRIO: {interacao['pergunta']}\n   ASSISTENTE: {interacao['resposta']}"
+            tokens = self.contador.contar(bloco) + 1
+            if not resumidas and usados + tokens <= orcamento:
+                integrais.append(bloco)
+                usados += tokens
+            else:
+                resumidas.append(interacao)
+        resumidas.extend(reversed(antigas))
+
+        resumos = []
+        for interacao in resumidas:
+            resumo = self.resumir(interacao)
+            tokens = self.contador.contar(resumo) + 1
+            if usados + tokens > orcamento:
+                break
+            resumos.append(resumo)
+            usados += tokens
+
+        texto = "HISTÓRICO DA CONVERSA ATUAL:\n"
+        if resumos:
+            texto += "Interações anteriores (resumo):\n" + "\n".join(f"- {resumo}" for resumo in reversed(resumos)) + "\n"
+        texto += "".join(f"\n{i}. {bloco}\n" for i, bloco in enumerate(reversed(integrais), 1))
+        return texto, {"tokens": usados, "integrais": len(integrais), "resumidas": len(resumos)}
+
+    def resumir(self, interacao: Dict) -> str:
+        pergunta = self.contador.truncar(interacao["pergunta"], 30)
+        primeira_frase = (dividirSentencas(interacao["resposta"]) or [""])[0]
+        return f"Usuário perguntou: {pergunta} | Resposta: {self.contador.truncar(primeira_frase, 40)}"
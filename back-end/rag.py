@@ -1,74 +1,126 @@
+import gc
 import os
-import torch
+import uuid
+import asyncio
+import contextvars
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
-from database import colecao_mensagens
+from pymongo import MongoClient
+from database import colecao_conhecimento, colecao_conhecimento_async, colecao_interacoes, colecao_sessoes, NOME_BANCO
+from indice import (criarIndice, SincronizadorIndice, textoIndexado, empacotarEmbedding, abrirSnapshot,
+                    CAMINHO_SNAPSHOT)
+from cache_respostas import CacheSemantico
+from chaves import extrairChaves
+from embeddings import ServicoEmbedding, NOME_MODELO_EMBEDDING
+from sessoes import ArmazemSessoes
+from gravacao import GravadorInteracoes
 import google.generativeai as genai
-from typing import List, Dict, Optional
+from cliente_ia import ClienteGemini, DisjuntorCircuito
+from metricas import etapa, anotar, registro_metricas
+from orcamento_prompt import ContadorTokens, MontadorPrompt
+from typing import List, Dict, Optional, Tuple
 
 # === Configuração de ambiente ===
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+# Nada pesado roda na importação: o modelo de embeddings e o Gemini são preparados
+# no primeiro uso ou no startup da API (ver `inicializar` em main.py).
+# O nome do modelo (EMBEDDING_MODELO) vem de embeddings.py, o mesmo usado pelo seed.py
 
 # Configuração da API do Gemini
-try:
-    GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
-    if not GOOGLE_API_KEY:
-        raise ValueError("A variável de ambiente GEMINI_API_KEY não foi definida.")
-    genai.configure(api_key=GOOGLE_API_KEY)
-    print("[OK] API do Gemini configurada.")
-except Exception as e:
-    print(f"[ERRO] Falha ao configurar a API do Gemini: {e}")
-
-# === Carregar modelo de embeddings ===
-print("[INFO] Carregando modelo de embeddings...")
-modelo_embedding = SentenceTransformer('all-MiniLM-L6-v2')
-print("[OK] Modelo de embeddings carregado.")
-print("[INFO] Utilizando a API do Gemini (Google AI)...")
+# GEMINI_API_ENDPOINT aponta o cliente para outro servidor (ex.: stub local em testes de carga), via REST
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+
+
+def configurarGemini() -> None:
+    try:
+        GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
+        if not GOOGLE_API_KEY:
+            raise ValueError("A variável de ambiente GEMINI_API_KEY não foi definida.")
+        opcoes_transporte = {}
+        if GEMINI_API_ENDPOINT:
+            opcoes_transporte = {"transport": "rest", "client_options": {"api_endpoint": GEMINI_API_ENDPOINT}}
+        genai.configure(api_key=GOOGLE_API_KEY, **opcoes_transporte)
+        print("[OK] API do Gemini configurada.")
+    except Exception as e:
+        print(f"[ERRO] Falha ao configurar a API do Gemini: {e}")
+
+
+# === Modelo de embeddings (carregado sob demanda) ===
+def carregarModeloEmbedding():
+    # torch e sentence_transformers só são importados aqui: importar o rag fica barato
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    # Com vários workers por máquina, cada um deve usar só a sua parte dos núcleos
+    if os.getenv("EMBEDDING_TORCH_THREADS"):
+        torch.set_num_threads(int(os.getenv("EMBEDDING_TORCH_THREADS")))
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"[INFO] Carregando modelo de embeddings ({NOME_MODELO_EMBEDDING}, {device})...")
+    modelo = SentenceTransformer(NOME_MODELO_EMBEDDING, device=device)
+    print("[OK] Modelo de embeddings carregado.")
+    return modelo
+
+
+# Todas as codificações de frases avulsas passam pelo serviço de micro-lotes
+servico_embedding = ServicoEmbedding(
+    carregarModeloEmbedding,
+    janela_ms=float(os.getenv("EMBEDDING_JANELA_MS", 5)),
+    tamanho_max_lote=int(os.getenv("EMBEDDING_LOTE_MAXIMO", 32)),
+)
+
+# Executor dedicado e limitado para o trabalho de CPU (busca e carga do índice),
+# para que as rotas async não disputem o threadpool padrão
+executor_embedding = ThreadPoolExecutor(
+    max_workers=int(os.getenv("EMBEDDING_THREADS", 2)),
+    thread_name_prefix="embedding",
+)
 
 # === Classe para gerenciar contexto da conversa ===
 class GerenciadorContexto:
-    def __init__(self, max_historico: int = 10, max_tokens_contexto: int = 1500):
+    def __init__(self, max_historico: int = 10, max_tokens_contexto: Optional[int] = None,
+                 sessao_id: Optional[str] = None, efemera: bool = False):
         self.historico_conversa: List[Dict] = []
         self.max_historico = max_historico
         self.max_tokens_contexto = max_tokens_contexto
-        self.sessao_id = self.gerarSessaoId()
+        self.sessao_id = sessao_id or self.gerarSessaoId()
+        self.alterado = False  # há interações ainda não salvas no banco
+        self.efemera = efemera  # sem continuidade (anônima, lote): o histórico não vai para o banco
         
     def gerarSessaoId(self) -> str:
         """Gera um ID único para a sessão de conversa"""
-        return f"sessao_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        return f"sessao_{uuid.uuid4().hex}"
     
-    def adicionarInteracao(self, pergunta: str, resposta: str, contexto_utilizado: List = None):
-        """Adiciona uma nova interação ao histórico"""
+    def adicionarInteracao(self, pergunta: str, resposta: str, contexto_utilizado: List = None) -> Dict:
+        """Adiciona uma nova interação ao histórico e a devolve"""
         interacao = {
             "pergunta": pergunta,
             "resposta": resposta,
-            "contexto_utilizado": contexto_utilizado or [],
+            # Só os ids dos documentos usados: o texto deles já está na base de conhecimento
+            "contexto_utilizado": self.compactarContexto(contexto_utilizado),
             "timestamp": datetime.now(timezone.utc)
         }
         
         self.historico_conversa.append(interacao)
+        self.alterado = True
         
         # Manter apenas as últimas N interações
         if len(self.historico_conversa) > self.max_historico:
             self.historico_conversa.pop(0)
+        return interacao
     
+    @staticmethod
+    def compactarContexto(contexto_utilizado: Optional[List]) -> List:
+        return [
+            str(doc["_id"]) if isinstance(doc, dict) and "_id" in doc else doc
+            for doc in (contexto_utilizado or [])
+            if not isinstance(doc, dict) or "_id" in doc
+        ]
+
     def obterContextoConversa(self) -> str:
-        """Obtém o contexto formatado da conversa atual"""
-        if not self.historico_conversa:
-            return ""
-        
-        contexto_texto = "HISTÓRICO DA CONVERSA ATUAL:\n"
-        for i, interacao in enumerate(self.historico_conversa[-5:], 1):  # Últimas 5 interações
-            contexto_texto += f"\n{i}. USUÁRIO: {interacao['pergunta']}\n"
-            contexto_texto += f"   ASSISTENTE: {interacao['resposta']}\n"
-        
-        # Limitar tamanho do contexto
-        if len(contexto_texto) > self.max_tokens_contexto:
-            contexto_texto = contexto_texto[-self.max_tokens_contexto:]
-        
-        return contexto_texto
+        """Obtém o contexto formatado da conversa atual, dentro do orçamento de tokens do histórico
+        (interações recentes na íntegra, as mais antigas resumidas)"""
+        texto, _ = montador_prompt.historico(self.historico_conversa, self.max_tokens_contexto)
+        return texto
     
     def verificarContinuidade(self, nova_pergunta: str) -> bool:
         """Verifica se a pergunta atual é uma continuação da anterior"""
@@ -94,36 +146,43 @@ class GerenciadorContexto:
         return None
     
     def salvarSessao(self):
-        """Salva o histórico da sessão no banco de dados"""
+        """Salva o histórico da sessão no banco de dados (um documento por sessão, atualizado no lugar)"""
+        if not self.alterado or self.efemera:
+            return
         try:
-            sessao_data = {
-                "tipo": "sessao_conversa",
-                "sessao_id": self.sessao_id,
-                "historico": self.historico_conversa,
-                "data_inicio": self.historico_conversa[0]['timestamp'] if self.historico_conversa else datetime.now(timezone.utc),
-                "data_fim": datetime.now(timezone.utc),
-                "total_interacoes": len(self.historico_conversa)
-            }
-            colecao_mensagens.insert_one(sessao_data)
+            colecao_sessoes.update_one(
+                {"sessao_id": self.sessao_id},
+                {
+                    "$set": {"historico": self.historico_conversa, "data_fim": datetime.now(timezone.utc)},
+                    "$max": {"total_interacoes": len(self.historico_conversa)},
+                    "$setOnInsert": {
+                        "data_inicio": self.historico_conversa[0]['timestamp'] if self.historico_conversa else datetime.now(timezone.utc),
+                    },
+                },
+                upsert=True,
+            )
+            self.alterado = False
             print(f"[INFO] Sessão {self.sessao_id} salva com {len(self.historico_conversa)} interações.")
         except Exception as e:
             print(f"[ERRO] Falha ao salvar sessão: {e}")
     
-    def carregarUltimaSessao(self, limite_horas: int = 24):
-        """Carrega a última sessão do usuário se foi recente"""
+    def carregarUltimaSessao(self, limite_horas: int = 24, sessao_id: Optional[str] = None):
+        """Carrega a última sessão do usuário se foi recente (opcionalmente, uma sessão específica)"""
         try:
             tempo_limite = datetime.now(timezone.utc).timestamp() - (limite_horas * 3600)
-            
-            ultima_sessao = colecao_mensagens.find_one(
-                {
-                    "tipo": "sessao_conversa",
-                    "data_fim": {"$gte": datetime.fromtimestamp(tempo_limite, timezone.utc)}
-                },
-                sort=[("data_fim", -1)]
-            )
+            filtro = {
+                "data_fim": {"$gte": datetime.fromtimestamp(tempo_limite, timezone.utc)}
+            }
+            if sessao_id:
+                filtro["sessao_id"] = sessao_id
+
+            ultima_sessao = colecao_sessoes.find_one(filtro, sort=[("data_fim", -1)])
             
             if ultima_sessao and ultima_sessao.get("historico"):
-                self.historico_conversa = ultima_sessao["historico"]
+                self.historico_conversa = [
+                    {**interacao, "contexto_utilizado": self.compactarContexto(interacao.get("contexto_utilizado"))}
+                    for interacao in ultima_sessao["historico"][-self.max_historico:]
+                ]
                 self.sessao_id = ultima_sessao["sessao_id"]
                 print(f"[INFO] Sessão anterior carregada: {len(self.historico_conversa)} interações.")
                 return True
@@ -132,25 +191,226 @@ class GerenciadorContexto:
             print(f"[ERRO] Falha ao carregar sessão anterior: {e}")
             return False
 
-# Instância global do gerenciador de contexto
+# Instância global do gerenciador de contexto (usada pelo terminal; a API usa uma sessão por usuário)
 contexto_manager = GerenciadorContexto()
 
+# Orçamentos (em tokens) das partes variáveis do prompt: conhecimento recuperado e histórico
+montador_prompt = MontadorPrompt(
+    ContadorTokens(os.getenv("PROMPT_TOKENIZADOR")),
+    orcamento_conhecimento=int(os.getenv("PROMPT_ORCAMENTO_CONHECIMENTO", 1200)),
+    orcamento_historico=int(os.getenv("PROMPT_ORCAMENTO_HISTORICO", 600)),
+    limiar_duplicado=float(os.getenv("PROMPT_LIMIAR_DUPLICADO", 0.8)),
+)
+
+
+def criarSessao(chave: str) -> GerenciadorContexto:
+    """Cria a sessão de um usuário, recuperando do banco o histórico recente se existir"""
+    sessao = GerenciadorContexto(sessao_id=chave)
+    sessao.carregarUltimaSessao(sessao_id=chave)
+    return sessao
+
+
+# Registros de interação e históricos de sessão são gravados em lote, fora do caminho da resposta
+gravador_interacoes = GravadorInteracoes(
+    colecao_interacoes, colecao_sessoes,
+    tamanho_lote=int(os.getenv("GRAVACAO_TAMANHO_LOTE", 100)),
+    intervalo=float(os.getenv("GRAVACAO_INTERVALO_SEGUNDOS", 1.0)),
+)
+
+armazem_sessoes = ArmazemSessoes(
+    fabrica=criarSessao,
+    capacidade=int(os.getenv("SESSOES_CAPACIDADE", 1000)),
+    inatividade_segundos=float(os.getenv("SESSOES_INATIVIDADE_SEGUNDOS", 1800)),
+    ao_descartar=GerenciadorContexto.salvarSessao,
+)
+
+# === Índice vetorial da base de conhecimento ===
+# Interações e sessões ficam em coleções próprias: a carga só lê a base de conhecimento
+TOP_K_DOCUMENTOS = 5
+LIMIAR_RELEVANCIA = 0.6
+# Busca híbrida: só os candidatos do BM25, uma sondagem curta do IVF e o delta recebem o cosseno
+BUSCA_HIBRIDA = os.getenv("BUSCA_HIBRIDA", "1") == "1"
+HIBRIDA_CANDIDATOS = int(os.getenv("HIBRIDA_CANDIDATOS", 200))
+HIBRIDA_PESO_VETOR = float(os.getenv("HIBRIDA_PESO_VETOR", 0.7))
+HIBRIDA_SONDAGENS = int(os.getenv("HIBRIDA_SONDAGENS", 2))
+
+indice_conhecimento = criarIndice()
+sincronizador_indice = SincronizadorIndice(
+    indice_conhecimento, colecao_conhecimento,
+    intervalo=float(os.getenv("INDICE_SINCRONIZACAO_SEGUNDOS", 5)),
+)
+
+# === Cache semântico das respostas geradas pela IA ===
+cache_respostas = CacheSemantico(
+    limiar=float(os.getenv("CACHE_LIMIAR_SIMILARIDADE", 0.95)),
+    ttl_segundos=float(os.getenv("CACHE_TTL_SEGUNDOS", 3600)),
+    capacidade=int(os.getenv("CACHE_CAPACIDADE", 1000)),
+)
+# Respostas que usaram um documento editado ou removido deixam de valer
+indice_conhecimento.observadores.append(cache_respostas.invalidarDocumentos)
+
+
+def carregarIndice() -> int:
+    """Carrega (ou recarrega) o índice vetorial a partir do MongoDB"""
+    total = indice_conhecimento.carregarDaColecao(colecao_conhecimento, servico_embedding)
+    print(f"[OK] Índice vetorial carregado com {total} documentos.")
+    return total
+
+
+# === Snapshot da base (python snapshot.py, ou seed.py --snapshot) ===
+# Com um snapshot o worker sobe mapeando o arquivo e só aplica o que mudou no MongoDB
+# depois da marca d'água dele, em vez de ler todos os documentos e embeddings
+
+
+def exportarSnapshot(caminho: Optional[str] = None, modelo: Optional[str] = None) -> Dict:
+    """Grava o índice (carregado do MongoDB, se ainda não estiver) no snapshot.
+    `modelo` é o modelo que gerou os embeddings da base (padrão: o da API)."""
+    caminho = caminho or CAMINHO_SNAPSHOT
+    if not indice_conhecimento.carregado:
+        carregarIndice()
+    os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+    cabecalho = indice_conhecimento.exportarSnapshot(caminho, modelo_embedding=modelo or NOME_MODELO_EMBEDDING)
+    print(f"[OK] Snapshot gravado em {caminho} ({cabecalho['documentos']} documentos).")
+    return cabecalho
+
+
+def carregarSnapshot(colecao=None, caminho: Optional[str] = None) -> Optional[int]:
+    """Mapeia o snapshot e aplica as alterações do MongoDB posteriores à marca d'água dele.
+    Devolve quantas foram aplicadas, ou None se não houver snapshot utilizável."""
+    caminho = caminho or CAMINHO_SNAPSHOT
+    if not os.path.exists(caminho):
+        return None
+    try:
+        cabecalho, _ = abrirSnapshot(caminho)
+        if cabecalho.get("modelo_embedding") != NOME_MODELO_EMBEDDING:
+            raise ValueError(f"gerado com o modelo {cabecalho.get('modelo_embedding')}")
+        indice_conhecimento.mapearSnapshot(caminho)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[AVISO] Snapshot {caminho} ignorado ({e}); carregando do MongoDB.")
+        return None
+
+    aplicados = SincronizadorIndice(indice_conhecimento, colecao if colecao is not None else colecao_conhecimento
+                                    ).sincronizar()
+    print(f"[OK] Índice carregado do snapshot {caminho} ({cabecalho['documentos']} documentos, "
+          f"{aplicados} alterações posteriores aplicadas).")
+    return aplicados
+
+
+# === Vários workers no mesmo servidor (gunicorn --preload, ver gunicorn.conf.py) ===
+
+def prepararProcessoPrincipal() -> None:
+    """Roda no processo mestre, antes do fork dos workers (no boot e a cada `kill -HUP`).
+
+    Os pesos do modelo e os índices por chave e BM25 ficam na memória do mestre e os
+    workers os herdam por cópia-na-escrita; matriz e metadados ficam no snapshot,
+    mapeado só para leitura. Cada worker aloca apenas o próprio delta, filas e buffers.
+    Rodar de novo remapeia o snapshot atual e aplica o que mudou depois dele; o modelo
+    já carregado é mantido (trocar de modelo exige reiniciar o mestre).
+    """
+    # Só os pesos: o forward pass de aquecimento (e o pool de threads do torch) fica para cada worker
+    servico_embedding.modelo
+
+    # Cliente próprio, fechado antes do fork; os clientes de database.py (connect=False) seguem
+    # sem conexões no mestre e cada worker conecta os seus depois do fork
+    with MongoClient(os.getenv("MONGO_URI")) as cliente_mestre:
+        colecao = cliente_mestre[NOME_BANCO][colecao_conhecimento.name]
+        aplicados = carregarSnapshot(colecao)
+        if aplicados is None:
+            indice_conhecimento.carregarDaColecao(colecao, servico_embedding)
+
+    if not len(indice_conhecimento):
+        print("[AVISO] Base de conhecimento vazia: nada a compartilhar entre os workers.")
+    elif aplicados is None or aplicados:
+        # Snapshot novo ou com alterações: regravado para os workers começarem sem delta
+        exportarSnapshot()
+        indice_conhecimento.mapearSnapshot(CAMINHO_SNAPSHOT)
+
+    # Tira os objetos já criados da coleta de lixo: sem isso o GC dos workers escreveria
+    # nos cabeçalhos deles e copiaria as páginas herdadas. O unfreeze deixa a coleta
+    # alcançar o índice anterior quando isto roda de novo num reload
+    gc.unfreeze()
+    gc.collect()
+    gc.freeze()
+
 # === Funções modificadas ===
 
-def gerarRespostaComIa(contexto_relevante: List, pergunta: str, contexto_conversa: str = "") -> str:
-    """Gera uma resposta usando a API do Gemini com base em contexto e histórico da conversa."""
-    
-    # Contexto da base de conhecimento
-    contexto_base = ""
-    if contexto_relevante:
-        contexto_base = "\n".join(
-            f"P: {doc.get('pergunta', '')}\nR: {doc.get('resposta', '')}"
-            for doc in contexto_relevante
-        )
-    
+MENSAGEM_ERRO_IA = "Erro ao gerar resposta com a IA do Gemini."
+AVISO_RESPOSTA_RESERVA = "A IA está indisponível no momento. Esta é a resposta mais próxima da base de conhecimento:"
+AVISO_MODO_DEGRADADO = "Estamos com alto volume de atendimentos. Esta é a resposta mais próxima da base de conhecimento:"
+
+
+# Configurações de geração para controlar a saída da IA
+CONFIG_GERACAO = {
+    "temperature": 0.3,
+    "max_output_tokens": 512,
+}
+
+# Um único cliente por worker: modelo reaproveitado, prazo por chamada, concorrência limitada,
+# novas tentativas com jitter e disjuntor
+cliente_ia = ClienteGemini(
+    genai, os.getenv("GEMINI_MODELO", "gemini-1.5-flash-latest"), CONFIG_GERACAO,
+    tempo_limite=float(os.getenv("GEMINI_TEMPO_LIMITE", 20)),
+    max_concorrencia=int(os.getenv("GEMINI_CONCORRENCIA", 8)),
+    tentativas=int(os.getenv("GEMINI_TENTATIVAS", 3)),
+    disjuntor=DisjuntorCircuito(
+        limite_falhas=int(os.getenv("GEMINI_LIMITE_FALHAS", 5)),
+        tempo_aberto=float(os.getenv("GEMINI_TEMPO_ABERTO_SEGUNDOS", 30)),
+    ),
+    async_nativo=not GEMINI_API_ENDPOINT,
+    configurar=configurarGemini,
+)
+
+# Modo degradado: com mais gerações pendentes do que isto, as rotas async respondem só com a base
+LIMITE_BACKLOG_IA = int(os.getenv("IA_LIMITE_BACKLOG", 2 * cliente_ia.max_concorrencia))
+respostas_degradadas = 0
+
+
+def iaSobrecarregada() -> bool:
+    return cliente_ia.pendentes >= LIMITE_BACKLOG_IA
+
+
+def respostaReserva(contexto_relevante: List, aviso: str = AVISO_RESPOSTA_RESERVA) -> str:
+    """Usada quando o Gemini falha, o circuito está aberto ou há backlog demais: a melhor entrada da base, se houver"""
+    for doc in contexto_relevante:
+        if isinstance(doc, dict) and (doc.get("resposta") or doc.get("texto")):
+            return f"{aviso}\n\n{doc.get('resposta') or doc.get('texto')}"
+    return MENSAGEM_ERRO_IA
+
+
+def respostaDegradada(contexto_relevante: List) -> str:
+    global respostas_degradadas
+    respostas_degradadas += 1
+    contarResposta("degradado")
+    return respostaReserva(contexto_relevante, AVISO_MODO_DEGRADADO)
+
+
+def contarResposta(origem: str) -> None:
+    """De onde saiu a resposta: codigo, base, cache, ia, reserva ou degradado"""
+    registro_metricas.contador("tekbot_respostas_total", "Respostas por origem", origem=origem).incrementar()
+    anotar(origem=origem)
+
+
+def ehRespostaReserva(resposta: str) -> bool:
+    """Respostas de erro, de reserva ou do modo degradado não entram no cache"""
+    return resposta == MENSAGEM_ERRO_IA or resposta.startswith((AVISO_RESPOSTA_RESERVA, AVISO_MODO_DEGRADADO))
+
+
+def montarPrompt(contexto_relevante: List, pergunta: str, contexto_conversa: Optional[str] = None,
+                 sessao: Optional[GerenciadorContexto] = None) -> str:
+    """Monta o prompt do Gemini com base em contexto e histórico da conversa.
+    Sem `contexto_conversa`, o histórico vem da sessão; conhecimento e histórico respeitam seus orçamentos de tokens."""
+    sessao = sessao or contexto_manager
+
+    # Contexto da base de conhecimento, sem passagens quase duplicadas e dentro do orçamento
+    contexto_base, uso_conhecimento = montador_prompt.conhecimento(contexto_relevante or [])
+    if contexto_conversa is None:
+        contexto_conversa = sessao.obterContextoConversa()
+
     # Verificar se é uma continuação
-    eh_continuacao = contexto_manager.verificarContinuidade(pergunta)
-    ultima_resposta = contexto_manager.obterUltimaResposta()
+    eh_continuacao = sessao.verificarContinuidade(pergunta)
+    ultima_resposta = sessao.obterUltimaResposta()
+    if ultima_resposta:
+        ultima_resposta = montador_prompt.contador.truncar(ultima_resposta, montador_prompt.orcamento_historico)
     
     # Construir prompt baseado no tipo de pergunta
     if eh_continuacao and ultima_resposta:
@@ -180,112 +440,436 @@ CONHECIMENTO BASE RELEVANTE:
 NOVA PERGUNTA: {pergunta}
 Resposta:
 """
-    
-    try:
-        # Seleciona o modelo do Gemini (gemini-1.5-flash é rápido e eficiente)
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
-
-        # Configurações de geração para controlar a saída da IA
-        generation_config = {
-            "temperature": 0.3,
-            "max_output_tokens": 512,
-        }
-
-        response = model.generate_content(
-            prompt,
-            generation_config=generation_config
-        )
-
-        return response.text.strip()
+    registrarTamanhoPrompt(prompt, uso_conhecimento)
+    return prompt
+
+
+def registrarTamanhoPrompt(prompt: str, uso_conhecimento: Dict) -> None:
+    tokens = montador_prompt.contador.contar(prompt)
+    registro_metricas.histograma(
+        "tekbot_prompt_tokens", "Tokens do prompt enviado ao Gemini",
+        limites=[100, 250, 500, 750, 1000, 1500, 2000, 3000, 4000, 8000],
+    ).observar(tokens)
+    economizados = uso_conhecimento["tokens_sem_orcamento"] - uso_conhecimento["tokens"]
+    registro_metricas.contador(
+        "tekbot_prompt_tokens_economizados_total", "Tokens de conhecimento cortados pelo orçamento e pela deduplicação"
+    ).incrementar(economizados)
+    anotar(tokens_prompt=tokens, tokens_conhecimento=uso_conhecimento["tokens"],
+           passagens_duplicadas=uso_conhecimento["duplicadas"])
+    print(f"[INFO] Prompt com {tokens} tokens (conhecimento {uso_conhecimento['tokens']}/"
+          f"{uso_conhecimento['tokens_sem_orcamento']}, {uso_conhecimento['passagens']} passagens, "
+          f"{uso_conhecimento['duplicadas']} duplicadas, {uso_conhecimento['fora_do_orcamento']} fora do orçamento)")
+
+
+def gerarRespostaComIa(contexto_relevante: List, pergunta: str, contexto_conversa: Optional[str] = None,
+                       sessao: Optional[GerenciadorContexto] = None) -> str:
+    """Gera uma resposta usando a API do Gemini com base em contexto e histórico da conversa."""
+    with etapa("prompt"):
+        prompt = montarPrompt(contexto_relevante, pergunta, contexto_conversa, sessao)
 
+    try:
+        with etapa("gemini"):
+            resposta = cliente_ia.gerar(prompt)
+        contarResposta("ia")
+        return resposta
     except Exception as e:
         print(f"[ERRO] Erro ao chamar a API Gemini: {e}")
-        return "Erro ao gerar resposta com a IA do Gemini."
+        contarResposta("reserva")
+        return respostaReserva(contexto_relevante)
 
 
-def recuperarInfoRelevantes(pergunta: str) -> List[Dict]:
-    """Recupera informações relevantes, considerando também o contexto da conversa"""
+def recuperarComPontuacao(pergunta: str, pergunta_embedding: Optional[np.ndarray] = None,
+                          sessao: Optional[GerenciadorContexto] = None
+                          ) -> Tuple[List[Tuple[Dict, float]], Optional[np.ndarray]]:
+    """Recupera os pares (documento, similaridade) e devolve também o embedding da pergunta,
+    para que quem chama não precise codificar a pergunta de novo."""
+    # Se for continuação, priorizar contexto da conversa
+    if (sessao or contexto_manager).verificarContinuidade(pergunta):
+        return [], pergunta_embedding  # Para continuações, não buscar nova base, usar apenas contexto da conversa
+
     try:
-        # Buscar na base de conhecimento
-        documentos = list(colecao_mensagens.find({"tipo": {"$ne": "interacao", "$ne": "sessao_conversa"}}))
-        
-        # Se for continuação, priorizar contexto da conversa
-        if contexto_manager.verificarContinuidade(pergunta):
-            return []  # Para continuações, não buscar nova base, usar apenas contexto da conversa
-            
+        if not indice_conhecimento.carregado:
+            carregarIndice()
     except Exception as e:
         print(f"[ERRO] Acesso ao banco falhou: {e}")
-        return []
+        return [], pergunta_embedding
+
+    if not len(indice_conhecimento):
+        return [], pergunta_embedding
+
+    if pergunta_embedding is None:
+        with etapa("embedding"):
+            pergunta_embedding = servico_embedding.codificar([pergunta])[0]
+    with etapa("busca"):
+        if BUSCA_HIBRIDA:
+            resultados = indice_conhecimento.buscarHibrido(
+                pergunta, pergunta_embedding, k=TOP_K_DOCUMENTOS, limiar=LIMIAR_RELEVANCIA,
+                candidatos=HIBRIDA_CANDIDATOS, peso_vetor=HIBRIDA_PESO_VETOR, sondagens=HIBRIDA_SONDAGENS,
+            )
+        else:
+            resultados = indice_conhecimento.buscar(pergunta_embedding, k=TOP_K_DOCUMENTOS, limiar=LIMIAR_RELEVANCIA)
+    observarResultados(resultados)
+    return resultados, pergunta_embedding
 
-    if not documentos:
-        return []
 
-    pergunta_embedding = modelo_embedding.encode([pergunta])[0].reshape(1, -1)
-    documentos_com_similaridade = []
+def observarResultados(resultados: List[Tuple[Dict, float]]) -> None:
+    maior = float(resultados[0][1]) if resultados else 0.0
+    registro_metricas.histograma(
+        "tekbot_busca_maior_similaridade", "Similaridade do melhor documento recuperado",
+        limites=[0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0],
+    ).observar(maior)
+    anotar(documentos_recuperados=len(resultados), maior_similaridade=round(maior, 4))
 
-    for doc in documentos:
-        pergunta_doc = doc.get("pergunta", "")
-        if not pergunta_doc:
-            continue
 
-        if "embedding" in doc:
-            doc_embedding = np.array(doc["embedding"]).reshape(1, -1)
-        else:
-            doc_embedding_np = modelo_embedding.encode([pergunta_doc])[0]
-            doc_embedding = doc_embedding_np.reshape(1, -1)
-            try:
-                colecao_mensagens.update_one(
-                    {"_id": doc["_id"]},
-                    {"$set": {"embedding": doc_embedding_np.tolist()}}
-                )
-            except Exception as e:
-                print(f"[WARN] Não foi possível salvar embedding: {e}")
-
-        similaridade = cosine_similarity(pergunta_embedding, doc_embedding)[0][0]
-        documentos_com_similaridade.append((doc, similaridade))
-
-    documentos_com_similaridade.sort(key=lambda x: x[1], reverse=True)
-    return [doc for doc, sim in documentos_com_similaridade[:5] if sim > 0.6]
-
-
-def registrarInteracao(pergunta: str, resposta: str, contexto: List):
-    """Registra a interação no banco e no contexto da conversa"""
-    # Adicionar ao contexto da conversa
-    contexto_manager.adicionarInteracao(pergunta, resposta, contexto)
-    
-    # Registrar no banco como antes
-    interacao = {
-        "tipo": "interacao",
+def responderPorChave(pergunta: str, sessao: Optional[GerenciadorContexto] = None) -> Optional[Dict]:
+    """Documento da base para perguntas que citam um código conhecido (rejeição, CFOP, CST).
+    É uma consulta a um dicionário: não passa pelo modelo de embedding, pela busca nem pelo Gemini."""
+    if (sessao or contexto_manager).verificarContinuidade(pergunta):
+        return None
+    if not indice_conhecimento.carregado:
+        return None
+    with etapa("chave"):
+        documento = indice_conhecimento.chaves.buscar(pergunta)
+    if documento:
+        contarResposta("codigo")
+    return documento
+
+
+def recuperarInfoRelevantes(pergunta: str, sessao: Optional[GerenciadorContexto] = None) -> List[Dict]:
+    """Recupera informações relevantes, considerando também o contexto da conversa"""
+    resultados, _ = recuperarComPontuacao(pergunta, sessao=sessao)
+    return [doc for doc, sim in resultados]
+
+
+def montarRegistroInteracao(pergunta: str, resposta: str, contexto: List, sessao: GerenciadorContexto) -> Dict:
+    return {
         "pergunta": pergunta,
         "resposta": resposta,
-        "contexto_utilizado": [{"_id": doc["_id"], "pergunta": doc.get("pergunta")} for doc in contexto if isinstance(doc, dict)],
-        "sessao_id": contexto_manager.sessao_id,
+        "contexto_utilizado": GerenciadorContexto.compactarContexto(contexto),
+        "sessao_id": sessao.sessao_id,
         "data": datetime.now(timezone.utc)
     }
-    try:
-        colecao_mensagens.insert_one(interacao)
-        print("[INFO] Interação salva no banco de dados.")
-    except Exception as e:
-        print(f"[ERRO] Falha ao salvar interação: {e}")
+
+
+def registrarInteracao(pergunta: str, resposta: str, contexto: List, sessao: Optional[GerenciadorContexto] = None):
+    """Registra a interação no contexto da conversa e a enfileira para gravação no banco"""
+    sessao = sessao or contexto_manager
+    with etapa("registro"):
+        # Adicionar ao contexto da conversa
+        interacao = sessao.adicionarInteracao(pergunta, resposta, contexto)
+
+        # O registro e o histórico da sessão são gravados em lote pelo gravador
+        gravador_interacoes.registrar(montarRegistroInteracao(pergunta, resposta, contexto, sessao))
+        if not sessao.efemera:
+            gravador_interacoes.anexarSessao(sessao.sessao_id, interacao, sessao.max_historico)
+    sessao.alterado = False  # o histórico desta sessão já está a caminho do banco
+
+
+def adicionarConhecimento(documento: Dict):
+    """Insere um documento na base de conhecimento e o indexa imediatamente neste worker.
+    Os demais workers recebem a inclusão pelo sincronizador do índice (campo atualizado_em)."""
+    embedding = servico_embedding.codificar([textoIndexado(documento)])[0]
+    agora = datetime.now(timezone.utc)
+    documento = {
+        **documento, "embedding": empacotarEmbedding(embedding), "atualizado_em": agora,
+        "chaves": extrairChaves(documento.get("pergunta")),
+    }
+    documento.setdefault("data", agora)
+
+    resultado = colecao_conhecimento.insert_one(documento)
+    indice_conhecimento.adicionar(documento, embedding)
+    return resultado.inserted_id
+
+
+def atualizarConhecimento(id_documento, campos: Dict) -> bool:
+    """Edita um documento da base; no índice a linha antiga vira tombstone e a nova vai para o delta"""
+    documento = colecao_conhecimento.find_one({"_id": id_documento, "removido": {"$ne": True}})
+    if not documento:
+        return False
+
+    documento.update(campos)
+    embedding = servico_embedding.codificar([textoIndexado(documento)])[0]
+    documento["embedding"] = empacotarEmbedding(embedding)
+    documento["atualizado_em"] = datetime.now(timezone.utc)
+    documento["chaves"] = extrairChaves(documento.get("pergunta"))
+
+    colecao_conhecimento.update_one({"_id": id_documento}, {"$set": {
+        **campos, "embedding": documento["embedding"], "atualizado_em": documento["atualizado_em"],
+        "chaves": documento["chaves"],
+    }})
+    indice_conhecimento.adicionar(documento, embedding)
+    return True
+
+
+def removerConhecimento(id_documento) -> bool:
+    """Remoção lógica: marca o documento para que todos os workers o retirem do índice"""
+    agora = datetime.now(timezone.utc)
+    resultado = colecao_conhecimento.update_one(
+        {"_id": id_documento, "removido": {"$ne": True}},
+        {"$set": {"removido": True, "atualizado_em": agora}}
+    )
+    if resultado.matched_count == 0:
+        return False
+    indice_conhecimento.remover(id_documento, agora.timestamp())
+    return True
 
 
 def treinarNovaPergunta(pergunta: str, resposta: str):
     """Simula aprendizado incremental armazenando a pergunta e resposta como novo dado de conhecimento."""
     try:
-        embedding = modelo_embedding.encode([pergunta])[0].tolist()
-        novo_conhecimento = {
+        adicionarConhecimento({
             "tipo": "base_conhecimento",
             "pergunta": pergunta,
             "resposta": resposta,
-            "embedding": embedding,
-            "data": datetime.now(timezone.utc)
-        }
-        colecao_mensagens.insert_one(novo_conhecimento)
+        })
         print("[INFO] Nova pergunta/resposta registrada na base de conhecimento.")
     except Exception as e:
         print(f"[ERRO] Falha ao treinar nova pergunta: {e}")
 
 
+# === Pipeline assíncrono (rotas async do FastAPI) ===
+
+async def carregarIndiceAsync() -> int:
+    """Carga inicial do índice: do snapshot, se houver um utilizável, ou lendo o MongoDB pelo
+    motor; a montagem da matriz roda no executor"""
+    loop = asyncio.get_running_loop()
+    if os.path.exists(CAMINHO_SNAPSHOT):
+        with etapa("snapshot"):
+            if await loop.run_in_executor(executor_embedding, carregarSnapshot) is not None:
+                return len(indice_conhecimento)
+
+    inicio_carga = datetime.now(timezone.utc).timestamp()
+    consulta, projecao = indice_conhecimento.consultaCarga()
+    with etapa("leitura_mongo"):
+        documentos = [doc async for doc in colecao_conhecimento_async.find(consulta, projecao)]
+
+    with etapa("montagem_indice"):
+        total = await loop.run_in_executor(
+            executor_embedding, indice_conhecimento.carregarDocumentos,
+            documentos, servico_embedding, colecao_conhecimento, inicio_carga,
+        )
+    print(f"[OK] Índice vetorial carregado com {total} documentos.")
+    return total
+
+
+async def recuperarComPontuacaoAsync(pergunta: str, sessao: Optional[GerenciadorContexto] = None
+                                     ) -> Tuple[List[Tuple[Dict, float]], Optional[np.ndarray]]:
+    """Versão async de recuperarComPontuacao"""
+    sessao = sessao or contexto_manager
+    if sessao.verificarContinuidade(pergunta):
+        return [], None
+
+    try:
+        if not indice_conhecimento.carregado:
+            await carregarIndiceAsync()
+    except Exception as e:
+        print(f"[ERRO] Acesso ao banco falhou: {e}")
+        return [], None
+
+    if not len(indice_conhecimento):
+        return [], None
+
+    # A codificação entra no micro-lote compartilhado; a busca roda no executor
+    with etapa("embedding"):
+        pergunta_embedding = (await servico_embedding.codificarAsync([pergunta]))[0]
+    loop = asyncio.get_running_loop()
+    # copy_context: as etapas medidas na thread do executor entram no rastreamento desta requisição
+    return await loop.run_in_executor(
+        executor_embedding, contextvars.copy_context().run, recuperarComPontuacao, pergunta, pergunta_embedding, sessao
+    )
+
+
+async def gerarRespostaComIaAsync(contexto_relevante: List, pergunta: str,
+                                  contexto_conversa: Optional[str] = None,
+                                  sessao: Optional[GerenciadorContexto] = None) -> str:
+    """Chamada assíncrona ao Gemini: a espera pela API não ocupa nenhuma thread"""
+    if iaSobrecarregada():
+        return respostaDegradada(contexto_relevante)
+    with etapa("prompt"):
+        prompt = montarPrompt(contexto_relevante, pergunta, contexto_conversa, sessao)
+
+    try:
+        with etapa("gemini"):
+            resposta = await cliente_ia.gerarAsync(prompt)
+        contarResposta("ia")
+        return resposta
+    except Exception as e:
+        print(f"[ERRO] Erro ao chamar a API Gemini: {e}")
+        contarResposta("reserva")
+        return respostaReserva(contexto_relevante)
+
+
+async def gerarRespostaComIaStreamAsync(contexto_relevante: List, pergunta: str,
+                                        contexto_conversa: Optional[str] = None,
+                                        sessao: Optional[GerenciadorContexto] = None):
+    """Streaming assíncrono do Gemini, trecho a trecho.
+    Se a falha vier antes do primeiro trecho, a resposta de reserva da base sai como trecho único."""
+    if iaSobrecarregada():
+        yield respostaDegradada(contexto_relevante)
+        return
+    with etapa("prompt"):
+        prompt = montarPrompt(contexto_relevante, pergunta, contexto_conversa, sessao)
+
+    enviou = False
+    try:
+        with etapa("gemini"):
+            async for trecho in cliente_ia.gerarStreamAsync(prompt):
+                enviou = True
+                yield trecho
+        contarResposta("ia")
+
+    except Exception as e:
+        print(f"[ERRO] Erro ao chamar a API Gemini em streaming: {e}")
+        if enviou:
+            raise
+        contarResposta("reserva")
+        yield respostaReserva(contexto_relevante)
+
+
+def podeUsarCache(pergunta_embedding: Optional[np.ndarray], contexto_conversa: Optional[str],
+                  sessao: GerenciadorContexto) -> bool:
+    """O cache é de todos os usuários: só guarda e só serve respostas geradas sem histórico de
+    conversa, que não carregam nada da sessão de quem perguntou"""
+    return pergunta_embedding is not None and not contexto_conversa and not sessao.historico_conversa
+
+
+async def gerarRespostaComCacheAsync(contexto_relevante: List, pergunta: str, pergunta_embedding: Optional[np.ndarray],
+                                     contexto_conversa: Optional[str] = None,
+                                     sessao: Optional[GerenciadorContexto] = None) -> str:
+    """Consulta o cache semântico antes de chamar o Gemini e guarda a resposta gerada.
+    Com histórico de conversa a resposta depende dele e não passa pelo cache."""
+    sessao = sessao or contexto_manager
+    usar_cache = podeUsarCache(pergunta_embedding, contexto_conversa, sessao)
+    if usar_cache:
+        with etapa("cache"):
+            resposta = cache_respostas.buscar(pergunta_embedding)
+        if resposta is not None:
+            contarResposta("cache")
+            return resposta
+
+    resposta = await gerarRespostaComIaAsync(contexto_relevante, pergunta, contexto_conversa, sessao)
+    if usar_cache and not ehRespostaReserva(resposta):
+        cache_respostas.guardar(pergunta, pergunta_embedding, resposta, [doc["_id"] for doc in contexto_relevante])
+    return resposta
+
+
+async def gerarRespostaComCacheStreamAsync(contexto_relevante: List, pergunta: str,
+                                           pergunta_embedding: Optional[np.ndarray],
+                                           contexto_conversa: Optional[str] = None,
+                                           sessao: Optional[GerenciadorContexto] = None):
+    """Como gerarRespostaComCacheAsync, mas em trechos; um acerto no cache sai como um único trecho.
+    A resposta só entra no cache se o streaming terminar sem erro."""
+    sessao = sessao or contexto_manager
+    usar_cache = podeUsarCache(pergunta_embedding, contexto_conversa, sessao)
+    if usar_cache:
+        with etapa("cache"):
+            resposta = cache_respostas.buscar(pergunta_embedding)
+        if resposta is not None:
+            contarResposta("cache")
+            yield resposta
+            return
+
+    trechos = []
+    async for trecho in gerarRespostaComIaStreamAsync(contexto_relevante, pergunta, contexto_conversa, sessao):
+        trechos.append(trecho)
+        yield trecho
+
+    resposta = "".join(trechos).strip()
+    if usar_cache and resposta and not ehRespostaReserva(resposta):
+        cache_respostas.guardar(pergunta, pergunta_embedding, resposta, [doc["_id"] for doc in contexto_relevante])
+
+
+LIMIAR_RESPOSTA_DIRETA = 0.9  # acima disto a resposta cadastrada é devolvida sem IA
+CONCORRENCIA_IA_LOTE = int(os.getenv("LOTE_CONCORRENCIA_IA", 4))
+
+
+async def responderEmLoteAsync(perguntas: List[str]) -> List[Dict]:
+    """Responde uma lista de perguntas independentes (ex.: as rejeições de um lote de NF-e).
+
+    Perguntas repetidas são respondidas uma vez. Códigos conhecidos saem do índice de
+    chaves; as demais são codificadas numa única chamada ao modelo e buscadas com um
+    único produto matriz-matriz. Respostas diretas e acertos do cache voltam sem IA e só
+    o que sobra vai ao Gemini, com no máximo CONCORRENCIA_IA_LOTE chamadas simultâneas.
+    """
+    sessao_lote = GerenciadorContexto(efemera=True)  # sem histórico: cada item é uma pergunta isolada
+    unicas = list(dict.fromkeys(pergunta.strip() for pergunta in perguntas))
+    resultados: Dict[str, Dict] = {}
+
+    if not indice_conhecimento.carregado:
+        await carregarIndiceAsync()
+
+    pendentes = []
+    for pergunta in unicas:
+        doc_chave = indice_conhecimento.chaves.buscar(pergunta)
+        if doc_chave:
+            resultados[pergunta] = {"resposta": doc_chave.get("resposta") or doc_chave.get("texto", ""),
+                                    "origem": "codigo", "contexto": [doc_chave]}
+        else:
+            pendentes.append(pergunta)
+
+    sem_resposta = []
+    if pendentes:
+        with etapa("embedding"):
+            embeddings = await servico_embedding.codificarAsync(pendentes)
+        loop = asyncio.get_running_loop()
+        with etapa("busca"):
+            encontrados = await loop.run_in_executor(
+                executor_embedding, lambda: indice_conhecimento.buscarLote(embeddings, TOP_K_DOCUMENTOS, LIMIAR_RELEVANCIA)
+            )
+        for pergunta, embedding, documentos in zip(pendentes, embeddings, encontrados):
+            if documentos and documentos[0][1] >= LIMIAR_RESPOSTA_DIRETA:
+                melhor_doc = documentos[0][0]
+                resultados[pergunta] = {"resposta": melhor_doc.get("resposta") or melhor_doc.get("texto", ""),
+                                        "origem": "base", "contexto": [melhor_doc]}
+                continue
+            contexto = [doc for doc, _ in documentos]
+            resposta = cache_respostas.buscar(embedding)
+            if resposta is not None:
+                resultados[pergunta] = {"resposta": resposta, "origem": "cache", "contexto": contexto}
+            else:
+                sem_resposta.append((pergunta, embedding, contexto))
+
+    # Só as perguntas sem resposta pronta vão ao Gemini, com concorrência limitada
+    semaforo = asyncio.Semaphore(CONCORRENCIA_IA_LOTE)
+
+    async def gerar(pergunta, embedding, contexto):
+        async with semaforo:
+            resposta = await gerarRespostaComIaAsync(contexto, pergunta, sessao=sessao_lote)
+        if ehRespostaReserva(resposta):
+            if resposta == MENSAGEM_ERRO_IA:
+                origem = "erro"
+            elif resposta.startswith(AVISO_MODO_DEGRADADO):
+                origem = "degradado"
+            else:
+                origem = "reserva"
+        else:
+            origem = "ia"
+            cache_respostas.guardar(pergunta, embedding, resposta, [doc["_id"] for doc in contexto])
+        resultados[pergunta] = {"resposta": resposta, "origem": origem, "contexto": contexto}
+
+    await asyncio.gather(*(gerar(*item) for item in sem_resposta))
+    geradas = {pergunta for pergunta, _, _ in sem_resposta}
+
+    for pergunta in unicas:
+        resultado = resultados[pergunta]
+        if pergunta not in geradas:  # as geradas já foram contadas em gerarRespostaComIaAsync
+            contarResposta(resultado["origem"])
+        gravador_interacoes.registrar(
+            montarRegistroInteracao(pergunta, resultado["resposta"], resultado["contexto"], sessao_lote)
+        )
+    return [
+        {"pergunta": pergunta, "resposta": resultados[pergunta.strip()]["resposta"],
+         "origem": resultados[pergunta.strip()]["origem"]}
+        for pergunta in perguntas
+    ]
+
+
+async def registrarInteracaoAsync(pergunta: str, resposta: str, contexto: List,
+                                  sessao: Optional[GerenciadorContexto] = None):
+    """Versão async de registrarInteracao; só enfileira, então não espera o banco"""
+    registrarInteracao(pergunta, resposta, contexto, sessao)
+
+
 # === Execução via terminal para testes ===
 if __name__ == "__main__":
     print("\n[ASSISTENTE ERP - Tek-System IA com Gemini e Contexto Conversacional]")
@@ -306,6 +890,7 @@ if __name__ == "__main__":
                 
             if pergunta.lower() == "sair":
                 contexto_manager.salvarSessao()
+                gravador_interacoes.parar()
                 print("Encerrando assistente. Conversa salva.")
                 break
                 
@@ -330,18 +915,24 @@ if __name__ == "__main__":
             # Obter contexto da conversa atual
             contexto_conversa = contexto_manager.obterContextoConversa()
             
-            # Recuperar documentos relevantes
-            documentos_relevantes = recuperarInfoRelevantes(pergunta)
+            # Código de rejeição/CFOP/CST conhecido: resposta exata da base
+            doc_chave = responderPorChave(pergunta)
+            if doc_chave:
+                resposta = doc_chave.get("resposta") or doc_chave.get("texto", "")
+                print(f"\n[RESPOSTA (código)]: {resposta}\n")
+                registrarInteracao(pergunta, resposta, [doc_chave])
+                continue
+
+            # Recuperar documentos relevantes (já ordenados e com a similaridade calculada)
+            resultados, _ = recuperarComPontuacao(pergunta)
+            documentos_relevantes = [doc for doc, sim in resultados]
 
             # Verificar se é resposta direta de alta similaridade
-            if documentos_relevantes and not contexto_manager.verificarContinuidade(pergunta):
-                pergunta_embedding = modelo_embedding.encode([pergunta]).reshape(1, -1)
-                doc_top = documentos_relevantes[0]
-                doc_embedding = modelo_embedding.encode([doc_top.get("pergunta", "")]).reshape(1, -1)
-                similaridade = cosine_similarity(pergunta_embedding, doc_embedding)[0][0]
-                
+            if resultados and not contexto_manager.verificarContinuidade(pergunta):
+                doc_top, similaridade = resultados[0]
+
                 if similaridade > 0.9:
-                    resposta = doc_top.get("resposta", "")
+                    resposta = doc_top.get("resposta") or doc_top.get("texto", "")
                     print(f"\n[RESPOSTA (base)]: {resposta}\n")
                     registrarInteracao(pergunta, resposta, [doc_top])
                     continue
@@ -356,6 +947,7 @@ if __name__ == "__main__":
 
         except KeyboardInterrupt:
             contexto_manager.salvarSessao()
+            gravador_interacoes.parar()
             print("\nEncerrando assistente. Conversa salva.")
             break
         except Exception as e:
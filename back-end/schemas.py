@@ -1,4 +1,5 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
+from typing import List
 
 # Classe para criar um usuário
 class UsuarioCriar(BaseModel):
@@ -24,6 +25,10 @@ class RequisicaoConsulta(BaseModel):
 class PerguntaEntrada(BaseModel):
     pergunta: str
 
+# Lote de perguntas (ex.: todas as rejeições de um lote de NF-e)
+class PerguntasEmLote(BaseModel):
+    perguntas: List[str] = Field(..., min_length=1, max_length=200)
+
 class MensagemEntrada(BaseModel):
     texto: str
 
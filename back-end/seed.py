@@ -1,113 +1,283 @@
-from pymongo import MongoClient, errors
+from pymongo import UpdateOne, errors
 from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
 import os
 import sys
 import xml.etree.ElementTree as ET
 import re
+import json
+import time
+from itertools import islice
+from indice import empacotarEmbedding
+from chaves import extrairChaves
+from datetime import datetime, timezone
 
 # === Carrega variáveis de ambiente ===
 load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
+from embeddings import NOME_MODELO_EMBEDDING  # depois do load_dotenv: lê EMBEDDING_MODELO do .env
 
 if not MONGO_URI:
     print("[ERRO] Variável de ambiente MONGO_URI não definida.")
     sys.exit(1)
 
+# Mensagens processadas por lote: uma consulta $in, um encode e um bulk_write por lote
+TAMANHO_LOTE = int(os.getenv("SEED_TAMANHO_LOTE", 256))
+ARQUIVO_CHECKPOINT = os.getenv("SEED_CHECKPOINT", ".seed_checkpoint.json")
+
 # === Inicializa modelo de embedding ===
-print("[INFO] Carregando modelo de embeddings...")
-modelo_embedding = SentenceTransformer("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+# Mesmo modelo da API (EMBEDDING_MODELO): o snapshot e as buscas dependem disso
+print(f"[INFO] Carregando modelo de embeddings ({NOME_MODELO_EMBEDDING})...")
+modelo_embedding = SentenceTransformer(NOME_MODELO_EMBEDDING)
 print("[OK] Modelo carregado com sucesso.")
 
-def conectar_mongodb(uri):
+def conectar_mongodb():
     try:
-        client = MongoClient(uri)
-        db = client["tekbot"]
-        return db["mensagens"]
-    except errors.ConnectionFailure as e:
+        from database import colecao_conhecimento, criarIndices
+        criarIndices()  # o índice em pergunta atende a deduplicação de cada lote
+        return colecao_conhecimento
+    except errors.PyMongoError as e:
         print(f"[ERRO] Falha na conexão com o MongoDB: {e}")
         sys.exit(1)
 
-def carregarMensagemXml(path):
-    mensagens = []
+# Tags do fp3: m18 traz a descrição (pergunta) e m17 a solução (resposta)
+PADRAO_TAG_FP3 = re.compile(r'<m17[^>]*u="Solução: (.*?)"\s*/>|<m18[^>]*u="Descrição: (.*?)"\s*/>')
+TAMANHO_BLOCO_FP3 = 1024 * 1024
+
+
+def limparTextoFp3(texto):
+    return texto.replace('&#13;&#10;', '\n').replace('&#34;', '"').strip()
+
+
+def iterarMensagensXml(path):
+    """Lê o XML em streaming: cada <mensagem> é liberada da árvore logo depois de lida"""
     try:
-        tree = ET.parse(path)
-        root = tree.getroot()
-        for item in root.findall("mensagem"):
-            pergunta_el = item.find("pergunta")
-            resposta_el = item.find("resposta")
-
-            if pergunta_el is not None and resposta_el is not None:
-                pergunta = pergunta_el.text.strip()
-                resposta = resposta_el.text.strip()
-                mensagens.append({"pergunta": pergunta, "resposta": resposta})
+        contexto = ET.iterparse(path, events=("start", "end"))
+        _, raiz = next(contexto)
+        for evento, item in contexto:
+            if evento != "end" or item.tag != "mensagem":
+                continue
+
+            pergunta = (item.findtext("pergunta") or "").strip()
+            resposta = (item.findtext("resposta") or "").strip()
+            if pergunta and resposta:
+                yield {"pergunta": pergunta, "resposta": resposta}
+
+            # Solta o elemento já processado para a memória não crescer com o arquivo
+            item.clear()
+            raiz.clear()
     except Exception as e:
         print(f"[ERRO] Falha ao ler '{path}': {e}")
-    return mensagens
 
-def carregarMensagemFp3(path):
-    mensagens = []
+
+def iterarMensagensFp3(path, tamanho_bloco=TAMANHO_BLOCO_FP3):
+    """Lê o fp3 em blocos e emite pares descrição/solução na ordem em que aparecem.
+
+    A primeira tag encontrada define qual delas abre cada registro. Uma tag de
+    fechamento sem abertura pendente (ou uma abertura repetida) indica registro
+    incompleto, que é descartado com aviso em vez de desalinhar os seguintes.
+    """
+    abertura = None  # "descricao" ou "solucao", conforme a ordem do arquivo
+    pendente_registro = None
+    descartados = 0
     try:
         with open(path, "r", encoding="utf-8") as arquivo:
-            conteudo = arquivo.read()
+            pendente = ""
+            while True:
+                bloco = arquivo.read(tamanho_bloco)
+                pendente += bloco
 
-        solucoes = re.findall(r'<m17[^>]*u="Solução: (.*?)"\s*/>', conteudo)
-        descricoes = re.findall(r'<m18[^>]*u="Descrição: (.*?)"\s*/>', conteudo)
+                fim_processado = 0
+                for encontrado in PADRAO_TAG_FP3.finditer(pendente):
+                    fim_processado = encontrado.end()
+                    texto_solucao, texto_descricao = encontrado.groups()
+                    tipo = "descricao" if texto_descricao is not None else "solucao"
+                    valor = limparTextoFp3(texto_descricao if texto_descricao is not None else texto_solucao)
+                    abertura = abertura or tipo
 
-        for solucao, descricao in zip(solucoes, descricoes):
-            solucao = solucao.replace('&#13;&#10;', '\n').replace('&#34;', '"').strip()
-            descricao = descricao.replace('&#13;&#10;', '\n').replace('&#34;', '"').strip()
-            mensagens.append({
-                "pergunta": descricao,
-                "resposta": solucao
-            })
+                    if tipo == abertura:
+                        if pendente_registro is not None:
+                            descartados += 1
+                        pendente_registro = valor
+                    elif pendente_registro is None:
+                        descartados += 1
+                    else:
+                        descricao, solucao = (pendente_registro, valor) if abertura == "descricao" else (valor, pendente_registro)
+                        yield {"pergunta": descricao, "resposta": solucao}
+                        pendente_registro = None
+
+                if not bloco:
+                    break
+
+                # Mantém só o trecho que ainda pode conter uma tag cortada no fim do bloco
+                pendente = pendente[fim_processado:]
+                inicio_tag = pendente.rfind("<")
+                pendente = pendente[inicio_tag:] if inicio_tag != -1 else ""
 
     except Exception as e:
         print(f"[ERRO] Falha ao ler '{path}': {e}")
-    return mensagens
 
-def inserir_mensagens(colecao, mensagens):
-    for item in mensagens:
-        pergunta = item["pergunta"]
-        resposta = item["resposta"]
+    if pendente_registro is not None:
+        descartados += 1
+    if descartados:
+        print(f"[AVISO] {descartados} registros sem par descrição/solução ignorados em '{path}'.")
+
+
+def carregarMensagemXml(path):
+    return list(iterarMensagensXml(path))
+
+
+def carregarMensagemFp3(path):
+    return list(iterarMensagensFp3(path))
+
+
+def lerCheckpoint(caminho=ARQUIVO_CHECKPOINT):
+    try:
+        with open(caminho, "r", encoding="utf-8") as arquivo:
+            return json.load(arquivo)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def salvarCheckpoint(checkpoint, caminho=ARQUIVO_CHECKPOINT):
+    # Grava em arquivo temporário e troca: uma interrupção nunca deixa o checkpoint pela metade
+    temporario = caminho + ".tmp"
+    with open(temporario, "w", encoding="utf-8") as arquivo:
+        json.dump(checkpoint, arquivo, ensure_ascii=False, indent=2)
+    os.replace(temporario, caminho)
+
+
+def assinaturaArquivo(path):
+    """Identifica a versão do arquivo de origem; se ele mudar, o checkpoint antigo não vale"""
+    info = os.stat(path)
+    return {"tamanho": info.st_size, "modificado": info.st_mtime}
+
+
+def emLotes(iteravel, tamanho):
+    iterador = iter(iteravel)
+    while True:
+        lote = list(islice(iterador, tamanho))
+        if not lote:
+            return
+        yield lote
+
+
+def inserir_mensagens(colecao, mensagens, origem=None, checkpoint=None, tamanho_lote=TAMANHO_LOTE):
+    """Insere as mensagens em lotes e retoma do checkpoint se a origem já foi parcialmente carregada.
+
+    Para cada lote: deduplica contra o banco com uma única consulta $in, codifica
+    as perguntas novas de uma vez e grava com bulk_write não ordenado. Os upserts
+    com $setOnInsert tornam a carga repetível (rodar de novo não duplica nada), mas
+    o índice em pergunta não é único: dois seeds simultâneos sobre as mesmas
+    perguntas podem inserir duplicatas, então rode um seed por vez.
+    """
+    estado = {}
+    if origem and checkpoint is not None:
+        assinatura = assinaturaArquivo(origem)
+        estado = checkpoint.get(origem, {})
+        if estado.get("assinatura") != assinatura:
+            estado = {"assinatura": assinatura, "processados": 0, "concluido": False}
+        if estado.get("concluido"):
+            print(f"[SKIP] '{origem}' já foi carregado por completo (checkpoint).")
+            return 0
+        if estado["processados"]:
+            print(f"[INFO] Retomando '{origem}' a partir da mensagem {estado['processados']}.")
+            mensagens = islice(mensagens, estado["processados"], None)
+        checkpoint[origem] = estado
+
+    processados = estado.get("processados", 0)
+    inseridos = ignorados = 0
+    inicio = time.perf_counter()
+
+    for lote in emLotes(mensagens, tamanho_lote):
+        # Remove repetidas dentro do lote e as que já existem no banco. Repetidas de lotes
+        # anteriores já foram gravadas e caem no $in: a memória não cresce com o arquivo
+        candidatos = {}
+        for item in lote:
+            pergunta = item["pergunta"]
+            if pergunta and pergunta not in candidatos:
+                candidatos[pergunta] = item["resposta"]
+
         try:
-            if colecao.find_one({"pergunta": pergunta}):
-                print(f"[SKIP] Já existe: {pergunta[:60]}...")
-                continue
+            existentes = {
+                doc["pergunta"]
+                for doc in colecao.find({"pergunta": {"$in": list(candidatos)}}, {"pergunta": 1, "_id": 0})
+            }
+            novos = [(pergunta, resposta) for pergunta, resposta in candidatos.items() if pergunta not in existentes]
+
+            inseridos_lote = 0
+            if novos:
+                embeddings = modelo_embedding.encode([pergunta for pergunta, _ in novos], batch_size=64)
+                agora = datetime.now(timezone.utc)
+                operacoes = [
+                    UpdateOne(
+                        {"pergunta": pergunta},
+                        {"$setOnInsert": {
+                            "pergunta": pergunta,
+                            "resposta": resposta,
+                            "embedding": empacotarEmbedding(embedding),
+                            # Códigos de rejeição/CFOP/CST: atendidos sem busca vetorial
+                            "chaves": extrairChaves(pergunta),
+                            # Permite que os workers em execução incorporem a entrada sem reiniciar
+                            "atualizado_em": agora
+                        }},
+                        upsert=True
+                    )
+                    for (pergunta, resposta), embedding in zip(novos, embeddings)
+                ]
+                inseridos_lote = colecao.bulk_write(operacoes, ordered=False).upserted_count
+
+        except errors.PyMongoError as e:
+            # Sem avançar o checkpoint: ao rodar de novo, o lote é refeito (a carga é idempotente)
+            print(f"[ERRO] Falha ao gravar lote iniciado em '{lote[0]['pergunta'][:60]}...': {e}")
+            raise
+
+        inseridos += inseridos_lote
+        ignorados += len(lote) - inseridos_lote
+        processados += len(lote)
+        if origem and checkpoint is not None:
+            estado["processados"] = processados
+            salvarCheckpoint(checkpoint)
+
+        decorrido = time.perf_counter() - inicio
+        print(f"[OK] {processados} processadas | {inseridos} inseridas | {ignorados} ignoradas | "
+              f"{(inseridos + ignorados) / decorrido:.1f} msg/s")
 
-            embedding = modelo_embedding.encode([pergunta])[0]
-            colecao.insert_one({
-                "pergunta": pergunta,
-                "resposta": resposta,
-                "embedding": embedding.tolist()
-            })
-            print(f"[OK] Inserido: {pergunta[:60]}...")
+    if origem and checkpoint is not None:
+        estado["concluido"] = True
+        salvarCheckpoint(checkpoint)
+
+    decorrido = time.perf_counter() - inicio
+    print(f"[INFO] Lote concluído: {inseridos} inseridas, {ignorados} já existentes/repetidas em {decorrido:.1f}s.")
+    return inseridos
 
-        except Exception as e:
-            print(f"[ERRO] Falha ao inserir '{pergunta[:60]}...': {e}")
 
 if __name__ == "__main__":
     print("[INFO] Conectando ao MongoDB...")
-    colecao = conectar_mongodb(MONGO_URI)
+    colecao = conectar_mongodb()
     print("[OK] Conectado.")
 
     print("[INFO] Carregando mensagens...")
-    mensagens = []
-
-    if os.path.exists("mensagens_rag.xml"):
-        mensagens_xml = carregarMensagemXml("mensagens_rag.xml")
-        mensagens += mensagens_xml
-        print(f"[OK] mensagens_rag.xml carregado com {len(mensagens_xml)} mensagens.")
-
-    if os.path.exists("mensagens.fp3"):
-        mensagens_fp3 = carregarMensagemFp3("mensagens.fp3")
-        mensagens += mensagens_fp3
-        print(f"[OK] mensagens.fp3 carregado com {len(mensagens_fp3)} mensagens.")
+    checkpoint = lerCheckpoint()
+    # Os leitores são geradores: o arquivo é lido aos poucos, conforme os lotes são gravados
+    fontes = [
+        ("mensagens_rag.xml", iterarMensagensXml),
+        ("mensagens.fp3", iterarMensagensFp3),
+    ]
 
-    if not mensagens:
+    fontes_encontradas = [(path, carregar) for path, carregar in fontes if os.path.exists(path)]
+    if not fontes_encontradas:
         print("[AVISO] Nenhuma mensagem para inserir.")
         sys.exit(0)
 
-    print(f"[INFO] Total de mensagens a inserir: {len(mensagens)}")
-    inserir_mensagens(colecao, mensagens)
+    for path, iterar in fontes_encontradas:
+        print(f"[INFO] Lendo {path}...")
+        inserir_mensagens(colecao, iterar(path), origem=path, checkpoint=checkpoint)
+
+    # --snapshot: regrava o snapshot da base (ver snapshot.py) com o que acabou de ser carregado
+    if "--snapshot" in sys.argv:
+        from snapshot import exportar
+        from indice import CAMINHO_SNAPSHOT
+        exportar(CAMINHO_SNAPSHOT, modelo=NOME_MODELO_EMBEDDING)
+
     print("[FINALIZADO] Processo concluído.")
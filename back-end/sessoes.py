@@ -0,0 +1,103 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, List, Optional, TypeVar
+
+Sessao = TypeVar("Sessao")
+
+
+class ArmazemSessoes(Generic[Sessao]):
+    """Sessões de conversa em memória, uma por chave (usuário autenticado ou id de sessão).
+
+    Sessões que ainda não estão em memória são criadas por `fabrica(chave)`, que
+    pode recuperá-las do banco. O armazém guarda no máximo `capacidade` sessões:
+    a menos usada sai primeiro (LRU) e as paradas há mais de `inatividade_segundos`
+    também são descartadas. Antes de sair, cada sessão passa por `ao_descartar`
+    (por exemplo, para ser salva no banco).
+    """
+
+    def __init__(self, fabrica: Callable[[str], Sessao], capacidade: int = 1000,
+                 inatividade_segundos: float = 1800, ao_descartar: Optional[Callable[[Sessao], None]] = None):
+        self.fabrica = fabrica
+        self.capacidade = capacidade
+        self.inatividade_segundos = inatividade_segundos
+        self.ao_descartar = ao_descartar
+        self.criadas = 0
+        self.reaproveitadas = 0
+        self.descartadas = 0
+        self._sessoes: "OrderedDict[str, List]" = OrderedDict()  # chave -> [sessao, ultimo_uso], da menos para a mais recente
+        self._trava = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessoes)
+
+    def obter(self, chave: str) -> Sessao:
+        """Devolve a sessão da chave, carregando-a (ou criando-a) se não estiver em memória"""
+        agora = time.monotonic()
+        with self._trava:
+            entrada = self._sessoes.get(chave)
+            if entrada is not None:
+                entrada[1] = agora
+                self._sessoes.move_to_end(chave)
+                self.reaproveitadas += 1
+                return entrada[0]
+
+        # A fábrica pode ir ao banco: roda fora da trava para não segurar as outras sessões
+        sessao = self.fabrica(chave)
+
+        with self._trava:
+            entrada = self._sessoes.get(chave)
+            if entrada is not None:  # outra requisição da mesma chave chegou antes
+                entrada[1] = agora
+                self._sessoes.move_to_end(chave)
+                return entrada[0]
+            self._sessoes[chave] = [sessao, agora]
+            self.criadas += 1
+            descartadas = self._expirar(agora)
+
+        self._finalizar(descartadas)
+        return sessao
+
+    def descartarInativas(self) -> int:
+        with self._trava:
+            descartadas = self._expirar(time.monotonic())
+        self._finalizar(descartadas)
+        return len(descartadas)
+
+    def salvarTodas(self) -> None:
+        """Esvazia o armazém passando todas as sessões por `ao_descartar` (desligamento do servidor)"""
+        with self._trava:
+            descartadas = [sessao for sessao, _ in self._sessoes.values()]
+            self._sessoes.clear()
+        self._finalizar(descartadas)
+
+    def estatisticas(self) -> Dict:
+        return {
+            "sessoes": len(self._sessoes),
+            "capacidade": self.capacidade,
+            "inatividade_segundos": self.inatividade_segundos,
+            "criadas": self.criadas,
+            "reaproveitadas": self.reaproveitadas,
+            "descartadas": self.descartadas,
+        }
+
+    def _expirar(self, agora: float) -> List[Sessao]:
+        """Retira as sessões inativas e o excedente da capacidade (chamar com a trava)"""
+        descartadas = []
+        while self._sessoes:
+            chave, (sessao, ultimo_uso) = next(iter(self._sessoes.items()))
+            if len(self._sessoes) <= self.capacidade and agora - ultimo_uso <= self.inatividade_segundos:
+                break  # a mais antiga ainda é válida, então as demais também são
+            del self._sessoes[chave]
+            descartadas.append(sessao)
+        self.descartadas += len(descartadas)
+        return descartadas
+
+    def _finalizar(self, descartadas: List[Sessao]) -> None:
+        if not self.ao_descartar:
+            return
+        for sessao in descartadas:
+            try:
+                self.ao_descartar(sessao)
+            except Exception as e:
+                print(f"[ERRO] Falha ao descartar sessão: {e}")
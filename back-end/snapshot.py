@@ -0,0 +1,76 @@
+import argparse
+import time
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+from indice import abrirSnapshot, DocumentosMapeados, empacotarEmbedding, CAMINHO_SNAPSHOT
+
+# Snapshot da base de conhecimento: um arquivo versionado com os embeddings float32, os
+# metadados (BSON com tabela de deslocamentos), o mapa de ids e as estruturas do índice
+# (listas IVF, postings do BM25). Os workers sobem mapeando o arquivo e só aplicam o que
+# mudou no MongoDB depois da marca d'água dele.
+# Uso:
+#   python snapshot.py exportar [--arquivo CAMINHO]     (MongoDB -> snapshot)
+#   python snapshot.py importar [--arquivo CAMINHO]     (snapshot -> MongoDB, ex.: ambiente novo)
+#   python snapshot.py info [--arquivo CAMINHO]
+# O caminho padrão vem de INDICE_SNAPSHOT; `python seed.py --snapshot` grava um novo depois da carga.
+
+TAMANHO_LOTE = 1000
+
+
+def exportar(caminho: str, modelo: str = None) -> dict:
+    from rag import carregarIndice, exportarSnapshot
+
+    inicio = time.perf_counter()
+    carregarIndice()  # sempre a partir do MongoDB: o snapshot anterior não entra na conta
+    cabecalho = exportarSnapshot(caminho, modelo)
+    print(f"[INFO] Exportação concluída em {time.perf_counter() - inicio:.1f}s.")
+    return cabecalho
+
+
+def importar(caminho: str) -> int:
+    """Grava no MongoDB os documentos do snapshot (upsert por _id), com embedding e atualizado_em.
+    Só os campos guardados no snapshot (os usados pelo índice) são restaurados."""
+    from database import colecao_conhecimento
+
+    cabecalho, secoes = abrirSnapshot(caminho)
+    documentos = DocumentosMapeados(secoes["documentos"], secoes["deslocamentos"])
+    gravados, operacoes, inicio = 0, [], time.perf_counter()
+
+    for linha, doc in enumerate(documentos):
+        campos = {campo: valor for campo, valor in doc.items() if campo != "_id" and valor is not None}
+        campos["embedding"] = empacotarEmbedding(secoes["matriz"][linha])
+        if secoes["versoes"][linha]:
+            campos["atualizado_em"] = datetime.fromtimestamp(float(secoes["versoes"][linha]), timezone.utc)
+        operacoes.append(UpdateOne({"_id": doc["_id"]}, {"$set": campos}, upsert=True))
+        if len(operacoes) >= TAMANHO_LOTE:
+            resultado = colecao_conhecimento.bulk_write(operacoes, ordered=False)
+            gravados += resultado.upserted_count + resultado.modified_count
+            operacoes = []
+            print(f"[INFO] {linha + 1}/{cabecalho['documentos']} documentos importados...")
+
+    if operacoes:
+        resultado = colecao_conhecimento.bulk_write(operacoes, ordered=False)
+        gravados += resultado.upserted_count + resultado.modified_count
+
+    print(f"[OK] {gravados} documentos gravados a partir de {caminho} em {time.perf_counter() - inicio:.1f}s.")
+    return gravados
+
+
+def info(caminho: str) -> dict:
+    cabecalho, secoes = abrirSnapshot(caminho)
+    marca_dagua = datetime.fromtimestamp(cabecalho["marca_dagua"], timezone.utc)
+    print(f"[INFO] {caminho}: formato v{cabecalho['versao']}, {cabecalho['documentos']} documentos, "
+          f"dimensão {cabecalho['dimensao']}, índice {cabecalho['tipo_indice']}, "
+          f"modelo {cabecalho.get('modelo_embedding')}, marca d'água {marca_dagua.isoformat()}")
+    for nome, array in secoes.items():
+        print(f"       {nome}: {array.dtype} {list(array.shape)} ({array.nbytes / 1024 / 1024:.1f} MB)")
+    return cabecalho
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta, importa ou descreve o snapshot da base de conhecimento")
+    parser.add_argument("comando", choices=["exportar", "importar", "info"])
+    parser.add_argument("--arquivo", default=CAMINHO_SNAPSHOT)
+    args = parser.parse_args()
+
+    {"exportar": exportar, "importar": importar, "info": info}[args.comando](args.arquivo)
@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+import pytest
+
+from admissao import ControleAdmissao, LimitadorTaxa, MiddlewareAdmissao, Sobrecarga
+
+
+def test_limitador_recusa_depois_da_rajada():
+    limitador = LimitadorTaxa(taxa=1.0, rajada=2)
+    assert limitador.permitir("ana")[0]
+    assert limitador.permitir("ana")[0]
+    permitido, espera = limitador.permitir("ana")
+    assert not permitido and 0 < espera <= 1.0
+    assert limitador.limitados == 1
+
+    # Cada chave tem o seu balde
+    assert limitador.permitir("bruno")[0]
+
+
+def test_limitador_descarta_a_chave_menos_recente():
+    limitador = LimitadorTaxa(taxa=1.0, rajada=1, max_chaves=2)
+    for chave in ("a", "b", "c"):
+        limitador.permitir(chave)
+    assert limitador.estatisticas()["chaves"] == 2
+    assert limitador.permitir("a")[0]  # "a" saiu e voltou com o balde cheio
+
+
+def test_controle_recusa_sem_vaga_nem_fila():
+    controle = ControleAdmissao(max_em_andamento=1, max_fila=0)
+
+    async def cenario():
+        async with controle.admitir():
+            with pytest.raises(Sobrecarga):
+                async with controle.admitir():
+                    pass
+        async with controle.admitir():  # a vaga foi liberada
+            pass
+
+    asyncio.run(cenario())
+    assert controle.admitidos == 2 and controle.recusados == 1 and controle.em_andamento == 0
+
+
+def test_controle_recusa_quem_espera_demais_na_fila():
+    controle = ControleAdmissao(max_em_andamento=1, max_fila=1, espera_maxima=0.05)
+
+    async def cenario():
+        async with controle.admitir():
+            with pytest.raises(Sobrecarga) as erro:
+                async with controle.admitir():
+                    pass
+            assert erro.value.espera >= 1.0
+
+    asyncio.run(cenario())
+    assert controle.recusados == 1 and controle.na_fila == 0
+
+
+def test_middleware_responde_429_com_retry_after():
+    chamadas = []
+
+    async def app(scope, receive, send):
+        chamadas.append(scope["path"])
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    middleware = MiddlewareAdmissao(app, ControleAdmissao(), LimitadorTaxa(taxa=0.5, rajada=1),
+                                    caminhos=["/ia/responder"], identificar=lambda cabecalhos, ip: ip)
+
+    async def pedir(caminho):
+        enviados = []
+
+        async def send(mensagem):
+            enviados.append(mensagem)
+
+        scope = {"type": "http", "path": caminho, "method": "POST", "headers": [], "client": ("10.0.0.1", 1234)}
+        await middleware(scope, None, send)
+        return enviados
+
+    assert asyncio.run(pedir("/ia/responder"))[0]["status"] == 200
+    recusa = asyncio.run(pedir("/ia/responder"))
+    assert recusa[0]["status"] == 429
+    assert dict(recusa[0]["headers"])[b"retry-after"] == b"2"
+    assert "detail" in json.loads(recusa[1]["body"])
+
+    # Rotas fora da lista não passam pelo limite
+    assert asyncio.run(pedir("/health"))[0]["status"] == 200
+    assert chamadas == ["/ia/responder", "/health"]
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.error import HTTPError
+
+import pytest
+
+from cliente_ia import CircuitoAberto, ClienteGemini, DisjuntorCircuito
+
+# Servidor stub local no lugar do Gemini: nenhum teste sai para a rede
+
+
+class ServiceUnavailable(Exception):
+    """Mesmo nome do erro 503 da API (ver ERROS_TRANSITORIOS)"""
+
+
+class InvalidArgument(Exception):
+    """Erro definitivo: a API respondeu, não vale repetir"""
+
+
+class ServidorStub:
+    """Responde 503 nos primeiros `falhas` pedidos e conta quantos estão em andamento"""
+
+    def __init__(self, falhas=0, demora=0.0, status_erro=503):
+        self.falhas = falhas
+        self.demora = demora
+        self.status_erro = status_erro
+        self.pedidos = 0
+        self.em_andamento = 0
+        self.pico = 0
+        self._trava = threading.Lock()
+        stub = self
+
+        class Manipulador(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                with stub._trava:
+                    stub.pedidos += 1
+                    numero = stub.pedidos
+                    stub.em_andamento += 1
+                    stub.pico = max(stub.pico, stub.em_andamento)
+                time.sleep(stub.demora)
+                with stub._trava:
+                    stub.em_andamento -= 1
+                if numero <= stub.falhas:
+                    self.send_response(stub.status_erro)
+                    self.end_headers()
+                    return
+                corpo = json.dumps({"texto": f"resposta {numero}"}).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def log_message(self, *args):
+                pass
+
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", 0), Manipulador)
+        self.url = f"http://127.0.0.1:{self.servidor.server_port}/gerar"
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+
+    def fechar(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+
+class ModeloStub:
+    """Faz o papel de genai.GenerativeModel, chamando o servidor stub por HTTP"""
+
+    def __init__(self, url):
+        self.url = url
+
+    def generate_content(self, prompt, generation_config=None, stream=False, request_options=None):
+        pedido = urllib.request.Request(self.url, data=json.dumps({"prompt": prompt}).encode(), method="POST")
+        try:
+            with urllib.request.urlopen(pedido, timeout=(request_options or {}).get("timeout", 5)) as resposta:
+                texto = json.loads(resposta.read())["texto"]
+        except HTTPError as e:
+            raise (ServiceUnavailable if e.code == 503 else InvalidArgument)(str(e)) from None
+        return SimpleNamespace(text=texto, usage_metadata=None)
+
+
+@pytest.fixture
+def stub():
+    servidores = []
+
+    def criar(**parametros):
+        servidor = ServidorStub(**parametros)
+        servidores.append(servidor)
+        return servidor
+
+    yield criar
+    for servidor in servidores:
+        servidor.fechar()
+
+
+def criarCliente(servidor, **parametros):
+    genai = SimpleNamespace(GenerativeModel=lambda nome: ModeloStub(servidor.url))
+    parametros = {"tentativas": 3, "espera_base": 0.0, "async_nativo": False, **parametros}
+    return ClienteGemini(genai, "stub", {}, **parametros)
+
+
+def test_disjuntor_abre_e_testa_uma_chamada_meio_aberto():
+    disjuntor = DisjuntorCircuito(limite_falhas=2, tempo_aberto=0.05)
+    disjuntor.registrarFalha()
+    assert disjuntor.estado == "fechado" and disjuntor.permitir()
+    disjuntor.registrarFalha()
+    assert disjuntor.estado == "aberto" and not disjuntor.permitir()
+    assert disjuntor.aberturas == 1
+
+    time.sleep(0.06)
+    assert disjuntor.estado == "meio_aberto"
+    assert disjuntor.permitir()
+    assert not disjuntor.permitir()  # só uma chamada de teste por vez
+
+    # Teste falhou: abre de novo pelo mesmo tempo
+    disjuntor.registrarFalha()
+    assert disjuntor.estado == "aberto" and not disjuntor.permitir()
+    assert disjuntor.aberturas == 2
+
+    time.sleep(0.06)
+    assert disjuntor.permitir()
+    disjuntor.registrarSucesso()
+    assert disjuntor.estado == "fechado" and disjuntor.permitir()
+
+
+def test_repete_erros_transitorios_e_nao_os_definitivos(stub):
+    servidor = stub(falhas=2)
+    cliente = criarCliente(servidor)
+    assert cliente.gerar("pergunta") == "resposta 3"
+    assert servidor.pedidos == 3 and cliente.repeticoes == 2
+    assert cliente.disjuntor.estado == "fechado"
+
+    servidor = stub(falhas=1, status_erro=400)
+    cliente = criarCliente(servidor)
+    with pytest.raises(InvalidArgument):
+        cliente.gerar("pergunta")
+    assert servidor.pedidos == 1 and cliente.repeticoes == 0
+
+
+def test_circuito_aberto_recusa_sem_chamar_o_servidor(stub):
+    servidor = stub(falhas=100)
+    cliente = criarCliente(servidor, disjuntor=DisjuntorCircuito(limite_falhas=2, tempo_aberto=60))
+    with pytest.raises(ServiceUnavailable):
+        cliente.gerar("pergunta")
+    # A segunda falha abriu o circuito: não houve terceira tentativa
+    assert servidor.pedidos == 2
+
+    with pytest.raises(CircuitoAberto):
+        cliente.gerar("pergunta")
+    assert servidor.pedidos == 2 and cliente.recusadas == 1
+
+
+def test_semaforo_limita_chamadas_simultaneas(stub):
+    servidor = stub(demora=0.05)
+    cliente = criarCliente(servidor, max_concorrencia=2)
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        respostas = list(executor.map(cliente.gerar, [f"pergunta {i}" for i in range(6)]))
+    assert len(respostas) == 6 and servidor.pico == 2
+
+    async def gerarVarias():
+        return await asyncio.gather(*(cliente.gerarAsync(f"pergunta {i}") for i in range(6)))
+
+    servidor.pico = 0
+    assert len(asyncio.run(gerarVarias())) == 6
+    assert servidor.pico <= 2
+    assert cliente.em_andamento == 0 and cliente.pendentes == 0
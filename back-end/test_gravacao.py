@@ -0,0 +1,97 @@
+from datetime import datetime, timezone
+
+import mongomock
+import pytest
+from pymongo.errors import BulkWriteError
+
+from gravacao import GravadorInteracoes
+
+INSTANTE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class ColecaoSessoes:
+    """Coleção de sessões sobre o mongomock, cujo bulk_write não acompanha o pymongo
+    instalado: aplica cada UpdateOne com update_one, que segue a semântica do $push"""
+
+    def __init__(self, colecao):
+        self.colecao = colecao
+
+    def bulk_write(self, operacoes, ordered=True):
+        for operacao in operacoes:
+            self.colecao.update_one(operacao._filter, operacao._doc, upsert=operacao._upsert)
+
+
+@pytest.fixture
+def banco():
+    banco = mongomock.MongoClient().tekbot
+    banco.sessoes.create_index("sessao_id", unique=True)
+    return banco
+
+
+def interacao(i):
+    return {"pergunta": f"pergunta {i}", "resposta": f"resposta {i}", "timestamp": INSTANTE}
+
+
+def test_parar_grava_o_que_estava_na_fila(banco):
+    sessoes = ColecaoSessoes(banco.sessoes)
+    # Intervalo longo: sem o parar, nada seria gravado durante o teste
+    gravador = GravadorInteracoes(banco.interacoes, sessoes, tamanho_lote=1000, intervalo=60)
+    for i in range(50):
+        gravador.registrar({"pergunta": f"pergunta {i}"})
+        gravador.anexarSessao("sessao_a", interacao(i), limite_historico=100)
+
+    gravador.parar()
+    assert not gravador._thread.is_alive()
+    assert banco.interacoes.count_documents({}) == 50
+    assert banco.sessoes.find_one({"sessao_id": "sessao_a"})["total_interacoes"] == 50
+    assert gravador.estatisticas()["pendentes"] == 0
+    assert gravador.gravados == 51  # 50 registros e um único $push para a sessão
+
+
+def test_parar_sem_thread_grava_direto(banco):
+    gravador = GravadorInteracoes(banco.interacoes, ColecaoSessoes(banco.sessoes))
+    gravador._fila.put(("registro", {"pergunta": "pendente"}))
+    gravador.parar()
+    assert banco.interacoes.count_documents({}) == 1
+
+
+def test_historico_da_sessao_fica_limitado(banco):
+    sessoes = ColecaoSessoes(banco.sessoes)
+    gravador = GravadorInteracoes(banco.interacoes, sessoes, intervalo=0.01)
+    for inicio in (0, 3):  # duas gravações sobre o mesmo documento
+        for i in range(inicio, inicio + 3):
+            gravador.anexarSessao("sessao_b", interacao(i), limite_historico=4)
+        gravador.descarregar(tempo_limite=5)
+    gravador.parar()
+
+    sessao = banco.sessoes.find_one({"sessao_id": "sessao_b"})
+    assert [item["pergunta"] for item in sessao["historico"]] == [f"pergunta {i}" for i in range(2, 6)]
+    assert sessao["total_interacoes"] == 6
+    assert sessao["data_inicio"] == INSTANTE.replace(tzinfo=None)  # o MongoDB devolve UTC sem fuso
+
+
+def test_upsert_duplicado_entre_workers_e_repetido(banco):
+    class ColecaoComCorrida(ColecaoSessoes):
+        """Na primeira gravação, outro worker cria a sessao_a antes do nosso upsert"""
+
+        def __init__(self, colecao):
+            super().__init__(colecao)
+            self.corrida = True
+
+        def bulk_write(self, operacoes, ordered=True):
+            if not self.corrida:
+                return super().bulk_write(operacoes, ordered)
+            self.corrida = False
+            self.colecao.insert_one({"sessao_id": "sessao_a", "historico": [], "total_interacoes": 0})
+            super().bulk_write(operacoes[1:], ordered)
+            raise BulkWriteError({"writeErrors": [{"index": 0, "code": 11000, "errmsg": "E11000 duplicate key"}],
+                                  "nInserted": 0, "nUpserted": len(operacoes) - 1})
+
+    gravador = GravadorInteracoes(banco.interacoes, ColecaoComCorrida(banco.sessoes))
+    gravador.anexarSessao("sessao_a", interacao(0), limite_historico=10)
+    gravador.anexarSessao("sessao_b", interacao(1), limite_historico=10)
+    gravador.parar()
+
+    assert gravador.falhas == 0 and gravador.gravados == 2
+    for sessao_id in ("sessao_a", "sessao_b"):
+        assert banco.sessoes.find_one({"sessao_id": sessao_id})["total_interacoes"] == 1
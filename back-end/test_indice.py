@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from indice import IndiceVetorial, IndiceIVF, normalizarVetores
+
+# Vetores sintéticos: nenhum teste depende do modelo de embeddings nem do MongoDB
+DIMENSAO = 16
+TOTAL = 300
+INSTANTE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def criarBase(n=TOTAL, semente=7):
+    rng = np.random.default_rng(semente)
+    documentos = [
+        {"_id": f"d{i}", "pergunta": f"pergunta {i}", "resposta": f"resposta {i}", "atualizado_em": INSTANTE}
+        for i in range(n)
+    ]
+    return documentos, rng.standard_normal((n, DIMENSAO)).astype(np.float32)
+
+
+def vetorAleatorio(semente):
+    return np.random.default_rng(semente).standard_normal(DIMENSAO).astype(np.float32)
+
+
+@pytest.fixture(params=["exato", "ivf"])
+def indice(request):
+    # Sondando todas as listas o IVF devolve o mesmo que a busca exata
+    if request.param == "ivf":
+        indice = IndiceIVF(n_listas=8, n_sondagens=8, minimo_documentos=100)
+    else:
+        indice = IndiceVetorial()
+    documentos, vetores = criarBase()
+    indice.construir(documentos, vetores)
+    return indice, vetores
+
+
+def melhor(indice, vetor):
+    resultados = indice.buscar(vetor, k=1, limiar=0.0)
+    return resultados[0][0] if resultados else None
+
+
+def test_adicionar_editar_remover_e_buscar(indice):
+    indice, vetores = indice
+    novo = vetorAleatorio(1)
+
+    assert indice.adicionar({"_id": "n1", "pergunta": "nova", "resposta": "primeira",
+                             "atualizado_em": INSTANTE + timedelta(seconds=1)}, novo)
+    assert melhor(indice, novo)["resposta"] == "primeira"
+    assert len(indice) == TOTAL + 1
+
+    # Edição: o mesmo _id com versão mais nova substitui texto e vetor
+    editado = vetorAleatorio(2)
+    assert indice.adicionar({"_id": "n1", "pergunta": "nova", "resposta": "editada",
+                             "atualizado_em": INSTANTE + timedelta(seconds=2)}, editado)
+    assert melhor(indice, editado)["resposta"] == "editada"
+    assert all(doc["resposta"] != "primeira" for doc, _ in indice.buscar(novo, k=TOTAL + 1, limiar=-1.0))
+    assert len(indice) == TOTAL + 1
+
+    # Edição de um documento da base e remoção de outro
+    assert indice.adicionar({"_id": "d5", "pergunta": "pergunta 5", "resposta": "base editada",
+                             "atualizado_em": INSTANTE + timedelta(seconds=3)}, vetores[5])
+    assert melhor(indice, vetores[5])["resposta"] == "base editada"
+    assert indice.remover("d6", INSTANTE.timestamp() + 4)
+    assert melhor(indice, vetores[6])["_id"] != "d6"
+    assert not indice.remover("d6")
+    assert len(indice) == TOTAL
+
+
+def test_versao_antiga_e_ignorada(indice):
+    indice, vetores = indice
+    assert not indice.adicionar({"_id": "d3", "pergunta": "pergunta 3", "resposta": "atrasada",
+                                 "atualizado_em": INSTANTE - timedelta(seconds=1)}, vetorAleatorio(3))
+    assert not indice.adicionar({"_id": "d3", "pergunta": "pergunta 3", "resposta": "mesma versão",
+                                 "atualizado_em": INSTANTE}, vetorAleatorio(3))
+    assert melhor(indice, vetores[3])["resposta"] == "resposta 3"
+
+
+def test_compactacao_preserva_ids_e_linhas(indice):
+    indice, vetores = indice
+    esperados = {f"d{i}": vetores[i] for i in range(TOTAL)}
+    for i in range(20):
+        esperados[f"n{i}"] = vetorAleatorio(100 + i)
+        indice.adicionar({"_id": f"n{i}", "pergunta": f"nova {i}", "resposta": f"nova {i}",
+                          "atualizado_em": INSTANTE + timedelta(seconds=1)}, esperados[f"n{i}"])
+    for i in range(0, 40, 4):
+        indice.remover(f"d{i}")
+        del esperados[f"d{i}"]
+
+    indice.compactar()
+
+    estado = indice._estado
+    assert estado.n_delta == 0 and indice._removidos == 0
+    assert len(indice) == len(esperados) == len(estado.documentos)
+    for chave, vetor in esperados.items():
+        no_delta, linha, _ = indice._localizacao[chave]
+        assert not no_delta
+        assert estado.documentos[linha]["_id"] == chave
+        np.testing.assert_allclose(estado.matriz[linha], normalizarVetores(vetor)[0], rtol=1e-5, atol=1e-6)
+        assert melhor(indice, vetor)["_id"] == chave
+
+
+def test_snapshot_mapeado_busca_igual(indice, tmp_path):
+    indice, vetores = indice
+    indice.adicionar({"_id": "n1", "pergunta": "nova", "resposta": "do delta",
+                      "atualizado_em": INSTANTE + timedelta(seconds=1)}, vetorAleatorio(1))
+    indice.remover("d2")
+    caminho = str(tmp_path / "base.snap")
+    indice.exportarSnapshot(caminho, modelo_embedding="sintetico")
+
+    mapeado = type(indice)() if type(indice) is IndiceVetorial else IndiceIVF(n_sondagens=8)
+    cabecalho = mapeado.mapearSnapshot(caminho)
+    assert mapeado.mapeado and cabecalho["documentos"] == len(indice) == len(mapeado)
+
+    consultas = np.vstack([vetores[:50], vetorAleatorio(1)[None, :], vetorAleatorio(9)[None, :]])
+    for consulta in consultas:
+        antes = [(doc["_id"], doc["resposta"], round(similaridade, 5))
+                 for doc, similaridade in indice.buscar(consulta, k=5, limiar=0.0)]
+        depois = [(doc["_id"], doc["resposta"], round(similaridade, 5))
+                  for doc, similaridade in mapeado.buscar(consulta, k=5, limiar=0.0)]
+        assert antes == depois
+    assert [[doc["_id"] for doc, _ in r] for r in indice.buscarLote(consultas, k=5, limiar=0.0)] == \
+        [[doc["_id"] for doc, _ in r] for r in mapeado.buscarLote(consultas, k=5, limiar=0.0)]
+
+
+def test_busca_hibrida_poda_e_prioriza_cosseno(indice):
+    indice, vetores = indice
+    indice.adicionar({"_id": "n1", "pergunta": "rejeicao danfe cte", "resposta": "lexica",
+                      "atualizado_em": INSTANTE + timedelta(seconds=1)}, vetorAleatorio(1))
+
+    # Com peso maior no BM25, o documento do termo raro entra mesmo longe no cosseno
+    resultados = indice.buscarHibrido("danfe pergunta 7", vetores[7], k=5, limiar=-1.0, peso_vetor=0.3)
+    assert resultados[0][0]["_id"] == "d7"
+    assert "n1" in [doc["_id"] for doc, _ in resultados]
+    similaridades = [similaridade for _, similaridade in resultados]
+    assert similaridades[0] == max(similaridades)
+
+    # Sem candidato acima do limiar, cai na busca vetorial completa
+    assert indice.buscarHibrido("termoinexistente", vetores[9], k=1, limiar=0.5)[0][0]["_id"] == "d9"
@@ -2,6 +2,21 @@ const chat = document.getElementById("chat");
 const form = document.getElementById("chat-form");
 const input = document.getElementById("user-input");
 
+// Identifica a conversa no servidor: pelo token do login ou, sem ele, por um id desta aba
+function cabecalhosSessao() {
+  const cabecalhos = { "Content-Type": "application/json" };
+  const token = localStorage.getItem("token");
+  if (token) cabecalhos["Authorization"] = `Bearer ${token}`;
+
+  let sessaoId = sessionStorage.getItem("sessaoId");
+  if (!sessaoId) {
+    sessaoId = crypto.randomUUID ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    sessionStorage.setItem("sessaoId", sessaoId);
+  }
+  cabecalhos["X-Sessao-Id"] = sessaoId;
+  return cabecalhos;
+}
+
 // Exibe mensagem de boas-vindas ao abrir a tela
 window.addEventListener("DOMContentLoaded", () => {
   appendMessage("Olá! Eu sou o <strong>TekBot</strong> e estou aqui para te ajudar!", "left");
@@ -19,22 +34,80 @@ form.addEventListener("submit", async (e) => {
   const digitando = appendTypingMessage();
 
   try {
-    const { data } = await axios.post("http://localhost:8000/ia/responder", {
-      pergunta: msg,
+    // Resposta em streaming: o texto aparece à medida que a IA o produz
+    const resposta = await fetch("http://localhost:8000/ia/responder/stream", {
+      method: "POST",
+      headers: cabecalhosSessao(),
+      body: JSON.stringify({ pergunta: msg }),
     });
+    if (!resposta.ok || !resposta.body) throw new Error(`HTTP ${resposta.status}`);
 
-    chat.removeChild(digitando);
+    let bolha = null;
+    let texto = "";
 
-    // Converte \n em <br>
-    const respostaFormatada = data.resposta.replace(/\\n|\\r\\n|\\\\n|\n/g, "<br>");
-    appendMessage(respostaFormatada, "left");
+    await lerEventos(resposta.body, (evento, dados) => {
+      if (evento === "trecho") {
+        if (!bolha) {
+          chat.removeChild(digitando);
+          bolha = appendMessage("", "left").querySelector(".message-bubble");
+        }
+        texto += dados.texto;
+        bolha.innerHTML = formatarResposta(texto);
+        chat.scrollTop = chat.scrollHeight;
+      } else if (evento === "erro") {
+        throw new Error(dados.detalhe);
+      }
+    });
+
+    if (!bolha) throw new Error("Resposta vazia");
   } catch (error) {
     console.error("Erro ao chamar a IA:", error);
-    chat.removeChild(digitando);
+    if (digitando.parentNode) chat.removeChild(digitando);
     appendMessage("Erro ao processar a pergunta. Tente novamente.", "left");
   }
 });
 
+/**
+ * Lê um corpo text/event-stream e chama o callback para cada evento completo.
+ * @param {ReadableStream} corpo
+ * @param {(evento: string, dados: object) => void} aoReceber
+ */
+async function lerEventos(corpo, aoReceber) {
+  const leitor = corpo.getReader();
+  const decodificador = new TextDecoder();
+  let pendente = "";
+
+  while (true) {
+    const { value, done } = await leitor.read();
+    if (done) break;
+    pendente += decodificador.decode(value, { stream: true });
+
+    // Eventos SSE são separados por uma linha em branco
+    let fim;
+    while ((fim = pendente.indexOf("\n\n")) !== -1) {
+      const bloco = pendente.slice(0, fim);
+      pendente = pendente.slice(fim + 2);
+
+      let evento = "message";
+      let dados = "";
+      for (const linha of bloco.split("\n")) {
+        if (linha.startsWith("event:")) evento = linha.slice(6).trim();
+        else if (linha.startsWith("data:")) dados += linha.slice(5).trim();
+      }
+      aoReceber(evento, dados ? JSON.parse(dados) : {});
+    }
+  }
+}
+
+/**
+ * Converte \n em <br>.
+ * @param {string} texto
+ * @returns {string}
+ */
+function formatarResposta(texto) {
+  return texto.replace(/\\n|\\r\\n|\\\\n|\n/g, "<br>");
+}
+
 /**
  * Cria e anexa uma mensagem padrão ao chat.
  * @param {string} message
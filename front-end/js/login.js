@@ -15,6 +15,8 @@ form.addEventListener("submit", async (e) => {
             senha: senha
         });
 
+        // O token identifica a conversa do usuário no chat
+        localStorage.setItem("token", response.data.access_token);
         window.location = 'http://127.0.0.1:8000/html/chat.html';
     } catch (error) {
         Swal.fire({